@@ -0,0 +1,246 @@
+"""
+Content-addressed cache of GigaChat completions.
+
+Repeated requests (``/summary`` pressed again after a failure, the CLI run
+on the same file, identical map-reduce chunks) return the stored answer
+instead of a new paid completion. The key is a hash of the model, the
+roles and the normalized texts (Unicode NFC, line endings and trailing
+whitespace), so the system prompt is part of it.
+
+Two tiers: an in-memory LRU (GIGACHAT_CACHE_MEMORY_ITEMS) in front of a
+SQLite file (GIGACHAT_CACHE_PATH) shared by the bot and the CLI. Entries
+older than GIGACHAT_CACHE_TTL_DAYS are ignored and deleted; above
+GIGACHAT_CACHE_MAX_MB the least recently used ones are evicted. A broken
+cache file only disables the persistent tier, it never fails a request.
+"""
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("gigachat.cache")
+
+# Bump when the key or the stored format changes
+KEY_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS completions (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    content TEXT NOT NULL,
+    usage TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS completions_lru ON completions (last_access);
+"""
+
+
+def normalize(text: str) -> str:
+    """Text as it matters for the answer: NFC, \\n line endings, no trailing spaces."""
+    text = unicodedata.normalize("NFC", text).replace("\r\n", "\n").replace("\r", "\n")
+    return "\n".join(line.rstrip() for line in text.split("\n")).strip()
+
+
+def cache_key(messages: List[Dict[str, str]], model: str) -> str:
+    payload = [KEY_VERSION, model, [[m["role"], normalize(m["content"])] for m in messages]]
+    raw = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """Two-tier (memory LRU + SQLite) cache of {content, model, usage} results."""
+
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        memory_items: int = 256,
+        max_bytes: int = 50 * 1024 * 1024,
+        max_age: float = 30 * 86400,
+        evict_every: int = 100,
+    ) -> None:
+        self.path = path
+        self.memory_items = memory_items
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.evict_every = evict_every
+        # key -> (created, result)
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._puts = 0
+        self.metrics = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evicted": 0,
+            "tokens_saved": 0,
+        }
+        if self.path is not None:
+            self.evict()
+
+    # Persistent tier
+
+    def _conn(self) -> Optional[sqlite3.Connection]:
+        if self.path is None:
+            return None
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                conn = sqlite3.connect(self.path, isolation_level=None, timeout=5)
+                conn.execute("PRAGMA journal_mode = WAL")
+                conn.execute("PRAGMA synchronous = NORMAL")
+                conn.executescript(SCHEMA)
+            except (OSError, sqlite3.Error) as exc:
+                logger.warning("Кэш ответов %s недоступен, работаем только в памяти: %s", self.path, exc)
+                self.path = None
+                return None
+            self._local.conn = conn
+        return conn
+
+    def _disk_get(self, key: str, now: float) -> Optional[Tuple[float, Dict[str, Any]]]:
+        conn = self._conn()
+        if conn is None:
+            return None
+        try:
+            row = conn.execute(
+                "UPDATE completions SET last_access = ? WHERE key = ? AND created > ? "
+                "RETURNING model, content, usage, created",
+                (now, key, now - self.max_age),
+            ).fetchone()
+        except sqlite3.Error as exc:
+            logger.warning("Ошибка чтения кэша ответов: %s", exc)
+            return None
+        if row is None:
+            return None
+        model, content, usage, created = row
+        return created, {"content": content, "model": model, "usage": json.loads(usage)}
+
+    def _disk_put(self, key: str, result: Dict[str, Any], now: float) -> None:
+        conn = self._conn()
+        if conn is None:
+            return
+        usage = json.dumps(result.get("usage") or {})
+        size = len(key) + len(result["content"].encode("utf-8")) + len(usage)
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, result["model"], result["content"], usage, size, now, now),
+            )
+        except sqlite3.Error as exc:
+            logger.warning("Ошибка записи в кэш ответов: %s", exc)
+
+    def evict(self) -> int:
+        """Delete expired entries, then the least recently used ones above max_bytes."""
+        conn = self._conn()
+        if conn is None:
+            return 0
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                removed = conn.execute(
+                    "DELETE FROM completions WHERE created <= ?", (time.time() - self.max_age,)
+                ).rowcount
+                excess = conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0] - self.max_bytes
+                if excess > 0:
+                    victims = []
+                    for key, size in conn.execute("SELECT key, size FROM completions ORDER BY last_access"):
+                        victims.append((key,))
+                        excess -= size
+                        if excess <= 0:
+                            break
+                    conn.executemany("DELETE FROM completions WHERE key = ?", victims)
+                    removed += len(victims)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as exc:
+            logger.warning("Ошибка очистки кэша ответов: %s", exc)
+            return 0
+        if removed:
+            logger.info("Кэш ответов: удалено %d записей", removed)
+        with self._lock:
+            self.metrics["evicted"] += removed
+        return removed
+
+    # Public API
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Cached result or None. A hit costs no tokens, so it is returned with
+        empty usage and "cached": True; the tokens of the original request
+        are counted in metrics["tokens_saved"].
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[0] > now - self.max_age:
+                self._memory.move_to_end(key)
+                tier = "memory_hits"
+            else:
+                entry, tier = None, "disk_hits"
+        if entry is None:
+            entry = self._disk_get(key, now)
+            if entry is not None:
+                self._remember(key, entry)
+        with self._lock:
+            if entry is None:
+                self.metrics["misses"] += 1
+                return None
+            self.metrics[tier] += 1
+            self.metrics["tokens_saved"] += int(entry[1]["usage"].get("total_tokens") or 0)
+        return {"content": entry[1]["content"], "model": entry[1]["model"], "usage": {}, "cached": True}
+
+    def put(self, key: str, result: Dict[str, Any]) -> None:
+        now = time.time()
+        stored = {"content": result["content"], "model": result["model"], "usage": result.get("usage") or {}}
+        self._remember(key, (now, stored))
+        self._disk_put(key, stored, now)
+        with self._lock:
+            self.metrics["stores"] += 1
+            self._puts += 1
+            evict = self._puts % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    def _remember(self, key: str, entry: Tuple[float, Dict[str, Any]]) -> None:
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+        conn = self._conn()
+        if conn is not None:
+            conn.execute("DELETE FROM completions")
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters of this process plus the size of the persistent tier."""
+        with self._lock:
+            stats: Dict[str, Any] = dict(self.metrics)
+            stats["memory_entries"] = len(self._memory)
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = round(hits / lookups, 3) if lookups else 0.0
+        conn = self._conn()
+        if conn is not None:
+            try:
+                stats["disk_entries"], stats["disk_bytes"] = conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions"
+                ).fetchone()
+            except sqlite3.Error:
+                pass
+        return stats
@@ -1,14 +1,35 @@
+import email.utils
+import hashlib
+import json
 import logging
 import os
+import random
+import threading
+import time
 import uuid
-from typing import Any, Dict
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
 
+from completion_cache import CompletionCache, cache_key
+from token_manager import Token, TokenManager
 from utils import encode_basic_auth
 
 logger = logging.getLogger("gigachat.api")
 
+OAUTH_URL = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
+API_URL = "https://gigachat.devices.sberbank.ru/api/v1"
+DEFAULT_MODEL = "GigaChat"
+SUMMARY_SYSTEM_PROMPT = "Ты – ассистент, который делает краткие выжимки текста."
+ASK_SYSTEM_PROMPT = "Ты — дружелюбный ассистент. Отвечай кратко и по делу."
+
+# Transient statuses worth retrying
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
 
 class GigaChatError(Exception):
     """Base exception for GigaChat API issues."""
@@ -30,103 +51,413 @@ def _get_verify_flag() -> bool | str:
     return verify_env.lower() in {"1", "true", "yes", "y"}
 
 
-def get_access_token() -> str:
+def _env_number(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def _retry_after(resp: Any) -> Optional[float]:
+    """Seconds from a Retry-After header (delta-seconds or HTTP date)."""
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _json_body(resp: Any) -> Dict[str, Any]:
+    """Response body as JSON; GigaChatError for anything else (e.g. a proxy error page)."""
+    try:
+        return resp.json()
+    except ValueError as exc:
+        raise GigaChatError(f"Ответ GigaChat не в формате JSON: {resp.text[:200]}") from exc
+
+
+def _token_cache_key() -> str:
+    # Токены разных учётных данных/scope в общем файле не смешиваются
+    raw = f"{os.getenv('CLIENT_ID')}:{os.getenv('GIGACHAT_SCOPE', 'GIGACHAT_API_PERS')}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def parse_completion(data: Dict[str, Any], model: str) -> Dict[str, Any]:
+    """chat/completions response -> {content, model, usage}."""
+    try:
+        content = data["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError) as exc:
+        raise GigaChatError(f"Непредвиденный формат ответа: {data}") from exc
+    return {
+        "content": content,
+        "model": data.get("model") or model,
+        "usage": data.get("usage") or {},
+    }
+
+
+class RetryPolicy:
     """
-    Obtain OAuth access token using CLIENT_ID and CLIENT_SECRET from env.
+    When and how long to wait before retrying a request: exponential backoff
+    with full jitter on 429/5xx and network errors, Retry-After honored.
+    Shared by GigaChatClient and AsyncGigaChatClient, which only send and
+    sleep differently.
+
+    Defaults come from env: GIGACHAT_MAX_RETRIES, GIGACHAT_BACKOFF_BASE,
+    GIGACHAT_BACKOFF_MAX (seconds).
     """
-    client_id = os.getenv("CLIENT_ID")
-    client_secret = os.getenv("CLIENT_SECRET")
-    if not client_id or not client_secret:
-        raise GigaChatError("CLIENT_ID или CLIENT_SECRET не заданы в .env")
 
-    # Official OAuth endpoint
-    url = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
-    headers = {
-        "Content-Type": "application/x-www-form-urlencoded",
-        "Accept": "application/json",
-        "Authorization": f"Basic {encode_basic_auth(client_id, client_secret)}",
-        "RqUID": str(uuid.uuid4()),
-    }
-    scope = os.getenv("GIGACHAT_SCOPE", "GIGACHAT_API_PERS")
-    payload = {"scope": scope}
+    def __init__(
+        self,
+        max_retries: Optional[int] = None,
+        backoff_base: Optional[float] = None,
+        backoff_max: Optional[float] = None,
+    ) -> None:
+        self.max_retries = int(max_retries if max_retries is not None else _env_number("GIGACHAT_MAX_RETRIES", 3))
+        self.backoff_base = backoff_base or _env_number("GIGACHAT_BACKOFF_BASE", 0.5)
+        self.backoff_max = backoff_max or _env_number("GIGACHAT_BACKOFF_MAX", 30)
 
-    logger.info("Запрашиваем OAuth токен")
-    verify = _get_verify_flag()
-    resp = requests.post(url, data=payload, headers=headers, timeout=30, verify=verify)
-    if resp.status_code != 200:
-        raise GigaChatError(f"OAuth error {resp.status_code}: {resp.text}")
+    def backoff(self, attempt: int) -> float:
+        # "Full jitter": spreads retries of concurrent callers
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
 
-    data = resp.json()
-    token = data.get("access_token")
-    if not token:
-        raise GigaChatError("Не удалось получить access_token из ответа OAuth")
-    return token
+    def after_error(self, attempt: int, exc: Exception) -> float:
+        """Delay before retrying a network error; GigaChatError once attempts are used up."""
+        if attempt >= self.max_retries:
+            raise GigaChatError(f"Сетевая ошибка GigaChat: {exc}") from exc
+        delay = self.backoff(attempt)
+        logger.warning("Сетевая ошибка (%s), повтор через %.1f с", exc.__class__.__name__, delay)
+        return delay
 
+    def after_response(self, attempt: int, resp: Any) -> Optional[float]:
+        """Delay before retrying a response, or None to return it as is."""
+        if resp.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+            return None
+        retry_after = _retry_after(resp)
+        if retry_after is not None and retry_after > self.backoff_max:
+            # Ждать дольше, чем мы готовы, нет смысла — отдаём ошибку
+            return None
+        delay = retry_after if retry_after is not None else self.backoff(attempt)
+        logger.warning("GigaChat ответил %s, повтор через %.1f с", resp.status_code, delay)
+        return delay
 
-def generate_summary(text: str) -> str:
+
+class GigaChatClient:
     """
-    Send text to GigaChat chat/completions and return summary.
+    Shared GigaChat client: one keep-alive connection pool for OAuth and
+    completions, retries of transient failures (see RetryPolicy), separate
+    connect/read timeouts and the cached OAuth token.
+
+    Defaults come from env: GIGACHAT_POOL_SIZE, GIGACHAT_CONNECT_TIMEOUT,
+    GIGACHAT_READ_TIMEOUT (seconds).
     """
-    token = get_access_token()
-    url = "https://gigachat.devices.sberbank.ru/api/v1/chat/completions"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {token}",
-    }
-    payload: Dict[str, Any] = {
-        "model": "GigaChat",
-        "messages": [
-            {
-                "role": "system",
-                "content": "Ты – ассистент, который делает краткие выжимки текста.",
-            },
-            {"role": "user", "content": text},
-        ],
-    }
 
-    logger.info("Отправляем текст в GigaChat на саммаризацию")
-    verify = _get_verify_flag()
-    resp = requests.post(url, json=payload, headers=headers, timeout=60, verify=verify)
-    if resp.status_code != 200:
-        raise GigaChatError(f"GigaChat error {resp.status_code}: {resp.text}")
+    def __init__(
+        self,
+        pool_size: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        backoff_base: Optional[float] = None,
+        backoff_max: Optional[float] = None,
+    ) -> None:
+        self.pool_size = int(pool_size or _env_number("GIGACHAT_POOL_SIZE", 10))
+        self.timeout = (
+            connect_timeout or _env_number("GIGACHAT_CONNECT_TIMEOUT", 5),
+            read_timeout or _env_number("GIGACHAT_READ_TIMEOUT", 60),
+        )
+        self.retry = RetryPolicy(max_retries, backoff_base, backoff_max)
 
-    data = resp.json()
-    try:
-        return data["choices"][0]["message"]["content"]
-    except (KeyError, IndexError) as exc:
-        raise GigaChatError(f"Непредвиденный формат ответа: {data}") from exc
+        self.session = requests.Session()
+        # Retries are done by _request (Retry-After, jitter, logging), not urllib3
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=self.pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.verify = _get_verify_flag()
+        self.cache = get_cache()
+
+        cache_path = os.getenv("GIGACHAT_TOKEN_CACHE")
+        # Бот, CLI и скрипты запускаются из разных каталогов: путь от корня проекта
+        self.tokens = TokenManager(
+            self.fetch_token,
+            cache_path=ROOT_DIR / cache_path if cache_path else None,
+            cache_key=_token_cache_key(),
+        )
+
+    def _request(self, method: str, url: str, **kwargs: Any) -> requests.Response:
+        """Send a request, retrying transient failures; other responses are returned as is."""
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        while True:
+            try:
+                resp = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                delay = self.retry.after_error(attempt, exc)
+            else:
+                delay = self.retry.after_response(attempt, resp)
+                if delay is None:
+                    return resp
+                # Return the connection to the pool (matters for streamed responses)
+                resp.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def fetch_token(self) -> Token:
+        """
+        Request a new OAuth access token using CLIENT_ID and CLIENT_SECRET from env.
+        Returns {"access_token", "expires_at"} (expires_at in epoch seconds).
+        """
+        client_id = os.getenv("CLIENT_ID")
+        client_secret = os.getenv("CLIENT_SECRET")
+        if not client_id or not client_secret:
+            raise GigaChatError("CLIENT_ID или CLIENT_SECRET не заданы в .env")
+
+        headers = {
+            "Content-Type": "application/x-www-form-urlencoded",
+            "Accept": "application/json",
+            "Authorization": f"Basic {encode_basic_auth(client_id, client_secret)}",
+            "RqUID": str(uuid.uuid4()),
+        }
+        scope = os.getenv("GIGACHAT_SCOPE", "GIGACHAT_API_PERS")
+
+        logger.info("Запрашиваем OAuth токен")
+        resp = self._request("POST", OAUTH_URL, data={"scope": scope}, headers=headers)
+        if resp.status_code != 200:
+            raise GigaChatError(f"OAuth error {resp.status_code}: {resp.text}")
+
+        data = _json_body(resp)
+        token = data.get("access_token")
+        if not token:
+            raise GigaChatError("Не удалось получить access_token из ответа OAuth")
+        # expires_at приходит в миллисекундах; без него считаем стандартные 30 минут
+        expires_at = float(data.get("expires_at") or 0) / 1000 or time.time() + 30 * 60
+        return {"access_token": token, "expires_at": expires_at}
 
+    def _post_completions(self, payload: Dict[str, Any], stream: bool = False) -> requests.Response:
+        """
+        POST chat/completions with the cached token. A 401 (token revoked or
+        expired early) triggers a single token refresh and retry.
+        """
+        url = f"{API_URL}/chat/completions"
 
-def ask_gigachat(
-    user_text: str,
-    system_prompt: str = "Ты — дружелюбный ассистент. Отвечай кратко и по делу.",
-) -> str:
+        def post(token: str) -> requests.Response:
+            headers = {
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {token}",
+            }
+            if stream:
+                headers["Accept"] = "text/event-stream"
+            return self._request("POST", url, json=payload, headers=headers, stream=stream)
+
+        token = self.tokens.get()
+        resp = post(token)
+        if resp.status_code == 401:
+            logger.warning("GigaChat отклонил токен (401), обновляем и повторяем запрос")
+            resp.close()
+            self.tokens.invalidate(token)
+            resp = post(self.tokens.get())
+        if resp.status_code != 200:
+            raise GigaChatError(f"GigaChat error {resp.status_code}: {resp.text}")
+        return resp
+
+    def completions(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """POST chat/completions and return the JSON response."""
+        return _json_body(self._post_completions(payload))
+
+    def chat(
+        self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL, use_cache: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Run a chat completion; returns {content, model, usage}. An identical
+        earlier request is answered from the cache ("cached": True, empty usage).
+        """
+        key = cache_key(messages, model) if use_cache and self.cache is not None else None
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                logger.info("Ответ взят из кэша")
+                return cached
+        result = parse_completion(self.completions({"model": model, "messages": messages}), model)
+        if key is not None:
+            self.cache.put(key, result)
+        return result
+
+    def stream_chat(
+        self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL, use_cache: bool = True
+    ) -> "ChatStream":
+        """Streaming chat completion: iterate the result for content deltas."""
+        return ChatStream(self, messages, model, use_cache)
+
+
+class ChatStream:
     """
-    Отправить произвольный запрос в GigaChat и вернуть ответ.
+    Chat completion in streaming (SSE) mode. Iterating yields content
+    deltas as GigaChat generates them; once exhausted, ``result`` holds
+    {content, model, usage} like GigaChatClient.chat and ``first_token_ms``
+    the time to the first delta. Transient errors are retried only before
+    the stream starts; a broken stream raises GigaChatError.
     """
-    token = get_access_token()
-    url = "https://gigachat.devices.sberbank.ru/api/v1/chat/completions"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {token}",
-    }
-    payload: Dict[str, Any] = {
-        "model": "GigaChat",
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_text},
-        ],
-    }
 
-    logger.info("Отправляем произвольный запрос в GigaChat")
-    verify = _get_verify_flag()
-    resp = requests.post(url, json=payload, headers=headers, timeout=60, verify=verify)
-    if resp.status_code != 200:
-        raise GigaChatError(f"GigaChat error {resp.status_code}: {resp.text}")
+    def __init__(self, client: GigaChatClient, messages: List[Dict[str, str]], model: str, use_cache: bool) -> None:
+        self.client = client
+        self.messages = messages
+        self.model = model
+        self.use_cache = use_cache
+        self.result: Optional[Dict[str, Any]] = None
+        self.first_token_ms: Optional[int] = None
 
-    data = resp.json()
-    try:
-        return data["choices"][0]["message"]["content"]
-    except (KeyError, IndexError) as exc:
-        raise GigaChatError(f"Непредвиденный формат ответа: {data}") from exc
+    def __iter__(self) -> Iterator[str]:
+        started = time.monotonic()
+        cache = self.client.cache if self.use_cache else None
+        key = cache_key(self.messages, self.model) if cache is not None else None
+        if key is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                logger.info("Ответ взят из кэша")
+                self.first_token_ms = int((time.monotonic() - started) * 1000)
+                self.result = cached
+                yield cached["content"]
+                return
+
+        resp = self.client._post_completions(
+            {"model": self.model, "messages": self.messages, "stream": True}, stream=True
+        )
+        parts: List[str] = []
+        model, usage = self.model, {}
+        try:
+            for data in _sse_data(resp):
+                model = data.get("model") or model
+                usage = data.get("usage") or usage
+                choices = data.get("choices") or [{}]
+                delta = (choices[0].get("delta") or {}).get("content")
+                if delta:
+                    if self.first_token_ms is None:
+                        self.first_token_ms = int((time.monotonic() - started) * 1000)
+                        logger.info("Первый фрагмент ответа через %d мс", self.first_token_ms)
+                    parts.append(delta)
+                    yield delta
+        except (requests.RequestException, ValueError) as exc:
+            raise GigaChatError(f"Поток ответа GigaChat прерван: {exc!r}") from exc
+        finally:
+            resp.close()
+
+        self.result = {"content": "".join(parts), "model": model, "usage": usage}
+        if key is not None:
+            cache.put(key, self.result)
+
+
+def _sse_data(resp: requests.Response) -> Iterator[Dict[str, Any]]:
+    """JSON payloads of the ``data:`` lines of a server-sent events response, up to [DONE]."""
+    for line in resp.iter_lines():
+        if not line.startswith(b"data:"):
+            continue
+        payload = line[5:].strip()
+        if payload == b"[DONE]":
+            return
+        try:
+            data = json.loads(payload)
+        except ValueError as exc:
+            raise GigaChatError(f"Непредвиденный фрагмент потока: {payload[:200]!r}") from exc
+        yield data
+
+
+def build_messages(user_text: str, system_prompt: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_text},
+    ]
+
+
+_client: Optional[GigaChatClient] = None
+_client_lock = threading.Lock()
+_cache: Optional[CompletionCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[CompletionCache]:
+    """
+    Process-wide completion cache, or None when GIGACHAT_CACHE=false.
+    GIGACHAT_CACHE_PATH (from the project root, default .gigachat_cache.db;
+    empty keeps the cache in memory only), GIGACHAT_CACHE_MEMORY_ITEMS,
+    GIGACHAT_CACHE_MAX_MB and GIGACHAT_CACHE_TTL_DAYS configure it.
+    """
+    global _cache
+    if os.getenv("GIGACHAT_CACHE", "true").lower() not in {"1", "true", "yes", "y"}:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                path = os.getenv("GIGACHAT_CACHE_PATH", ".gigachat_cache.db")
+                _cache = CompletionCache(
+                    ROOT_DIR / path if path else None,
+                    memory_items=int(_env_number("GIGACHAT_CACHE_MEMORY_ITEMS", 256)),
+                    max_bytes=int(_env_number("GIGACHAT_CACHE_MAX_MB", 50) * 1024 * 1024),
+                    max_age=_env_number("GIGACHAT_CACHE_TTL_DAYS", 30) * 86400,
+                )
+    return _cache
+
+
+def get_client() -> GigaChatClient:
+    """Process-wide client (created on first use, after .env is loaded)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = GigaChatClient()
+    return _client
+
+
+def get_token_manager() -> TokenManager:
+    """
+    Shared token cache of the process. GIGACHAT_TOKEN_CACHE (file path)
+    enables sharing the token with other processes.
+    """
+    return get_client().tokens
+
+
+def fetch_access_token() -> Token:
+    """Request a new OAuth token, bypassing the cache."""
+    return get_client().fetch_token()
+
+
+def get_access_token(force_refresh: bool = False) -> str:
+    """
+    Return a valid OAuth access token, cached until shortly before expiry.
+    """
+    manager = get_token_manager()
+    return manager.refresh() if force_refresh else manager.get()
+
+
+def generate_summary_details(text: str) -> Dict[str, Any]:
+    """
+    Send text to GigaChat chat/completions and return summary with metadata.
+
+    Returns dict with keys: content, model, usage (prompt/completion/total tokens).
+    """
+    logger.info("Отправляем текст в GigaChat на саммаризацию")
+    return get_client().chat(build_messages(text, SUMMARY_SYSTEM_PROMPT))
+
+
+def stream_summary(text: str) -> ChatStream:
+    """
+    Summary of the text in streaming mode: iterate for content deltas,
+    then read ``result`` (content, model, usage).
+    """
+    logger.info("Отправляем текст в GigaChat на саммаризацию (потоково)")
+    return get_client().stream_chat(build_messages(text, SUMMARY_SYSTEM_PROMPT))
 
+
+def generate_summary(text: str) -> str:
+    """
+    Send text to GigaChat chat/completions and return summary.
+    """
+    return generate_summary_details(text)["content"]
+
+
+def ask_gigachat(user_text: str, system_prompt: str = ASK_SYSTEM_PROMPT) -> str:
+    """
+    Отправить произвольный запрос в GigaChat и вернуть ответ.
+    """
+    logger.info("Отправляем произвольный запрос в GigaChat")
+    return get_client().chat(build_messages(user_text, system_prompt))["content"]
@@ -0,0 +1,192 @@
+"""
+Asyncio GigaChat client.
+
+Same API surface as gigachat.py (``agenerate_summary``,
+``agenerate_summary_details``, ``aask``) on httpx's non-blocking client, so
+an event loop (the Telethon process, an async bot) can keep many
+completions in flight without threads. A global limiter
+(GIGACHAT_MAX_CONCURRENCY) bounds the number of concurrent requests per
+event loop; ``asummarize_many`` summarizes a batch concurrently, keeping
+the input order and returning per-item errors instead of failing the batch.
+
+The OAuth token, the completion cache and the RetryPolicy are shared with
+the blocking client. The CLI uses it to summarize several files at once.
+"""
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import httpx
+
+from completion_cache import cache_key
+from gigachat import (
+    API_URL,
+    ASK_SYSTEM_PROMPT,
+    DEFAULT_MODEL,
+    SUMMARY_SYSTEM_PROMPT,
+    GigaChatError,
+    RetryPolicy,
+    _env_number,
+    _get_verify_flag,
+    _json_body,
+    build_messages,
+    get_cache,
+    get_token_manager,
+    parse_completion,
+)
+
+logger = logging.getLogger("gigachat.async")
+
+
+class AsyncGigaChatClient:
+    """
+    Non-blocking counterpart of GigaChatClient: keep-alive pool, the same
+    RetryPolicy, connect/read timeouts and a semaphore limiting concurrent
+    completions. Bound to one event loop.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        pool_size: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        backoff_base: Optional[float] = None,
+        backoff_max: Optional[float] = None,
+    ) -> None:
+        self.max_concurrency = int(max_concurrency or _env_number("GIGACHAT_MAX_CONCURRENCY", 4))
+        pool_size = int(pool_size or _env_number("GIGACHAT_POOL_SIZE", 10))
+        self.retry = RetryPolicy(max_retries, backoff_base, backoff_max)
+        self.http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(
+                read_timeout or _env_number("GIGACHAT_READ_TIMEOUT", 60),
+                connect=connect_timeout or _env_number("GIGACHAT_CONNECT_TIMEOUT", 5),
+            ),
+            verify=_get_verify_flag(),
+        )
+        self.tokens = get_token_manager()
+        self.cache = get_cache()
+        self.limiter = asyncio.Semaphore(self.max_concurrency)
+
+    async def __aenter__(self) -> "AsyncGigaChatClient":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        await self.http.aclose()
+
+    async def _request(self, method: str, url: str, **kwargs: Any) -> httpx.Response:
+        """Send a request, retrying transient failures; other responses are returned as is."""
+        attempt = 0
+        while True:
+            try:
+                resp = await self.http.request(method, url, **kwargs)
+            except httpx.TransportError as exc:
+                delay = self.retry.after_error(attempt, exc)
+            else:
+                delay = self.retry.after_response(attempt, resp)
+                if delay is None:
+                    return resp
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def completions(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """POST chat/completions; a 401 triggers a single token refresh and retry."""
+        url = f"{API_URL}/chat/completions"
+
+        async def post(token: str) -> httpx.Response:
+            headers = {
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {token}",
+            }
+            return await self._request("POST", url, json=payload, headers=headers)
+
+        async with self.limiter:
+            token = await self.tokens.aget()
+            resp = await post(token)
+            if resp.status_code == 401:
+                logger.warning("GigaChat отклонил токен (401), обновляем и повторяем запрос")
+                self.tokens.invalidate(token)
+                resp = await post(await self.tokens.aget())
+        if resp.status_code != 200:
+            raise GigaChatError(f"GigaChat error {resp.status_code}: {resp.text}")
+        return _json_body(resp)
+
+    async def chat(
+        self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL, use_cache: bool = True
+    ) -> Dict[str, Any]:
+        """Run a chat completion; returns {content, model, usage}, shares the completion cache."""
+        key = cache_key(messages, model) if use_cache and self.cache is not None else None
+        # The cache file (lookups, stores and eviction) is used from worker
+        # threads, each with its own connection, never from the event loop
+        if key is not None:
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                return cached
+        result = parse_completion(await self.completions({"model": model, "messages": messages}), model)
+        if key is not None:
+            await asyncio.to_thread(self.cache.put, key, result)
+        return result
+
+
+# One client (and so one limiter) per event loop
+_clients: Dict[asyncio.AbstractEventLoop, AsyncGigaChatClient] = {}
+
+
+def get_async_client() -> AsyncGigaChatClient:
+    """Client of the running event loop, created on first use."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        # Drop clients of loops that are gone (e.g. previous asyncio.run calls)
+        for old_loop in [old for old in _clients if old.is_closed()]:
+            del _clients[old_loop]
+        client = _clients[loop] = AsyncGigaChatClient()
+    return client
+
+
+async def close_async_client() -> None:
+    """Close the running loop's client (call before the loop shuts down)."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def agenerate_summary_details(text: str) -> Dict[str, Any]:
+    """
+    Async generate_summary_details: summary of the text with metadata
+    (content, model, usage).
+    """
+    logger.info("Отправляем текст в GigaChat на саммаризацию")
+    return await get_async_client().chat(build_messages(text, SUMMARY_SYSTEM_PROMPT))
+
+
+async def agenerate_summary(text: str) -> str:
+    """Async generate_summary."""
+    return (await agenerate_summary_details(text))["content"]
+
+
+async def aask(user_text: str, system_prompt: str = ASK_SYSTEM_PROMPT) -> str:
+    """Async ask_gigachat: произвольный запрос в GigaChat."""
+    logger.info("Отправляем произвольный запрос в GigaChat")
+    return (await get_async_client().chat(build_messages(user_text, system_prompt)))["content"]
+
+
+async def asummarize_many(texts: Sequence[str]) -> List[Union[Dict[str, Any], GigaChatError]]:
+    """
+    Summarize many texts (chats, chunks) concurrently, within the global
+    limiter. Results keep the input order; a failed item holds its
+    GigaChatError instead of failing the whole batch.
+    """
+
+    async def one(text: str) -> Union[Dict[str, Any], GigaChatError]:
+        try:
+            return await agenerate_summary_details(text)
+        except GigaChatError as exc:
+            return exc
+
+    return list(await asyncio.gather(*(one(text) for text in texts)))
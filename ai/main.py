@@ -1,9 +1,12 @@
 import argparse
+import asyncio
 import logging
 import sys
+from typing import Any, Dict, List, Union
 
-from gigachat import GigaChatError, generate_summary, get_access_token
-from utils import init_env, pick_input_text
+from gigachat import GigaChatError, generate_summary, get_access_token, get_cache
+from gigachat_async import asummarize_many, close_async_client
+from utils import init_env, pick_input_text, read_text_from_file
 
 
 def build_parser() -> argparse.ArgumentParser:
@@ -14,16 +17,34 @@ def build_parser() -> argparse.ArgumentParser:
 
     summary_parser = subparsers.add_parser("summary", help="Сделать выжимку текста")
     summary_parser.add_argument(
-        "--file", type=str, help="Путь до файла с текстом", default=None
+        "--file",
+        type=str,
+        action="append",
+        help="Путь до файла с текстом (можно несколько: выжимки делаются параллельно)",
+        default=None,
     )
     summary_parser.add_argument(
         "--text", type=str, help="Текст напрямую в аргументе", default=None
     )
 
     subparsers.add_parser("token", help="Получить OAuth access token для GigaChat")
+
+    cache_parser = subparsers.add_parser("cache", help="Статистика кэша ответов GigaChat")
+    cache_parser.add_argument(
+        "--clear", action="store_true", help="Очистить кэш ответов"
+    )
     return parser
 
 
+async def summarize_files(paths: List[str]) -> List[Union[Dict[str, Any], GigaChatError]]:
+    """Выжимки нескольких файлов параллельно через асинхронный клиент."""
+    texts = [read_text_from_file(path) for path in paths]
+    try:
+        return await asummarize_many(texts)
+    finally:
+        await close_async_client()
+
+
 def main(argv: list[str] | None = None) -> int:
     logging.basicConfig(
         level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s"
@@ -35,7 +56,18 @@ def main(argv: list[str] | None = None) -> int:
 
     if args.command == "summary":
         try:
-            user_text = pick_input_text(args.text, args.file)
+            if not args.text and args.file and len(args.file) > 1:
+                results = asyncio.run(summarize_files(args.file))
+                for path, result in zip(args.file, results):
+                    print(f"\n--- Summary: {path} ---\n")
+                    if isinstance(result, GigaChatError):
+                        print(f"GigaChat error: {result}")
+                    else:
+                        print(result["content"])
+                print("\n--------------")
+                failed = sum(isinstance(result, GigaChatError) for result in results)
+                return 1 if failed else 0
+            user_text = pick_input_text(args.text, args.file[0] if args.file else None)
             result = generate_summary(user_text)
             print("\n--- Summary ---\n")
             print(result)
@@ -66,6 +98,17 @@ def main(argv: list[str] | None = None) -> int:
             logging.exception("Unexpected error: %s", err)
             return 1
 
+    if args.command == "cache":
+        cache = get_cache()
+        if cache is None:
+            logging.error("Кэш ответов выключен (GIGACHAT_CACHE=false)")
+            return 1
+        if args.clear:
+            cache.clear()
+        for name, value in cache.stats().items():
+            print(f"{name}: {value}")
+        return 0
+
     parser.print_help()
     return 1
 
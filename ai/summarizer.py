@@ -0,0 +1,156 @@
+"""
+Map-reduce summarization of large backlogs.
+
+Texts (formatted messages) are packed in order into chunks that fit a token
+budget (SUMMARY_CHUNK_TOKENS, estimated from the text length), the chunks
+are summarized in parallel (map), and the partial summaries are merged
+level by level with the same budget until one summary is left (reduce).
+A backlog that fits one chunk costs a single request, as before.
+With ``on_delta`` the final request (the only chunk, or the last merge)
+is streamed, so the caller can show the summary as it is generated.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional
+
+from gigachat import SUMMARY_SYSTEM_PROMPT, GigaChatError, build_messages, get_client
+
+logger = logging.getLogger("gigachat.summarizer")
+
+MERGE_SYSTEM_PROMPT = (
+    "Ты – ассистент, который объединяет частичные выжимки одной переписки "
+    "в одну краткую выжимку без повторов."
+)
+
+# Input tokens per request; the answer and the prompt need room as well
+CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS") or 4000)
+# Rough average for Russian text with GigaChat's tokenizer
+CHARS_PER_TOKEN = float(os.getenv("SUMMARY_CHARS_PER_TOKEN") or 3)
+MAX_WORKERS = int(os.getenv("GIGACHAT_MAX_CONCURRENCY") or 4)
+SEPARATOR = "\n\n---\n\n"
+
+# on_progress(stage, done, total); stage is "map" or "reduce"
+Progress = Callable[[str, int, int], None]
+# on_delta(text) for each streamed fragment of the final summary
+Delta = Callable[[str], None]
+
+
+def estimate_tokens(text: str) -> int:
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+def split_text(text: str, budget: int) -> List[str]:
+    """Split a text longer than the budget, preferably at line breaks or spaces."""
+    # estimate_tokens rounds up, so a piece of budget * CHARS_PER_TOKEN
+    # characters would already be one token over
+    limit = max(1, int((budget - 1) * CHARS_PER_TOKEN))
+    pieces = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut < limit // 2:
+            cut = text.rfind(" ", 0, limit)
+        if cut < limit // 2:
+            cut = limit
+        pieces.append(text[:cut])
+        text = text[cut:].lstrip()
+    if text:
+        pieces.append(text)
+    return pieces
+
+
+def pack_chunks(parts: List[str], budget: int = CHUNK_TOKENS) -> List[str]:
+    """Greedily pack texts, in order, into chunks of at most ``budget`` tokens."""
+    separator_tokens = estimate_tokens(SEPARATOR)
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for part in parts:
+        pieces = split_text(part, budget) if estimate_tokens(part) > budget else [part]
+        for piece in pieces:
+            cost = estimate_tokens(piece) + separator_tokens
+            if current and size + cost > budget:
+                chunks.append(SEPARATOR.join(current))
+                current, size = [], 0
+            current.append(piece)
+            size += cost
+    if current:
+        chunks.append(SEPARATOR.join(current))
+    return chunks
+
+
+def _summarize_chunks(
+    chunks: List[str],
+    system_prompt: str,
+    stage: str,
+    on_progress: Optional[Progress],
+    on_delta: Optional[Delta] = None,
+) -> List[Dict[str, Any]]:
+    """Summarize chunks in parallel, keeping their order; the first error aborts the stage."""
+    client = get_client()
+    if on_delta is not None and len(chunks) == 1:
+        # The final summary: stream it instead of reporting progress
+        stream = client.stream_chat(build_messages(chunks[0], system_prompt))
+        for delta in stream:
+            on_delta(delta)
+        return [stream.result]
+    results: List[Dict[str, Any]] = [{}] * len(chunks)
+    pool = ThreadPoolExecutor(max_workers=max(1, min(MAX_WORKERS, len(chunks))), thread_name_prefix="summary")
+    try:
+        futures = {
+            pool.submit(client.chat, build_messages(chunk, system_prompt)): index
+            for index, chunk in enumerate(chunks)
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            results[futures[future]] = future.result()
+            if on_progress is not None:
+                on_progress(stage, done, len(chunks))
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    return results
+
+
+def summarize_large(
+    parts: List[str],
+    on_progress: Optional[Progress] = None,
+    budget: int = CHUNK_TOKENS,
+    on_delta: Optional[Delta] = None,
+) -> Dict[str, Any]:
+    """
+    Summarize any number of texts within the token budget per request.
+
+    Returns {content, model, usage (summed over all requests), chunks, levels}.
+    Raises GigaChatError if any request fails.
+    """
+    chunks = pack_chunks(parts, budget)
+    logger.info("Саммаризация: %d частей по ≤%d токенов", len(chunks), budget)
+    calls = results = _summarize_chunks(chunks, SUMMARY_SYSTEM_PROMPT, "map", on_progress, on_delta)
+    levels = 0
+    previous_size = None
+    while len(results) > 1:
+        levels += 1
+        contents = [result["content"] for result in results]
+        size = sum(estimate_tokens(content) for content in contents)
+        if previous_size is not None and size >= previous_size:
+            raise GigaChatError("Частичные выжимки не сокращаются: объединить их в пределах бюджета не удалось")
+        previous_size = size
+        # Re-packed (and split) on every level, so no request exceeds the
+        # budget; partial summaries too long to share a chunk are condensed
+        # one by one first and packed together on the next level
+        merged = pack_chunks(contents, budget)
+        logger.info("Объединение выжимок, уровень %d: %d → %d", levels, len(results), len(merged))
+        results = _summarize_chunks(merged, MERGE_SYSTEM_PROMPT, "reduce", on_progress, on_delta)
+        calls = calls + results
+
+    usage: Dict[str, int] = {}
+    for call in calls:
+        for key, value in call["usage"].items():
+            if isinstance(value, int):
+                usage[key] = usage.get(key, 0) + value
+    return {
+        "content": results[0]["content"],
+        "model": results[0]["model"],
+        "usage": usage,
+        "chunks": len(chunks),
+        "levels": levels,
+    }
@@ -0,0 +1,167 @@
+"""
+Cache of the GigaChat OAuth token.
+
+A token lives 30 minutes (``expires_at`` in the OAuth response), so there
+is no need to request one per API call. ``TokenManager`` keeps the token
+in memory, refreshes it in a background thread when it is about to expire
+(callers keep using the still valid one meanwhile) and, optionally,
+shares it between processes (bot, CLI, scripts/update_token.py) through a
+JSON file written atomically.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger("gigachat.token")
+
+# {"access_token": str, "expires_at": epoch seconds}
+Token = Dict[str, Any]
+
+
+class TokenManager:
+    """Thread- and asyncio-safe token cache with proactive refresh."""
+
+    def __init__(
+        self,
+        fetch: Callable[[], Token],
+        cache_path: Optional[Path] = None,
+        cache_key: str = "",
+        refresh_ahead: float = 300,
+        min_ttl: float = 30,
+    ) -> None:
+        """
+        fetch — requests a new token, returns {"access_token", "expires_at"}.
+        refresh_ahead — seconds before expiry to start a background refresh.
+        min_ttl — a token expiring sooner is never handed out.
+        cache_key — identifies the credentials/scope in the shared file.
+        """
+        self._fetch = fetch
+        self.cache_path = cache_path
+        self.cache_key = cache_key
+        self.refresh_ahead = refresh_ahead
+        self.min_ttl = min_ttl
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        # Token rejected by the API; the shared file may still hold it
+        self._rejected: Optional[str] = None
+        # Guards the token; held for a network fetch only when no valid token is left
+        self._lock = threading.Lock()
+        # Held while a background refresh runs; never waited on
+        self._refresh_flag = threading.Lock()
+        self.fetches = 0
+
+    def _ttl(self) -> float:
+        return self._expires_at - time.time()
+
+    def get(self) -> str:
+        """Valid token: from memory, the shared file, or a new OAuth request."""
+        token, ttl = self._token, self._ttl()
+        if token is not None and ttl > self.min_ttl:
+            if ttl < self.refresh_ahead:
+                self._refresh_in_background()
+            return token
+        with self._lock:
+            # Another thread may have refreshed while we waited
+            if self._token is not None and self._ttl() > self.min_ttl:
+                return self._token
+            if self._load_shared():
+                return self._token
+            return self._refresh_locked()
+
+    async def aget(self) -> str:
+        """get() for coroutines: a network refresh runs in a thread."""
+        token, ttl = self._token, self._ttl()
+        if token is not None and ttl > self.min_ttl:
+            if ttl < self.refresh_ahead:
+                self._refresh_in_background()
+            return token
+        return await asyncio.to_thread(self.get)
+
+    def refresh(self) -> str:
+        """Request a new token regardless of the cached one."""
+        with self._lock:
+            return self._refresh_locked()
+
+    def invalidate(self, token: str) -> None:
+        """
+        Drop a token the API rejected (401). Only the given token is dropped,
+        so concurrent failures with the same token cause a single refresh.
+        """
+        with self._lock:
+            self._rejected = token
+            if self._token == token:
+                self._token = None
+                self._expires_at = 0.0
+
+    def _refresh_locked(self) -> str:
+        self._store(self._fetch())
+        return self._token
+
+    def _store(self, data: Token) -> None:
+        """Swap in a fetched token (under self._lock)."""
+        self.fetches += 1
+        self._token = data["access_token"]
+        self._expires_at = float(data["expires_at"])
+        logger.info("OAuth токен обновлён, действует %.0f с", self._ttl())
+        self._save_shared()
+
+    def _refresh_in_background(self) -> None:
+        # Non-blocking: callers on the fast path (and the event loop) never wait
+        if not self._refresh_flag.acquire(blocking=False):
+            return
+
+        def run() -> None:
+            try:
+                with self._lock:
+                    # Another process may already have refreshed it
+                    if self._ttl() >= self.refresh_ahead or self._load_shared(self.refresh_ahead):
+                        return
+                # The OAuth round trip runs without the lock: the current
+                # token stays available to everyone meanwhile
+                data = self._fetch()
+                with self._lock:
+                    self._store(data)
+            except Exception as exc:  # the current token is still valid
+                logger.warning("Фоновое обновление токена не удалось: %s", exc)
+            finally:
+                self._refresh_flag.release()
+
+        threading.Thread(target=run, name="gigachat-token-refresh", daemon=True).start()
+
+    # Shared file
+
+    def _load_shared(self, min_ttl: Optional[float] = None) -> bool:
+        if self.cache_path is None:
+            return False
+        try:
+            data = json.loads(self.cache_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return False
+        if data.get("key") != self.cache_key or data.get("access_token") in (None, "", self._rejected):
+            return False
+        expires_at = float(data.get("expires_at") or 0)
+        if expires_at - time.time() <= (self.min_ttl if min_ttl is None else min_ttl):
+            return False
+        self._token, self._expires_at = data["access_token"], expires_at
+        return True
+
+    def _save_shared(self) -> None:
+        if self.cache_path is None:
+            return
+        payload = {"key": self.cache_key, "access_token": self._token, "expires_at": self._expires_at}
+        tmp = self.cache_path.with_name(f".{self.cache_path.name}.{os.getpid()}.tmp")
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            # The token is a credential: readable by the owner only
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump(payload, file)
+            os.replace(tmp, self.cache_path)
+        except OSError as exc:
+            logger.warning("Не удалось сохранить токен в %s: %s", self.cache_path, exc)
+            tmp.unlink(missing_ok=True)
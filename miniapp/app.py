@@ -2,123 +2,196 @@
 Telegram Mini App для мониторинга системы саммаризации.
 Работает внутри Telegram через Web Apps API.
 """
-import sqlite3
-from datetime import datetime
+import sys
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, abort, render_template, jsonify, request, send_file
+
+# Общий менеджер подключений к БД живёт рядом с Telethon-модулями
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR / "telethon"))
+
+from connection import DB_PATH, acquire_connection, release_connection  # noqa: E402
+from db import (  # noqa: E402
+    get_messages_page,
+    get_recent_messages,
+    get_recent_summaries,
+    get_statistics,
+    init_db,
+)
+from media import request_media  # noqa: E402
+from search import search_messages, search_summaries  # noqa: E402
 
 app = Flask(__name__)
 
-# Путь к базе данных (на уровень выше)
-DB_PATH = Path(__file__).parent.parent / "messages.db"
+# Время хранится в UTC, отображается по Москве (UTC+3)
+MSK = timezone(timedelta(hours=3))
 
+# Приводим схему БД к актуальной версии (идемпотентно)
+init_db()
 
-def get_db_connection():
-    """Создать подключение к БД."""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
 
+@app.before_request
+def acquire_db():
+    """
+    Threaded-сервер обслуживает каждый запрос в новом потоке: берём готовое
+    подключение из пула вместо открытия нового с настройкой PRAGMA.
+    """
+    acquire_connection()
 
-def get_statistics():
-    """Получить статистику из БД."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Всего сообщений
-    cursor.execute("SELECT COUNT(*) as total FROM messages")
-    total = cursor.fetchone()["total"]
-    
-    # Проанализировано
-    cursor.execute("SELECT COUNT(*) as analyzed FROM messages WHERE summarized = 1")
-    analyzed = cursor.fetchone()["analyzed"]
-    
-    # Необработанных
-    unsummarized = total - analyzed
-    
-    # Последняя саммаризация
-    cursor.execute("""
-        SELECT MAX(date) as last_summary 
-        FROM messages 
-        WHERE summarized = 1
-    """)
-    result = cursor.fetchone()
-    last_summary = result["last_summary"] if result["last_summary"] else "Нет данных"
-    
-    conn.close()
-    
-    return {
-        "total": total,
-        "analyzed": analyzed,
-        "unsummarized": unsummarized,
-        "last_summary": last_summary,
-        "percentage": round((analyzed / total * 100) if total > 0 else 0, 1)
-    }
 
+@app.teardown_appcontext
+def release_db(exc=None):
+    """Вернуть подключение в пул (не закрывая)."""
+    release_connection()
+
+
+def arg_limit(default, maximum):
+    """
+    Параметр limit запроса: нечисловое значение заменяется значением по
+    умолчанию, результат ограничен диапазоном 1..maximum.
+    """
+    return max(1, min(request.args.get("limit", default, type=int), maximum))
 
-def get_all_messages(limit=50, offset=0):
-    """Получить все сообщения с пагинацией."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT id, chat_id, sender, text, date, summarized
-        FROM messages
-        ORDER BY date DESC
-        LIMIT ? OFFSET ?
-    """, (limit, offset))
-    
-    messages = [dict(row) for row in cursor.fetchall()]
-    
-    # Получаем общее количество
-    cursor.execute("SELECT COUNT(*) as total FROM messages")
-    total = cursor.fetchone()["total"]
-    
-    conn.close()
-    
-    return messages, total
+
+def get_all_messages(limit=50, cursor=None, direction="next"):
+    """
+    Получить страницу сообщений с курсорной пагинацией.
+    Общее количество берётся из счётчиков статистики, а не COUNT(*).
+    """
+    messages, next_cursor, prev_cursor = get_messages_page(
+        limit=limit, cursor=cursor, direction=direction
+    )
+    total = get_statistics()["total"]
+    return messages, next_cursor, prev_cursor, total
 
 
 @app.route("/")
 def index():
     """Главная страница - дашборд."""
     stats = get_statistics()
-    return render_template("index.html", stats=stats)
+    summaries = get_recent_summaries(limit=5)
+    return render_template("index.html", stats=stats, summaries=summaries)
 
 
 @app.route("/messages")
 def messages():
     """Страница со списком сообщений."""
-    page = int(request.args.get("page", 1))
     per_page = 30
-    offset = (page - 1) * per_page
-    
-    messages_list, total = get_all_messages(limit=per_page, offset=offset)
-    total_pages = (total + per_page - 1) // per_page
+    try:
+        messages_list, next_cursor, prev_cursor, total = get_all_messages(
+            limit=per_page,
+            cursor=request.args.get("cursor"),
+            direction=request.args.get("dir", "next"),
+        )
+    except ValueError:
+        abort(400)
     
     return render_template(
         "messages.html",
         messages=messages_list,
-        page=page,
-        total_pages=total_pages,
+        next_cursor=next_cursor,
+        prev_cursor=prev_cursor,
         total=total
     )
 
 
+@app.route("/api/messages")
+def api_messages():
+    """
+    JSON-вариант списка сообщений: /api/messages?cursor=...&dir=next|prev&limit=...
+    """
+    limit = arg_limit(30, 200)
+    try:
+        messages_list, next_cursor, prev_cursor, total = get_all_messages(
+            limit=limit,
+            cursor=request.args.get("cursor"),
+            direction=request.args.get("dir", "next"),
+        )
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
+    return jsonify({
+        "messages": messages_list,
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
+        "total": total,
+    })
+
+
+@app.route("/api/messages/recent")
+def api_recent_messages():
+    """
+    Сообщения за последние N часов: /api/messages/recent?hours=24&chat_id=...
+    """
+    hours = request.args.get("hours", 24, type=float)
+    chat_id = request.args.get("chat_id", type=int)
+    limit = arg_limit(1000, 5000)
+    messages_list = get_recent_messages(hours=hours, chat_id=chat_id, limit=limit)
+    return jsonify({"hours": hours, "chat_id": chat_id, "messages": messages_list})
+
+
 @app.route("/api/stats")
 def api_stats():
-    """API endpoint для получения статистики."""
-    stats = get_statistics()
+    """API endpoint для получения статистики (?chat_id=... — по отдельному чату)."""
+    chat_id = request.args.get("chat_id", type=int)
+    stats = get_statistics(chat_id)
     return jsonify(stats)
 
 
+@app.route("/api/summaries")
+def api_summaries():
+    """API endpoint для получения последних саммаризаций."""
+    limit = arg_limit(10, 100)
+    return jsonify(get_recent_summaries(limit=limit))
+
+
+@app.route("/api/search")
+def api_search():
+    """
+    Полнотекстовый поиск: /api/search?q=...&type=messages|summaries&cursor=...
+    Результаты отсортированы по релевантности, сниппеты размечены <mark>.
+    """
+    query = request.args.get("q", "").strip()
+    search = search_summaries if request.args.get("type") == "summaries" else search_messages
+    limit = arg_limit(20, 100)
+    try:
+        results, next_cursor = search(query, limit=limit, cursor=request.args.get("cursor"))
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
+    return jsonify({"query": query, "results": results, "next_cursor": next_cursor})
+
+
+@app.route("/media/<int(signed=True):chat_id>/<int:message_id>")
+def media(chat_id, message_id):
+    """
+    Медиафайл сообщения. Файлы скачиваются по запросу: пока Telethon-процесс
+    скачивает файл, отвечаем 202 со статусом (клиент повторяет запрос позже).
+    """
+    info = request_media(chat_id, message_id)
+    if info["status"] == "missing":
+        abort(404)
+    if info["status"] == "ready":
+        return send_file(info["path"], mimetype=info["mime_type"], download_name=info["file_name"])
+    return jsonify({"status": info["status"], "kind": info["kind"], "error": info["error"]}), 202
+
+
 @app.template_filter("format_datetime")
 def format_datetime(value):
-    """Форматирование даты и времени."""
+    """
+    Форматирование даты и времени в московском часовом поясе.
+    Принимает миллисекунды эпохи (date_ms) или ISO-строку (без смещения — UTC).
+    """
     try:
-        dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
-        return dt.strftime("%d.%m.%Y %H:%M")
+        if isinstance(value, (int, float)):
+            if not value:
+                return "—"
+            dt = datetime.fromtimestamp(value / 1000, tz=timezone.utc)
+        else:
+            dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+            if dt.tzinfo is None:
+                dt = dt.replace(tzinfo=timezone.utc)
+        return dt.astimezone(MSK).strftime("%d.%m.%Y %H:%M")
     except:
         return value
 
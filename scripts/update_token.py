@@ -1,5 +1,9 @@
 #!/usr/bin/env python3
-"""Update GIGACHAT_TOKEN in .env file."""
+"""Update GIGACHAT_TOKEN in .env file.
+
+Reuses the token shared through GIGACHAT_TOKEN_CACHE while it is valid;
+pass --force to request a new one.
+"""
 import pathlib
 import sys
 
@@ -11,14 +15,14 @@ sys.path.insert(0, str(ai_dir))
 from utils import init_env
 from gigachat import get_access_token
 
-def update_token_in_env():
+def update_token_in_env(force: bool = False):
     """Fetch new token and update .env file."""
     project_root = pathlib.Path(__file__).parent.parent
     env_path = project_root / ".env"
     
     # Load environment variables
     init_env()
-    token = get_access_token()
+    token = get_access_token(force_refresh=force)
     if not env_path.exists():
         print(f"Error: .env file not found at {env_path}")
         return 1
@@ -47,5 +51,5 @@ def update_token_in_env():
     return 0
 
 if __name__ == "__main__":
-    sys.exit(update_token_in_env())
+    sys.exit(update_token_in_env(force="--force" in sys.argv[1:]))
 
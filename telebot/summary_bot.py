@@ -2,13 +2,16 @@
 Telegram-бот для саммаризации сообщений по команде.
 Работает с БД, которую наполняет Telethon.
 """
+import html
 import logging
 import os
 import sys
+import time
 from pathlib import Path
 
 import telebot
 from telebot import types
+from telebot.apihelper import ApiTelegramException
 from dotenv import load_dotenv
 
 # Загружаем переменные окружения
@@ -19,13 +22,23 @@ load_dotenv(ROOT_DIR / ".env")
 sys.path.insert(0, str(ROOT_DIR / "ai"))
 sys.path.insert(0, str(ROOT_DIR / "telethon"))
 
-from gigachat import GigaChatError, generate_summary  # noqa: E402
+from gigachat import GigaChatError, get_cache  # noqa: E402
+from summarizer import summarize_large  # noqa: E402
 from db import (  # noqa: E402
     init_db,
-    get_unsummarized_messages,
-    mark_as_summarized,
+    claim_stale_summaries,
+    claim_unsummarized,
+    complete_claim,
+    delete_summary,
+    get_statistics,
+    release_claim,
+    release_stale_summaries,
+    replace_summary,
     save_summary,
+    transaction,
 )
+from media import get_media_info  # noqa: E402
+from search import search_messages  # noqa: E402
 
 # Получаем токен бота
 BOT_TOKEN = os.getenv("BOT_TOKEN")
@@ -35,6 +48,14 @@ if not BOT_TOKEN:
 # Создаем бота
 bot = telebot.TeleBot(BOT_TOKEN)
 
+# Сколько сообщений обрабатывает одна команда /summary (весь бэклог, с разумным пределом)
+SUMMARY_MAX_MESSAGES = int(os.getenv("SUMMARY_MAX_MESSAGES") or 5000)
+# Аренда захвата должна пережить все запросы map-reduce
+SUMMARY_LEASE_SECONDS = int(os.getenv("SUMMARY_LEASE_SECONDS") or 1800)
+# Минимальный интервал между правками сообщения с выжимкой (лимиты Telegram)
+SUMMARY_EDIT_SECONDS = float(os.getenv("SUMMARY_EDIT_SECONDS") or 1.5)
+TELEGRAM_MESSAGE_LIMIT = 4096
+
 # Настройка логирования
 logging.basicConfig(
     level=logging.INFO,
@@ -52,6 +73,122 @@ def get_main_keyboard():
     return keyboard
 
 
+# Типы вложений (message_media.kind) для текста, который получает GigaChat
+MEDIA_LABELS = {
+    "voice": "голосовое сообщение",
+    "video_note": "видеосообщение",
+    "gif": "GIF",
+    "sticker": "стикер",
+    "video": "видео",
+    "audio": "аудио",
+    "photo": "фото",
+    "document": "файл",
+}
+
+
+def media_label(media):
+    """Краткое описание вложения: тип, имя файла и длительность."""
+    parts = [MEDIA_LABELS.get(media["kind"], media["kind"])]
+    if media.get("file_name"):
+        parts.append(media["file_name"])
+    if media.get("duration"):
+        minutes, seconds = divmod(int(media["duration"]), 60)
+        parts.append(f"{minutes}:{seconds:02d}")
+    return "[" + ", ".join(parts) + "]"
+
+
+def attach_media(messages):
+    """Добавить к сообщениям метаданные вложений (одним запросом)."""
+    media = get_media_info([(msg["chat_id"], msg["id"]) for msg in messages])
+    for msg in messages:
+        msg["media"] = media.get((msg["chat_id"], msg["id"]))
+    return messages
+
+
+def format_message(msg):
+    """Сообщение в виде текста для GigaChat; у вложения текст — это подпись."""
+    header = f"От {msg['sender']} ({msg['date']})"
+    if msg.get("media"):
+        header += f" {media_label(msg['media'])}"
+    return f"{header}:\n{msg['text']}"
+
+
+def split_message(text, limit=TELEGRAM_MESSAGE_LIMIT):
+    """Разбить длинный текст на части, которые Telegram примет одним сообщением."""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut < limit // 2:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    parts.append(text)
+    return parts
+
+
+class LiveMessage:
+    """
+    Сообщение, которое правится по ходу работы: прогресс map-reduce,
+    затем выжимка по мере генерации. Частые обновления объединяются —
+    правка не чаще SUMMARY_EDIT_SECONDS, а ответ 429 откладывает следующую.
+    """
+
+    def __init__(self, message, min_interval=None):
+        self.message = message
+        self.min_interval = SUMMARY_EDIT_SECONDS if min_interval is None else min_interval
+        self.next_edit = 0.0
+        self.text = message.text
+
+    def update(self, text, force=False):
+        """Показать text, если подошло время очередной правки (или force)."""
+        text = text[:TELEGRAM_MESSAGE_LIMIT]
+        now = time.monotonic()
+        if text == self.text or (not force and now < self.next_edit):
+            return
+        self._edit(text)
+
+    def progress(self, stage, done, total):
+        """Колбэк прогресса summarize_large."""
+        if stage == "map":
+            text = f"⏳ Саммаризация: обработано частей {done}/{total}"
+        else:
+            text = f"🔗 Объединение выжимок: {done}/{total}"
+        self.update(text, force=done == total)
+
+    def finish(self, text, reply_markup=None):
+        """Итоговый текст: дождаться лимита и обязательно применить; хвост длинного текста — новыми сообщениями."""
+        first, *rest = split_message(text)
+        delay = self.next_edit - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        if first != self.text and not self._edit(first):
+            # Править не вышло — отправляем итог отдельным сообщением
+            rest.insert(0, first)
+        for i, part in enumerate(rest):
+            bot.reply_to(self.message, part, reply_markup=reply_markup if i == len(rest) - 1 else None)
+
+    def _edit(self, text):
+        self.next_edit = time.monotonic() + self.min_interval
+        try:
+            bot.edit_message_text(text, self.message.chat.id, self.message.message_id)
+        except ApiTelegramException as err:
+            if err.error_code == 429:
+                retry_after = (err.result_json.get("parameters") or {}).get("retry_after", 1)
+                self.next_edit = time.monotonic() + retry_after
+            logger.debug("Не удалось обновить сообщение: %s", err)
+            return False
+        self.text = text
+        return True
+
+
+def reply_error(message, live, text):
+    """Сообщить об ошибке; недописанную выжимку в сообщении со статусом заменяем."""
+    if live is not None:
+        live.finish(text)
+    else:
+        bot.reply_to(message, text, reply_markup=get_main_keyboard())
+
+
 @bot.message_handler(commands=["start", "help"])
 def handle_start(message):
     """Приветствие и подсказка."""
@@ -63,6 +200,8 @@ def handle_start(message):
 📝 Саммаризация - получить выжимку новых сообщений
 
 Или команды: /status, /summary
+🔍 /search <запрос> - поиск по истории сообщений
+♻️ /refresh - пересчитать выжимки, сообщения которых изменили или удалили
 """
     bot.reply_to(message, help_text, reply_markup=get_main_keyboard())
 
@@ -70,9 +209,13 @@ def handle_start(message):
 @bot.message_handler(commands=["status"])
 def handle_status(message):
     """Показать статистику."""
-    messages = get_unsummarized_messages(limit=1000)
-    count = len(messages)
-    bot.reply_to(message, f"📊 Необработанных сообщений: {count}", reply_markup=get_main_keyboard())
+    stats = get_statistics()
+    text = f"📊 Необработанных сообщений: {stats['unsummarized']}"
+    if stats["summaries"]:
+        text += f"\n🕐 Последняя саммаризация: {stats['last_summary']}"
+    if stats["stale_summaries"]:
+        text += f"\n♻️ Устаревших выжимок: {stats['stale_summaries']} (/refresh)"
+    bot.reply_to(message, text, reply_markup=get_main_keyboard())
 
 
 @bot.message_handler(commands=["summary"])
@@ -82,16 +225,26 @@ def handle_summary(message):
     
     bot.send_chat_action(message.chat.id, "typing")
     
+    claim_token = None
+    live = None
     try:
-        # Получаем все несаммаризованные сообщения
-        messages = get_unsummarized_messages(limit=100)
+        # Атомарно захватываем весь бэклог несаммаризованных сообщений,
+        # чтобы параллельные запросы не обработали их повторно
+        claim_token, messages = claim_unsummarized(
+            limit=SUMMARY_MAX_MESSAGES, lease_seconds=SUMMARY_LEASE_SECONDS
+        )
         
         if not messages:
             bot.reply_to(message, "✅ Нет новых сообщений для саммаризации.", reply_markup=get_main_keyboard())
             return
         
-        # Фильтруем короткие сообщения
-        valid_messages = [msg for msg in messages if msg.get("text") and len(msg["text"].strip()) >= 10]
+        # Фильтруем короткие сообщения; короткая подпись к вложению
+        # вместе с его описанием остаётся осмысленной
+        attach_media(messages)
+        valid_messages = [
+            msg for msg in messages
+            if msg.get("text") and (len(msg["text"].strip()) >= 10 or msg["media"])
+        ]
         
         if not valid_messages:
             bot.reply_to(
@@ -100,43 +253,140 @@ def handle_summary(message):
                 reply_markup=get_main_keyboard()
             )
             # Помечаем короткие как обработанные
-            for msg in messages:
-                mark_as_summarized(msg["id"])
+            complete_claim(claim_token)
             return
         
-        # Объединяем тексты сообщений
-        combined_text = "\n\n---\n\n".join([
-            f"От {msg['sender']} ({msg['date']}):\n{msg['text']}"
-            for msg in valid_messages
-        ])
+        texts = [format_message(msg) for msg in valid_messages]
         
         logger.info("Саммаризация %d сообщений (общая длина: %d символов)", 
-                   len(valid_messages), len(combined_text))
+                   len(valid_messages), sum(len(text) for text in texts))
         
-        bot.reply_to(message, f"⏳ Обрабатываю {len(valid_messages)} сообщений...")
+        live = LiveMessage(bot.reply_to(message, f"⏳ Обрабатываю {len(valid_messages)} сообщений..."))
+        header = f"📝 Выжимка из {len(valid_messages)} сообщений:\n\n"
+        streamed = []
         
-        # Создаём саммаризацию через GigaChat
-        summary = generate_summary(combined_text)
+        def on_delta(delta):
+            # Итоговая выжимка приходит по частям: показываем её сразу
+            streamed.append(delta)
+            live.update(header + "".join(streamed) + " ▌")
         
-        # Сохраняем саммаризацию для первого сообщения (как общую)
-        save_summary(valid_messages[0]["id"], summary)
+        # Создаём саммаризацию через GigaChat: части параллельно, затем объединение
+        started = time.monotonic()
+        result = summarize_large(texts, on_progress=live.progress, on_delta=on_delta)
+        latency_ms = int((time.monotonic() - started) * 1000)
+        summary = result["content"]
+        logger.info("Выжимка готова: %d частей, %d уровней объединения, %d мс",
+                   result["chunks"], result["levels"], latency_ms)
+        cache = get_cache()
+        if cache is not None:
+            logger.info("Кэш ответов: %s", cache.stats())
         
-        # Помечаем все сообщения как обработанные
-        for msg in messages:
-            mark_as_summarized(msg["id"])
+        # Сохраняем саммаризацию (со ссылками на исходные сообщения) и помечаем
+        # все сообщения захвата как обработанные в одной транзакции
+        with transaction():
+            save_summary(
+                summary,
+                valid_messages,
+                model=result["model"],
+                latency_ms=latency_ms,
+                usage=result["usage"],
+            )
+            complete_claim(claim_token)
         
-        # Отправляем результат
-        response = f"📝 Выжимка из {len(valid_messages)} сообщений:\n\n{summary}"
-        bot.reply_to(message, response, reply_markup=get_main_keyboard())
+        # Итоговый текст (без курсора) в то же сообщение
+        live.finish(header + summary, reply_markup=get_main_keyboard())
         
         logger.info("✓ Саммаризация отправлена пользователю")
         
     except GigaChatError as err:
         logger.error("GigaChat error: %s", err)
-        bot.reply_to(message, "❌ Ошибка GigaChat. Попробуйте позже.", reply_markup=get_main_keyboard())
+        if claim_token:
+            release_claim(claim_token)
+        reply_error(message, live, "❌ Ошибка GigaChat. Попробуйте позже.")
     except Exception as err:  # pragma: no cover
         logger.exception("Unexpected error: %s", err)
-        bot.reply_to(message, "❌ Не удалось создать саммаризацию.", reply_markup=get_main_keyboard())
+        if claim_token:
+            release_claim(claim_token)
+        reply_error(message, live, "❌ Не удалось создать саммаризацию.")
+
+
+@bot.message_handler(commands=["refresh"])
+def handle_refresh(message):
+    """Пересчитать только устаревшие выжимки (правки и удаления сообщений)."""
+    bot.send_chat_action(message.chat.id, "typing")
+    claimed = claim_stale_summaries(limit=5)
+    if not claimed:
+        bot.reply_to(message, "✅ Все выжимки актуальны.", reply_markup=get_main_keyboard())
+        return
+
+    refreshed = removed = 0
+    pending = [item["id"] for item in claimed]
+    try:
+        for item in claimed:
+            if not item["messages"]:
+                # Все сообщения выжимки удалены
+                delete_summary(item["id"])
+                removed += 1
+            else:
+                started = time.monotonic()
+                texts = [format_message(msg) for msg in attach_media(item["messages"])]
+                result = summarize_large(texts)
+                replace_summary(
+                    item["id"],
+                    result["content"],
+                    item["messages"],
+                    model=result["model"],
+                    latency_ms=int((time.monotonic() - started) * 1000),
+                    usage=result["usage"],
+                )
+                refreshed += 1
+            pending.remove(item["id"])
+    except GigaChatError as err:
+        logger.error("GigaChat error: %s", err)
+    except Exception as err:  # pragma: no cover
+        logger.exception("Unexpected error: %s", err)
+    finally:
+        # Необработанные возвращаем в очередь пересчёта
+        release_stale_summaries(pending)
+
+    text = f"♻️ Пересчитано выжимок: {refreshed}"
+    if removed:
+        text += f"\n🗑 Удалено (сообщений не осталось): {removed}"
+    if pending:
+        text += "\n❌ Часть выжимок не удалось пересчитать, попробуйте позже."
+    bot.reply_to(message, text, reply_markup=get_main_keyboard())
+
+
+@bot.message_handler(commands=["search"])
+def handle_search(message):
+    """Полнотекстовый поиск по сохранённым сообщениям."""
+    query = message.text.partition(" ")[2].strip()
+    if not query:
+        bot.reply_to(message, "🔍 Использование: /search <запрос>", reply_markup=get_main_keyboard())
+        return
+    
+    try:
+        results, _ = search_messages(query, limit=10)
+    except ValueError as err:
+        bot.reply_to(message, f"❌ {err}", reply_markup=get_main_keyboard())
+        return
+    
+    if not results:
+        bot.reply_to(message, "🔍 Ничего не найдено.", reply_markup=get_main_keyboard())
+        return
+    
+    # Сниппеты уже экранированы, подсветку <mark> переводим в жирный шрифт Telegram
+    lines = [
+        f"<b>{html.escape(item['sender'] or 'Неизвестно')}</b> ({html.escape(item['date'] or '')}):\n"
+        + item["snippet"].replace("<mark>", "<b>").replace("</mark>", "</b>")
+        for item in results
+    ]
+    bot.reply_to(
+        message,
+        f"🔍 Найдено по запросу «{html.escape(query)}»:\n\n" + "\n\n".join(lines),
+        parse_mode="HTML",
+        reply_markup=get_main_keyboard(),
+    )
 
 
 @bot.message_handler(func=lambda message: message.text == "📊 Статус")
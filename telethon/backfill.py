@@ -0,0 +1,299 @@
+"""
+Concurrent, resumable history backfill across many dialogs.
+
+Each dialog is walked newest -> oldest by its own task; a semaphore bounds
+how many dialogs are fetched at once. Progress (min_id/max_id per chat) is
+checkpointed in the backfill_state table only after the written rows are
+confirmed by a successful flush, so an interrupted backfill resumes where
+it stopped, and a rerun first picks up messages newer than the stored
+max_id. BACKFILL_LIMIT caps the older history fetched per dialog across
+runs (the count is part of the saved state). FloodWait pauses only
+the affected dialog, which gives its slot to the others while sleeping.
+
+Standalone usage (from telethon/):
+    BACKFILL_DIALOGS=all python backfill.py
+"""
+import asyncio
+import logging
+from contextlib import AsyncExitStack
+from typing import Any, Dict, List, Optional
+
+from telethon import TelegramClient
+from telethon.errors import FloodWaitError, TakeoutInitDelayError
+from telethon.tl.types import Dialog
+
+import config
+from db import get_backfill_state, save_backfill_state
+from entities import cache as entity_cache, resolve_sender
+from records import message_to_row
+from sharding import ShardManager, is_channel
+from writer import MessageWriter
+
+logger = logging.getLogger("tg-bot.backfill")
+
+# Persist progress every N messages per dialog
+CHECKPOINT_EVERY = 500
+# Pause before checkpointing again while the writer cannot store rows
+CHECKPOINT_RETRY_SECONDS = 5
+
+
+def select_dialogs(dialogs: List[Dialog], spec: str) -> List[Dialog]:
+    """
+    Pick dialogs by spec: "all" or comma-separated chat ids / @usernames.
+    """
+    if spec.strip().lower() == "all":
+        return dialogs
+
+    wanted = {item.strip().lstrip("@").lower() for item in spec.split(",") if item.strip()}
+    selected = []
+    for dialog in dialogs:
+        username = (getattr(dialog.entity, "username", None) or "").lower()
+        if str(dialog.id) in wanted or (username and username in wanted):
+            selected.append(dialog)
+    missing = len(wanted) - len(selected)
+    if missing > 0:
+        logger.warning("%d of the requested dialogs were not found", missing)
+    return selected
+
+
+class DialogBackfill:
+    """Backfill state machine of a single dialog."""
+
+    def __init__(self, client: TelegramClient, dialog: Dialog, writer: MessageWriter, limit: int = 0):
+        self.client = client
+        self.dialog = dialog
+        # Entity of the chat for the current client (changes on account failover)
+        self.entity = dialog.entity
+        self.writer = writer
+        self.limit = limit
+        self.chat_id = dialog.id
+        self.title = dialog.name or getattr(dialog.entity, "title", None) or "Unknown"
+        self.min_id: Optional[int] = None
+        self.max_id: Optional[int] = None
+        self.done = False
+        # Older-history messages fetched, over all runs (counts against limit)
+        self.fetched = 0
+        # Messages stored by this run
+        self.stored = 0
+        self._loaded = False
+
+    async def _load(self) -> None:
+        if self._loaded:
+            return
+        state = await asyncio.to_thread(get_backfill_state, self.chat_id)
+        if state:
+            self.min_id, self.max_id, self.done = state["min_id"], state["max_id"], bool(state["done"])
+            self.fetched = state["fetched"]
+        self._loaded = True
+
+    async def checkpoint(self) -> bool:
+        """
+        Flush queued rows, then record progress (never ahead of the data).
+        Returns False, keeping the saved progress as it was, if the rows
+        could not be stored yet.
+        """
+        try:
+            await self.writer.flush()
+        except Exception as exc:
+            logger.warning("Backfill of chat id=%s not checkpointed, rows not stored yet: %s", self.chat_id, exc)
+            return False
+        await asyncio.to_thread(
+            save_backfill_state, self.chat_id, self.min_id, self.max_id, self.done, self.fetched
+        )
+        return True
+
+    async def _store(self, message: Any) -> None:
+        sender = await resolve_sender(message, self.title)
+        await self.writer.put(message_to_row(message, self.chat_id, sender.label))
+        self.stored += 1
+        if self.stored % CHECKPOINT_EVERY == 0:
+            await self.checkpoint()
+
+    async def run_once(self) -> None:
+        """One pass; may raise FloodWaitError, progress so far is kept."""
+        await self._load()
+
+        # Messages newer than the high-water mark (posted since the last run)
+        if self.max_id:
+            async for message in self.client.iter_messages(
+                self.entity, min_id=self.max_id, reverse=True
+            ):
+                self.max_id = max(self.max_id, message.id)
+                await self._store(message)
+
+        # Older history below the low-water mark
+        if not self.done:
+            remaining = max(self.limit - self.fetched, 0) if self.limit else None
+            if remaining == 0:
+                return
+            fetched = 0
+            async for message in self.client.iter_messages(
+                self.entity, offset_id=self.min_id or 0, limit=remaining
+            ):
+                self.min_id = message.id
+                self.max_id = max(self.max_id or 0, message.id)
+                fetched += 1
+                self.fetched += 1
+                await self._store(message)
+            # Stopped by the limit rather than by reaching the first message
+            self.done = remaining is None or fetched < remaining
+
+
+async def backfill_dialog(
+    client: TelegramClient,
+    dialog: Dialog,
+    writer: MessageWriter,
+    semaphore: asyncio.Semaphore,
+    limit: int = 0,
+    router: Optional[ShardManager] = None,
+    semaphores: Optional[Dict[str, asyncio.Semaphore]] = None,
+    clients: Optional[Dict[str, TelegramClient]] = None,
+) -> int:
+    """
+    Backfill one dialog. On FloodWait a channel fails over to another account
+    when a router is given; other chats (message ids of one account) and runs
+    without a router sleep it out. With a router, semaphores and clients
+    (e.g. takeout sessions) are looked up by shard name, falling back to
+    semaphore and the shard's own client. Returns messages fetched.
+    """
+    semaphores = semaphores or {}
+    clients = clients or {}
+    job = DialogBackfill(client, dialog, writer, limit)
+    shard = router.owner(dialog.id) if router is not None else None
+    if shard is not None:
+        job.client = clients.get(shard.name, shard.client)
+        job.entity = await router.entity_for(shard, dialog.id)
+    while True:
+        try:
+            slot = semaphores.get(shard.name, semaphore) if shard is not None else semaphore
+            async with slot:
+                await job.run_once()
+            # The final state is recorded once the writer has stored the rows
+            while not await job.checkpoint():
+                await asyncio.sleep(CHECKPOINT_RETRY_SECONDS)
+            logger.info("Backfill of %s (id=%s) finished: %d messages", job.title, job.chat_id, job.stored)
+            return job.stored
+        except FloodWaitError as exc:
+            # Keep progress and free the slot for other dialogs while waiting
+            await job.checkpoint()
+            if shard is not None:
+                router.report_flood(shard, exc.seconds)
+            if shard is not None and is_channel(job.chat_id):
+                fallback = router.owner(job.chat_id)
+                if fallback is not None and fallback is not shard and fallback.available():
+                    logger.info("Backfill of chat id=%s moves to shard %s", job.chat_id, fallback.name)
+                    shard = fallback
+                    job.client = clients.get(shard.name, shard.client)
+                    job.entity = await router.entity_for(shard, job.chat_id)
+                    continue
+            logger.warning("FloodWait %ss for %s (id=%s), pausing this dialog", exc.seconds, job.title, job.chat_id)
+            await asyncio.sleep(exc.seconds + 1)
+
+
+async def _open_takeout(stack: AsyncExitStack, client: TelegramClient, name: str) -> TelegramClient:
+    """Enter a takeout session of client on stack; the client itself if not allowed yet."""
+    try:
+        return await stack.enter_async_context(
+            client.takeout(finalize=True, users=True, chats=True, megagroups=True, channels=True)
+        )
+    except TakeoutInitDelayError as exc:
+        logger.warning("Takeout for %s is not available for %ss yet, using the regular session", name, exc.seconds)
+        return client
+
+
+async def backfill_dialogs(
+    client: TelegramClient,
+    dialogs: List[Dialog],
+    writer: MessageWriter,
+    concurrency: int = 4,
+    limit: int = 0,
+    takeout: bool = False,
+    router: Optional[ShardManager] = None,
+) -> Dict[int, Any]:
+    """
+    Backfill many dialogs concurrently, at most concurrency at a time.
+    With a router every dialog is fetched by the account owning it and the
+    limit applies per account; with takeout every account fetches through
+    its own takeout session.
+    Returns {chat_id: messages fetched or the exception that stopped it}.
+    """
+    async with AsyncExitStack() as stack:
+        semaphore = asyncio.Semaphore(concurrency)
+        semaphores: Dict[str, asyncio.Semaphore] = {}
+        clients: Dict[str, TelegramClient] = {}
+        if router is not None:
+            for shard in router.started():
+                semaphores[shard.name] = asyncio.Semaphore(concurrency)
+                if takeout:
+                    clients[shard.name] = await _open_takeout(stack, shard.client, shard.name)
+        elif takeout:
+            client = await _open_takeout(stack, client, "the account")
+
+        accounts = max(len(semaphores), 1)
+        logger.info(
+            "Backfilling %d dialogs, %d at a time per account (%d accounts)", len(dialogs), concurrency, accounts
+        )
+        results = await asyncio.gather(
+            *(
+                backfill_dialog(client, dialog, writer, semaphore, limit, router, semaphores, clients)
+                for dialog in dialogs
+            ),
+            return_exceptions=True,
+        )
+    report = {}
+    for dialog, result in zip(dialogs, results):
+        if isinstance(result, BaseException):
+            logger.error("Backfill of chat id=%s failed: %s", dialog.id, result)
+        report[dialog.id] = result
+    logger.info("Entity cache: %s", entity_cache.stats())
+    return report
+
+
+async def run_backfill(
+    client: TelegramClient, writer: MessageWriter, router: Optional[ShardManager] = None
+) -> Dict[int, Any]:
+    """Backfill the dialogs configured by BACKFILL_DIALOGS."""
+    if not config.backfill_dialogs:
+        return {}
+    available = router.dialogs() if router is not None else await client.get_dialogs()
+    dialogs = select_dialogs(available, config.backfill_dialogs)
+    return await backfill_dialogs(
+        client,
+        dialogs,
+        writer,
+        concurrency=config.backfill_concurrency,
+        limit=config.backfill_limit,
+        takeout=config.backfill_takeout,
+        router=router,
+    )
+
+
+async def _main() -> None:
+    from connection import close_connection
+    from db import init_db
+    from main import build_client, ensure_config
+
+    ensure_config()
+    init_db()
+    writer = MessageWriter(
+        batch_size=config.ingest_batch_size,
+        flush_ms=config.ingest_flush_ms,
+        max_queue=config.ingest_queue_size,
+    )
+    await writer.start()
+    client = build_client()
+    await client.start()
+    try:
+        await run_backfill(client, writer)
+    finally:
+        await client.disconnect()
+        await writer.close()
+        close_connection()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+    )
+    asyncio.run(_main())
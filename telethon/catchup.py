@@ -0,0 +1,161 @@
+"""
+Gap detection and catch-up for the live listener.
+
+Messages posted while the listener was stopped or disconnected never reach
+the NewMessage handler. At startup and after every reconnect the newest
+known message id of each known chat is compared with the dialog's top
+message, and only the missing range is fetched with
+``iter_messages(min_id=...)``, for several chats in parallel. The newest id
+looked at is recorded (chat_seen) once the fetched rows are stored, so
+filtered-out messages are not fetched again on the next pass.
+"""
+import asyncio
+import logging
+from typing import Callable, Dict, Optional
+
+from telethon import TelegramClient, helpers
+from telethon.errors import FloodWaitError
+from telethon.tl import functions
+from telethon.tl.types import Dialog
+
+from db import get_chat_watermarks, save_chat_seen
+from entities import resolve_sender
+from filters import MessageFilter
+from records import message_to_row
+from writer import MessageWriter
+
+logger = logging.getLogger("tg-bot.catchup")
+
+# How often the connection state is checked for reconnects, seconds
+RECONNECT_POLL_SECONDS = 5
+# A ping slower than this means the connection is down, seconds
+PING_TIMEOUT_SECONDS = 10
+
+
+async def catch_up_dialog(
+    client: TelegramClient,
+    dialog: Dialog,
+    last_id: int,
+    writer: MessageWriter,
+    message_filter: MessageFilter,
+    on_flood: Optional[Callable[[int], None]] = None,
+) -> int:
+    """
+    Fetch messages of one dialog newer than last_id and record the newest id
+    seen once they are stored. Returns messages queued.
+    """
+    chat_title = dialog.name or getattr(dialog.entity, "title", None) or "Unknown"
+    start_id = last_id
+    queued = 0
+    while True:
+        try:
+            async for message in client.iter_messages(dialog.entity, min_id=last_id, reverse=True):
+                last_id = message.id
+                if not message_filter.allows(message.sender_id, message.message or ""):
+                    continue
+                sender = await resolve_sender(message, chat_title)
+                await writer.put(message_to_row(message, dialog.id, sender.label))
+                queued += 1
+            break
+        except FloodWaitError as exc:
+            # Resume after the pause from the last message seen
+            logger.warning("FloodWait %ss during catch-up of chat id=%s", exc.seconds, dialog.id)
+            if on_flood is not None:
+                on_flood(exc.seconds)
+            await asyncio.sleep(exc.seconds + 1)
+
+    if last_id > start_id:
+        # Never ahead of the data: the next pass refetches if the rows are lost
+        try:
+            await writer.flush()
+        except Exception as exc:
+            logger.warning("Catch-up of chat id=%s not recorded, rows not stored yet: %s", dialog.id, exc)
+        else:
+            await asyncio.to_thread(save_chat_seen, dialog.id, last_id)
+    return queued
+
+
+async def catch_up(
+    client: TelegramClient,
+    writer: MessageWriter,
+    message_filter: MessageFilter,
+    concurrency: int = 4,
+    owns: Optional[Callable[[int], bool]] = None,
+    on_flood: Optional[Callable[[int], None]] = None,
+) -> Dict[int, int]:
+    """
+    Fill the gaps of all known allowed chats whose top message is ahead of the DB.
+    With several accounts, ``owns`` limits the pass to this account's chats and
+    ``on_flood`` reports its flood waits. Returns {chat_id: messages queued}.
+    """
+    watermarks = await asyncio.to_thread(get_chat_watermarks)
+    if not watermarks:
+        return {}
+
+    dialogs = await client.get_dialogs()
+    behind = [
+        dialog for dialog in dialogs
+        if dialog.id in watermarks
+        and message_filter.allows_chat(dialog.id)
+        and (owns is None or owns(dialog.id))
+        and dialog.dialog.top_message > watermarks[dialog.id]
+    ]
+    if not behind:
+        logger.info("No gaps detected")
+        return {}
+
+    logger.info("Catching up %d chats", len(behind))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(dialog: Dialog) -> int:
+        async with semaphore:
+            return await catch_up_dialog(client, dialog, watermarks[dialog.id], writer, message_filter, on_flood)
+
+    results = await asyncio.gather(*(run(dialog) for dialog in behind), return_exceptions=True)
+    report = {}
+    for dialog, result in zip(behind, results):
+        if isinstance(result, BaseException):
+            logger.error("Catch-up of chat id=%s failed: %s", dialog.id, result)
+            continue
+        logger.info("Chat id=%s: %d missed messages recovered", dialog.id, result)
+        report[dialog.id] = result
+    return report
+
+
+async def _ping(client: TelegramClient) -> bool:
+    """
+    Whether requests get through right now. is_connected() stays True while
+    Telethon reconnects by itself, but a ping waits until the connection is
+    back, so a timeout means it is down.
+    """
+    try:
+        await asyncio.wait_for(
+            client(functions.PingRequest(helpers.generate_random_long())), PING_TIMEOUT_SECONDS
+        )
+    except Exception:  # timeout, ConnectionError after disconnect(), ...
+        return False
+    return True
+
+
+async def watch_reconnects(
+    client: TelegramClient,
+    writer: MessageWriter,
+    message_filter: MessageFilter,
+    concurrency: int = 4,
+    owns: Optional[Callable[[int], bool]] = None,
+    on_flood: Optional[Callable[[int], None]] = None,
+) -> None:
+    """Run catch_up() every time the connection comes back after a drop."""
+    was_up = await _ping(client)
+    while client.is_connected():
+        await asyncio.sleep(RECONNECT_POLL_SECONDS)
+        is_up = await _ping(client)
+        if is_up and not was_up:
+            logger.info("Connection restored, checking for missed messages")
+            try:
+                await catch_up(client, writer, message_filter, concurrency, owns, on_flood)
+            except Exception as exc:  # keep watching on transient errors
+                logger.error("Catch-up after reconnect failed: %s", exc)
+                # Retry on the next poll
+                is_up = False
+        was_up = is_up
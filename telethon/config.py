@@ -14,5 +14,46 @@ api_hash: str = os.getenv("api_hash") or ""
 # Telethon session name; a .session file will be created locally
 session_name: str = os.getenv("session_name") or "tg_session"
 
+# Session storage: "sqlite" - Telethon's .session file written continuously,
+# "memory" - in-memory session saved to the same file by periodic atomic snapshots (see session_store.py)
+session_storage: str = (os.getenv("SESSION_STORAGE") or "sqlite").lower()
+session_flush_seconds: int = int(os.getenv("SESSION_FLUSH_SECONDS") or 60)
+
 # Bot username to monitor (optional, if empty - monitors all chats)
 bot_username: str = os.getenv("MONITOR_BOT_USERNAME") or "@ED_Zerocoder_intensive_bot"
+
+# Filter rules of the live listener (see filters.py).
+# Comma-separated chat ids / @usernames; defaults to the monitored bot chat
+filter_chats: str = os.getenv("FILTER_CHATS") or bot_username
+# Senders whose messages are never stored
+filter_blocked_senders: str = os.getenv("FILTER_BLOCKED_SENDERS") or "@ED_Zerocoder_intensive_bot"
+# Regex of message texts to ignore: commands and summarizer bot buttons
+filter_ignore_pattern: str = os.getenv("FILTER_IGNORE_PATTERN") or r"^/|^(📊 Статус|📝 Саммаризация)$"
+# Optional JSON file with the same rules: {"chats": [], "blocked_senders": [], "ignore_patterns": []}
+filter_rules_file: str = os.getenv("FILTER_RULES_FILE") or ""
+
+# Write-behind batching of incoming messages (see writer.py)
+ingest_batch_size: int = int(os.getenv("INGEST_BATCH_SIZE") or 500)
+ingest_flush_ms: int = int(os.getenv("INGEST_FLUSH_MS") or 200)
+ingest_queue_size: int = int(os.getenv("INGEST_QUEUE_SIZE") or 10_000)
+
+# History backfill (see backfill.py)
+# BACKFILL_DIALOGS: empty - no backfill, "all" - every dialog,
+# or a comma-separated list of chat ids / @usernames
+backfill_dialogs: str = os.getenv("BACKFILL_DIALOGS") or ""
+backfill_concurrency: int = int(os.getenv("BACKFILL_CONCURRENCY") or 4)
+# Max older-history messages per dialog, over all runs (0 - the whole history)
+backfill_limit: int = int(os.getenv("BACKFILL_LIMIT") or 0)
+# Use a takeout session (higher export limits, requires confirmation in Telegram)
+backfill_takeout: bool = (os.getenv("BACKFILL_TAKEOUT") or "").lower() in {"1", "true", "yes", "y"}
+
+# Gap catch-up on startup/reconnect: number of chats fetched in parallel
+catchup_concurrency: int = int(os.getenv("CATCHUP_CONCURRENCY") or 4)
+
+# Cache of resolved senders/chats (see entities.py)
+entity_cache_size: int = int(os.getenv("ENTITY_CACHE_SIZE") or 5000)
+entity_cache_ttl: int = int(os.getenv("ENTITY_CACHE_TTL") or 3600)
+
+# Extra accounts for sharded ingestion (see sharding.py):
+# comma-separated "session" or "session:api_id:api_hash"
+extra_accounts: str = os.getenv("EXTRA_ACCOUNTS") or ""
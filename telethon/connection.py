@@ -0,0 +1,143 @@
+"""
+Shared SQLite connection manager.
+
+Every process (Telethon listener, summary bot, Flask dashboard, Mini App)
+talks to the same ``messages.db``. Instead of opening a new connection per
+statement, each thread gets one long-lived connection configured for WAL
+mode, so readers never block the writer and commits do not fsync per row.
+"""
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+# Single location of the database for all processes (can be overridden via env)
+DB_PATH = Path(os.getenv("MESSAGES_DB_PATH") or ROOT_DIR / "messages.db")
+
+# Pragmas applied to every new connection
+BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS") or 5000)
+CACHE_SIZE_KIB = int(os.getenv("SQLITE_CACHE_SIZE_KIB") or 20_000)
+MMAP_SIZE_BYTES = int(os.getenv("SQLITE_MMAP_SIZE") or 256 * 1024 * 1024)
+# Idle connections kept for short-lived threads (web requests)
+POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE") or 8)
+
+_local = threading.local()
+_pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=POOL_SIZE)
+
+
+def _configure(conn: sqlite3.Connection) -> None:
+    """Apply WAL mode and performance pragmas to a fresh connection."""
+    conn.execute("PRAGMA journal_mode = WAL")
+    # NORMAL is durable in WAL mode except for the last commits on power loss
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    # Negative value means size in KiB rather than in pages
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE_BYTES}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA foreign_keys = ON")
+
+
+def connect(db_path: Optional[Path] = None, check_same_thread: bool = True) -> sqlite3.Connection:
+    """
+    Open a new configured connection.
+
+    Connections work in autocommit mode: writes are grouped explicitly
+    with ``transaction()``. Pooled connections move between threads
+    (one at a time) and are opened with check_same_thread=False.
+    """
+    conn = sqlite3.connect(
+        db_path or DB_PATH,
+        isolation_level=None,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=check_same_thread,
+    )
+    conn.row_factory = sqlite3.Row
+    _configure(conn)
+    return conn
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Return the connection bound to the current thread, creating it on first use.
+
+    Asyncio tasks run on the loop thread and therefore share its connection;
+    this is safe because sqlite3 calls never yield to the event loop.
+    Short-lived threads (e.g. a threaded WSGI server's request threads)
+    should use ``acquire_connection()`` / ``release_connection()`` instead.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = connect()
+        _local.conn = conn
+    return conn
+
+
+def acquire_connection() -> sqlite3.Connection:
+    """
+    Bind a pooled connection to the current thread (opening one if the pool
+    is empty), so get_connection() in this thread reuses it. A thread that
+    already has its own connection keeps it.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        try:
+            conn = _pool.get_nowait()
+        except queue.Empty:
+            conn = connect(check_same_thread=False)
+        _local.conn = conn
+        _local.pooled = True
+    return conn
+
+
+def release_connection() -> None:
+    """Return the current thread's pooled connection (closed if the pool is full)."""
+    conn = getattr(_local, "conn", None)
+    if conn is None or not getattr(_local, "pooled", False):
+        return
+    _local.conn = None
+    _local.pooled = False
+    if conn.in_transaction:
+        # Left open by an error: never hand it over mid-transaction
+        conn.execute("ROLLBACK")
+    try:
+        _pool.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+
+def close_connection() -> None:
+    """Close the current thread's connection (e.g. on shutdown)."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+        _local.pooled = False
+
+
+@contextmanager
+def transaction(conn: Optional[sqlite3.Connection] = None) -> Iterator[sqlite3.Connection]:
+    """
+    Run a block of statements in one write transaction.
+
+    Uses BEGIN IMMEDIATE so the write lock is taken up front and waits on
+    busy_timeout instead of failing with "database is locked" on upgrade.
+    Nested calls join the outer transaction.
+    """
+    conn = conn or get_connection()
+    if conn.in_transaction:
+        yield conn
+        return
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
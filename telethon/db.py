@@ -1,99 +1,594 @@
 import sqlite3
-from contextlib import closing
-from pathlib import Path
-from typing import Any, Dict, List, Optional
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple, Union
 
-DB_PATH = Path("messages.db")
+from connection import DB_PATH, get_connection, transaction  # noqa: F401
+from migrations import migrate
+from pagination import decode_cursor, encode_cursor
+
+# Строка message_stats с общими счётчиками (id чата Telegram не бывает 0)
+GLOBAL_STATS_CHAT_ID = 0
 
 
 def init_db() -> None:
     """
-    Initialize the SQLite database and ensure the messages table exists.
+    Initialize the SQLite database and bring its schema up to date.
     """
-    with closing(sqlite3.connect(DB_PATH)) as conn:
-        conn.execute(
+    migrate()
+
+
+def to_epoch_ms(value: Union[None, str, datetime]) -> int:
+    """
+    Convert a datetime or ISO string (any offset; naive means UTC) to UTC
+    epoch milliseconds. Returns 0 when the value is missing or unparseable.
+    """
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return 0
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+def _with_date_ms(message_data: Dict[str, Any]) -> Dict[str, Any]:
+    if message_data.get("date_ms"):
+        return message_data
+    return {**message_data, "date_ms": to_epoch_ms(message_data.get("date"))}
+
+
+def save_summary(
+    summary_text: str,
+    messages: List[Dict[str, Any]],
+    model: Optional[str] = None,
+    latency_ms: Optional[int] = None,
+    usage: Optional[Dict[str, int]] = None,
+) -> int:
+    """
+    Сохранить саммаризацию в таблицу summaries и связать её с сообщениями.
+
+    messages — покрытые саммаризацией сообщения (ключи chat_id, id).
+    Возвращает id саммаризации.
+    """
+    usage = usage or {}
+    chat_id, first_id, last_id = _summary_range(messages)
+    with transaction() as conn:
+        cursor = conn.execute(
             """
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY,
-                chat_id INTEGER NOT NULL,
-                sender TEXT,
-                text TEXT,
-                date TEXT,
-                summarized INTEGER DEFAULT 0
+            INSERT INTO summaries (
+                chat_id, first_message_id, last_message_id, message_count, text,
+                model, latency_ms, prompt_tokens, completion_tokens, total_tokens
             )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                chat_id,
+                first_id,
+                last_id,
+                len(messages),
+                summary_text,
+                model,
+                latency_ms,
+                usage.get("prompt_tokens"),
+                usage.get("completion_tokens"),
+                usage.get("total_tokens"),
+            ),
+        )
+        summary_id = cursor.lastrowid
+        _link_summary(conn, summary_id, messages)
+    return summary_id
+
+
+def _summary_range(messages: List[Dict[str, Any]]) -> Tuple[Optional[int], Optional[int], Optional[int]]:
+    # chat_id и диапазон id известны, только если все сообщения из одного чата
+    chat_ids = {msg["chat_id"] for msg in messages}
+    if len(chat_ids) != 1:
+        return None, None, None
+    ids = [msg["id"] for msg in messages]
+    return chat_ids.pop(), min(ids), max(ids)
+
+
+def _link_summary(conn: sqlite3.Connection, summary_id: int, messages: List[Dict[str, Any]]) -> None:
+    conn.executemany(
+        "INSERT OR IGNORE INTO summary_messages (chat_id, message_id, summary_id) VALUES (?, ?, ?)",
+        [(msg["chat_id"], msg["id"], summary_id) for msg in messages],
+    )
+
+
+def claim_stale_summaries(limit: int = 5, lease_seconds: int = 300) -> List[Dict[str, Any]]:
+    """
+    Атомарно захватить устаревшие саммаризации (сообщения которых
+    отредактированы или удалены) для пересчёта.
+
+    Возвращает [{id, chat_id, messages}], где messages — ещё существующие
+    сообщения саммаризации в хронологическом порядке. Захват с истёкшей
+    арендой (упавший воркер) может быть перехвачен заново.
+    """
+    with transaction() as conn:
+        rows = conn.execute(
+            """
+            UPDATE summaries SET stale = 2, updated_at = datetime('now')
+            WHERE id IN (
+                SELECT id FROM summaries
+                WHERE stale != 0 AND (stale = 1 OR updated_at < datetime('now', ?))
+                ORDER BY id LIMIT ?
+            )
+            RETURNING id, chat_id
+            """,
+            (f"-{lease_seconds} seconds", limit),
+        ).fetchall()
+        claimed = []
+        for row in sorted(rows, key=lambda r: r["id"]):
+            messages = conn.execute(
+                """
+                SELECT m.id, m.chat_id, m.sender, m.text, m.date, m.date_ms
+                FROM summary_messages sm
+                JOIN messages m ON m.chat_id = sm.chat_id AND m.id = sm.message_id
+                WHERE sm.summary_id = ?
+                ORDER BY m.date_ms, m.chat_id, m.id
+                """,
+                (row["id"],),
+            ).fetchall()
+            claimed.append({"id": row["id"], "chat_id": row["chat_id"], "messages": [dict(m) for m in messages]})
+    return claimed
+
+
+def replace_summary(
+    summary_id: int,
+    summary_text: str,
+    messages: List[Dict[str, Any]],
+    model: Optional[str] = None,
+    latency_ms: Optional[int] = None,
+    usage: Optional[Dict[str, int]] = None,
+) -> None:
+    """
+    Заменить текст устаревшей саммаризации пересчитанным.
+
+    Если за время пересчёта сообщения снова изменились, саммаризация
+    остаётся устаревшей и будет пересчитана ещё раз.
+    """
+    usage = usage or {}
+    chat_id, first_id, last_id = _summary_range(messages)
+    with transaction() as conn:
+        conn.execute(
             """
+            UPDATE summaries SET
+                first_message_id = CASE WHEN chat_id IS NOT NULL THEN ? ELSE first_message_id END,
+                last_message_id = CASE WHEN chat_id IS NOT NULL THEN ? ELSE last_message_id END,
+                message_count = ?, text = ?, model = ?, latency_ms = ?,
+                prompt_tokens = ?, completion_tokens = ?, total_tokens = ?,
+                updated_at = datetime('now'),
+                stale = CASE WHEN stale = 2 THEN 0 ELSE stale END
+            WHERE id = ?
+            """,
+            (
+                first_id,
+                last_id,
+                len(messages),
+                summary_text,
+                model,
+                latency_ms,
+                usage.get("prompt_tokens"),
+                usage.get("completion_tokens"),
+                usage.get("total_tokens"),
+                summary_id,
+            ),
         )
-        # Добавляем колонку summarized, если её нет (для существующих БД)
-        try:
-            conn.execute("ALTER TABLE messages ADD COLUMN summarized INTEGER DEFAULT 0")
-        except sqlite3.OperationalError:
-            pass  # колонка уже существует
-        conn.commit()
+        conn.execute("DELETE FROM summary_messages WHERE summary_id = ?", (summary_id,))
+        _link_summary(conn, summary_id, messages)
+
+
+def delete_summary(summary_id: int) -> None:
+    """Удалить саммаризацию (например, когда все её сообщения удалены)."""
+    get_connection().execute("DELETE FROM summaries WHERE id = ?", (summary_id,))
+
+
+def release_stale_summaries(summary_ids: List[int]) -> None:
+    """Вернуть захваченные саммаризации в очередь пересчёта (при ошибке)."""
+    get_connection().executemany(
+        "UPDATE summaries SET stale = 1 WHERE id = ? AND stale = 2",
+        [(summary_id,) for summary_id in summary_ids],
+    )
+
+
+def get_recent_summaries(limit: int = 10) -> List[Dict[str, Any]]:
+    """
+    Получить последние саммаризации (новые первыми).
+    """
+    cursor = get_connection().execute(
+        """
+        SELECT id, chat_id, first_message_id, last_message_id, message_count, text,
+               model, latency_ms, total_tokens, created_at
+        FROM summaries
+        ORDER BY created_at DESC
+        LIMIT ?
+        """,
+        (limit,),
+    )
+    return [dict(row) for row in cursor.fetchall()]
+
+
+def get_summary_for_message(chat_id: int, message_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Найти последнюю саммаризацию, покрывшую сообщение (chat_id, message_id).
+    """
+    row = get_connection().execute(
+        """
+        SELECT s.id, s.chat_id, s.message_count, s.text, s.model, s.created_at
+        FROM summary_messages sm
+        JOIN summaries s ON s.id = sm.summary_id
+        WHERE sm.chat_id = ? AND sm.message_id = ?
+        ORDER BY s.id DESC
+        LIMIT 1
+        """,
+        (chat_id, message_id),
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def get_statistics(chat_id: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Получить статистику (глобально или по чату) из счётчиков message_stats.
+
+    Счётчики поддерживаются триггерами, поэтому это O(1) вне зависимости
+    от размера таблицы messages.
+    """
+    row = get_connection().execute(
+        "SELECT total, summarized, claimable, summaries, last_summary_at FROM message_stats WHERE chat_id = ?",
+        (GLOBAL_STATS_CHAT_ID if chat_id is None else chat_id,),
+    ).fetchone()
+    total = row["total"] if row else 0
+    analyzed = row["summarized"] if row else 0
+    # Очередь саммаризатора: сообщения без текста (только медиа) в неё не попадают
+    claimable = row["claimable"] if row else 0
+    # Частичный индекс idx_summaries_stale покрывает только устаревшие строки
+    stale = get_connection().execute(
+        "SELECT COUNT(*) FROM summaries WHERE stale != 0 AND (? IS NULL OR chat_id = ?)",
+        (chat_id, chat_id),
+    ).fetchone()[0]
+    return {
+        "total": total,
+        "analyzed": analyzed,
+        "unsummarized": claimable,
+        "summaries": row["summaries"] if row else 0,
+        "last_summary": (row["last_summary_at"] if row else None) or "Нет данных",
+        "percentage": round((analyzed / (analyzed + claimable) * 100) if analyzed + claimable > 0 else 0, 1),
+        "stale_summaries": stale,
+    }
+
+
+def get_messages_page(
+    limit: int = 50, cursor: Optional[str] = None, direction: str = "next"
+) -> Tuple[List[Dict[str, Any]], Optional[str], Optional[str]]:
+    """
+    Страница сообщений (новые первыми) с курсорной пагинацией по (date_ms, chat_id, id).
+
+    Стоимость не зависит от глубины страницы, в отличие от LIMIT/OFFSET.
+    direction="next" — более старые сообщения после cursor, "prev" — более новые.
+    Возвращает (messages, next_cursor, prev_cursor); None — страниц дальше нет.
+    """
+    key = decode_cursor(cursor, 3)
+    conn = get_connection()
+    columns = """chat_id, id, sender, text, date, date_ms, summarized,
+        (SELECT kind FROM message_media
+         WHERE message_media.chat_id = messages.chat_id AND message_media.message_id = messages.id) AS media_kind"""
+    if key is None:
+        rows = conn.execute(
+            f"SELECT {columns} FROM messages ORDER BY date_ms DESC, chat_id DESC, id DESC LIMIT ?",
+            (limit + 1,),
+        ).fetchall()
+    elif direction == "prev":
+        rows = conn.execute(
+            f"""
+            SELECT {columns} FROM messages
+            WHERE (date_ms, chat_id, id) > (?, ?, ?)
+            ORDER BY date_ms ASC, chat_id ASC, id ASC
+            LIMIT ?
+            """,
+            (*key, limit + 1),
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            f"""
+            SELECT {columns} FROM messages
+            WHERE (date_ms, chat_id, id) < (?, ?, ?)
+            ORDER BY date_ms DESC, chat_id DESC, id DESC
+            LIMIT ?
+            """,
+            (*key, limit + 1),
+        ).fetchall()
+
+    has_more = len(rows) > limit
+    messages = [dict(row) for row in rows[:limit]]
+    if key is not None and direction == "prev":
+        messages.reverse()
+        has_newer, has_older = has_more, True
+    else:
+        has_newer, has_older = key is not None, has_more
+
+    def _key(msg: Dict[str, Any]) -> str:
+        return encode_cursor(msg["date_ms"], msg["chat_id"], msg["id"])
+
+    next_cursor = _key(messages[-1]) if messages and has_older else None
+    prev_cursor = _key(messages[0]) if messages and has_newer else None
+    return messages, next_cursor, prev_cursor
 
 
-def save_message(message_data: Dict[str, Any]) -> None:
+def get_messages_in_window(
+    start_ms: int,
+    end_ms: Optional[int] = None,
+    chat_id: Optional[int] = None,
+    limit: int = 1000,
+) -> List[Dict[str, Any]]:
     """
-    Persist a message to the database if it is not already stored.
+    Сообщения за интервал [start_ms, end_ms) в хронологическом порядке,
+    по всем чатам или по одному чату. Время — миллисекунды эпохи UTC.
+    """
+    end_ms = end_ms if end_ms is not None else int(time.time() * 1000) + 1
+    columns = "chat_id, id, sender, text, date, date_ms, summarized"
+    if chat_id is None:
+        rows = get_connection().execute(
+            f"""
+            SELECT {columns} FROM messages
+            WHERE date_ms >= ? AND date_ms < ?
+            ORDER BY date_ms ASC
+            LIMIT ?
+            """,
+            (start_ms, end_ms, limit),
+        ).fetchall()
+    else:
+        rows = get_connection().execute(
+            f"""
+            SELECT {columns} FROM messages
+            WHERE chat_id = ? AND date_ms >= ? AND date_ms < ?
+            ORDER BY date_ms ASC
+            LIMIT ?
+            """,
+            (chat_id, start_ms, end_ms, limit),
+        ).fetchall()
+    return [dict(row) for row in rows]
+
 
-    message_data expects keys: id, chat_id, sender, text, date
+def get_recent_messages(hours: float = 24, chat_id: Optional[int] = None, limit: int = 1000) -> List[Dict[str, Any]]:
+    """
+    Сообщения за последние `hours` часов (например, «последние 24 часа чата X»).
     """
-    with closing(sqlite3.connect(DB_PATH)) as conn:
+    start_ms = int((time.time() - hours * 3600) * 1000)
+    return get_messages_in_window(start_ms, chat_id=chat_id, limit=limit)
+
+
+def save_messages(messages: List[Dict[str, Any]]) -> int:
+    """
+    Persist a batch of messages in a single transaction.
+
+    Messages are keyed by (chat_id, id), duplicates are ignored. Expected
+    keys: id, chat_id, sender, text, date (date_ms is derived from date when
+    not given); an optional "media" key holds the message's media metadata (see media.media_metadata).
+    Returns the number of rows actually inserted.
+    """
+    if not messages:
+        return 0
+    with transaction() as conn:
         # Avoid duplicates via INSERT OR IGNORE on the primary key
-        conn.execute(
+        cursor = conn.executemany(
             """
-            INSERT OR IGNORE INTO messages (id, chat_id, sender, text, date, summarized)
-            VALUES (:id, :chat_id, :sender, :text, :date, 0)
+            INSERT OR IGNORE INTO messages (id, chat_id, sender, text, date, date_ms, summarized)
+            VALUES (:id, :chat_id, :sender, :text, :date, :date_ms, 0)
             """,
-            message_data,
+            [_with_date_ms(msg) for msg in messages],
         )
-        conn.commit()
+        # rowcount, unlike total_changes, ignores rows written by triggers
+        inserted = cursor.rowcount
+        # Media metadata (records.message_to_row), no files are downloaded here
+        media = [
+            {**msg["media"], "chat_id": msg["chat_id"], "message_id": msg["id"]}
+            for msg in messages
+            if msg.get("media")
+        ]
+        if media:
+            conn.executemany(
+                """
+                INSERT OR IGNORE INTO message_media
+                    (chat_id, message_id, kind, mime_type, size, file_name, duration, file_id, file_reference)
+                VALUES
+                    (:chat_id, :message_id, :kind, :mime_type, :size, :file_name, :duration, :file_id, :file_reference)
+                """,
+                media,
+            )
+        return inserted
 
 
-def get_unsummarized_messages(limit: int = 100) -> List[Dict[str, Any]]:
+def save_message_edits(messages: List[Dict[str, Any]]) -> int:
     """
-    Получить несаммаризованные сообщения из БД.
-    Возвращает список словарей с ключами: id, chat_id, sender, text, date.
+    Применить правки сообщений (UPSERT по ключу chat_id, id).
+
+    Текст заменяется, только если правка не старше сохранённой (edited_ms)
+    и текст действительно изменился; неизвестные сообщения вставляются.
+    Триггеры обновляют поисковый индекс и помечают затронутые саммаризации.
+    Возвращает количество изменённых строк.
     """
-    with closing(sqlite3.connect(DB_PATH)) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.execute(
+    if not messages:
+        return 0
+    with transaction() as conn:
+        cursor = conn.executemany(
             """
-            SELECT id, chat_id, sender, text, date
-            FROM messages
-            WHERE summarized = 0 AND text IS NOT NULL AND text != ''
-            ORDER BY date ASC
-            LIMIT ?
+            INSERT INTO messages (id, chat_id, sender, text, date, date_ms, summarized, edited_ms)
+            VALUES (:id, :chat_id, :sender, :text, :date, :date_ms, 0, :edited_ms)
+            ON CONFLICT (chat_id, id) DO UPDATE SET
+                text = excluded.text,
+                edited_ms = excluded.edited_ms
+            WHERE excluded.edited_ms >= COALESCE(messages.edited_ms, 0)
+              AND messages.text IS NOT excluded.text
             """,
-            (limit,),
+            [_with_date_ms(msg) for msg in messages],
         )
-        return [dict(row) for row in cursor.fetchall()]
+        return cursor.rowcount
 
 
-def mark_as_summarized(message_id: int) -> None:
+def delete_messages(chat_ids: List[int], message_ids: List[int]) -> int:
     """
-    Пометить сообщение как саммаризованное.
+    Удалить сообщения message_ids из любого из чатов chat_ids.
+
+    Несколько чатов нужны для личных чатов и обычных групп: Telegram не
+    сообщает чат удаления, но id сообщений там уникальны в пределах аккаунта.
+    Возвращает количество удалённых строк.
     """
-    with closing(sqlite3.connect(DB_PATH)) as conn:
-        conn.execute(
-            "UPDATE messages SET summarized = 1 WHERE id = ?",
-            (message_id,),
+    if not chat_ids or not message_ids:
+        return 0
+    with transaction() as conn:
+        cursor = conn.executemany(
+            "DELETE FROM messages WHERE chat_id = ? AND id = ?",
+            [(chat_id, message_id) for chat_id in chat_ids for message_id in message_ids],
         )
-        conn.commit()
+        return cursor.rowcount
 
 
-def save_summary(message_id: int, summary_text: str) -> None:
+def apply_message_changes(
+    inserts: List[Dict[str, Any]],
+    edits: List[Dict[str, Any]],
+    deletes: List[Tuple[List[int], List[int]]],
+) -> int:
     """
-    Сохранить саммаризацию в отдельную запись (как ответ бота).
+    Записать пачку изменений одной транзакцией: вставки, затем правки,
+    затем удаления (в том порядке, в котором они происходят в Telegram).
+    Возвращает количество вставленных сообщений.
     """
-    with closing(sqlite3.connect(DB_PATH)) as conn:
-        # Генерируем уникальный ID для саммаризации
-        summary_id = message_id * 10_000 + 9999
-        conn.execute(
+    with transaction():
+        inserted = save_messages(inserts)
+        save_message_edits(edits)
+        for chat_ids, message_ids in deletes:
+            delete_messages(chat_ids, message_ids)
+    return inserted
+
+
+def get_backfill_state(chat_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Прогресс выгрузки истории чата: min_id, max_id, done, fetched (или None).
+    """
+    row = get_connection().execute(
+        "SELECT chat_id, min_id, max_id, done, fetched, updated_at FROM backfill_state WHERE chat_id = ?",
+        (chat_id,),
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def save_backfill_state(
+    chat_id: int, min_id: Optional[int], max_id: Optional[int], done: bool, fetched: int = 0
+) -> None:
+    """
+    Записать прогресс выгрузки истории чата (high-water marks и число
+    загруженных старых сообщений — для BACKFILL_LIMIT между запусками).
+    """
+    get_connection().execute(
+        """
+        INSERT INTO backfill_state (chat_id, min_id, max_id, done, fetched, updated_at)
+        VALUES (?, ?, ?, ?, ?, datetime('now'))
+        ON CONFLICT (chat_id) DO UPDATE SET
+            min_id = excluded.min_id,
+            max_id = excluded.max_id,
+            done = excluded.done,
+            fetched = excluded.fetched,
+            updated_at = excluded.updated_at
+        """,
+        (chat_id, min_id, max_id, int(done), fetched),
+    )
+
+
+def get_chat_watermarks() -> Dict[int, int]:
+    """
+    Максимальный известный id сообщения по каждому чату: {chat_id: max_id} —
+    сохранённый или просмотренный догрузкой (chat_seen), что больше.
+    Список чатов берётся из message_stats, MAX(id) читается по первичному ключу.
+    """
+    rows = get_connection().execute(
+        """
+        SELECT s.chat_id,
+               MAX(
+                   COALESCE((SELECT MAX(m.id) FROM messages m WHERE m.chat_id = s.chat_id), 0),
+                   COALESCE((SELECT c.seen_id FROM chat_seen c WHERE c.chat_id = s.chat_id), 0)
+               ) AS max_id
+        FROM message_stats s
+        WHERE s.chat_id != ? AND s.total > 0
+        """,
+        (GLOBAL_STATS_CHAT_ID,),
+    ).fetchall()
+    return {row["chat_id"]: row["max_id"] for row in rows if row["max_id"]}
+
+
+def save_chat_seen(chat_id: int, seen_id: int) -> None:
+    """
+    Запомнить самый новый id сообщения, просмотренный догрузкой чата, в том
+    числе отфильтрованного. Вызывать только после того, как сообщения до
+    него записаны.
+    """
+    get_connection().execute(
+        """
+        INSERT INTO chat_seen (chat_id, seen_id) VALUES (?, ?)
+        ON CONFLICT (chat_id) DO UPDATE SET seen_id = MAX(seen_id, excluded.seen_id)
+        """,
+        (chat_id, seen_id),
+    )
+
+
+def claim_unsummarized(limit: int = 100, lease_seconds: int = 300) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Атомарно захватить пачку несаммаризованных сообщений.
+
+    Сообщения помечаются токеном захвата с временем аренды, поэтому
+    параллельные воркеры не получат одни и те же строки. Захват с истёкшей
+    арендой (упавший воркер) может быть перехвачен заново.
+    Возвращает (claim_token, сообщения в хронологическом порядке).
+    """
+    token = uuid.uuid4().hex
+    now = time.time()
+    with transaction() as conn:
+        rows = conn.execute(
             """
-            INSERT OR REPLACE INTO messages (id, chat_id, sender, text, date, summarized)
-            VALUES (?, (SELECT chat_id FROM messages WHERE id = ?), 'bot_summary', ?, datetime('now'), 1)
+            UPDATE messages
+            SET claim_token = ?, claim_expires = ?
+            WHERE (chat_id, id) IN (
+                SELECT chat_id, id FROM messages
+                WHERE summarized = 0 AND text IS NOT NULL AND text != ''
+                  AND (claim_token IS NULL OR claim_expires < ?)
+                ORDER BY date_ms ASC
+                LIMIT ?
+            )
+            RETURNING id, chat_id, sender, text, date, date_ms
             """,
-            (summary_id, message_id, summary_text),
-        )
-        conn.commit()
+            (token, now + lease_seconds, now, limit),
+        ).fetchall()
+    # RETURNING does not guarantee order
+    messages = sorted((dict(row) for row in rows), key=lambda m: (m["date_ms"], m["chat_id"], m["id"]))
+    return token, messages
 
+
+def complete_claim(claim_token: str) -> int:
+    """
+    Пометить все сообщения захвата как саммаризованные одним запросом.
+    Возвращает количество обновлённых строк.
+    """
+    cursor = get_connection().execute(
+        """
+        UPDATE messages
+        SET summarized = 1, claim_token = NULL, claim_expires = NULL
+        WHERE claim_token = ?
+        """,
+        (claim_token,),
+    )
+    return cursor.rowcount
+
+
+def release_claim(claim_token: str) -> int:
+    """
+    Вернуть сообщения захвата в очередь (например, при ошибке GigaChat).
+    """
+    cursor = get_connection().execute(
+        "UPDATE messages SET claim_token = NULL, claim_expires = NULL WHERE claim_token = ?",
+        (claim_token,),
+    )
+    return cursor.rowcount
@@ -0,0 +1,126 @@
+"""
+Cache of resolved senders and chats for the ingester.
+
+A chat has only a handful of distinct senders, yet every message used to
+await ``get_sender()`` / ``get_chat()`` and re-run ``format_sender``. The
+cache keeps the formatted label and username per peer id in a bounded LRU;
+entries expire after a TTL and are dropped early on profile/title updates.
+Sender and chat labels are kept under separate keys: in a private chat the
+chat id is the other user's id, but the two labels are built differently.
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from telethon import utils
+from telethon.tl import types
+
+import config
+from records import format_sender
+
+
+# Cache key namespaces
+SENDER = "sender"
+CHAT = "chat"
+
+Key = Tuple[str, int]
+
+
+class PeerInfo(NamedTuple):
+    """Resolved peer: display label and username (duck-types a Telethon entity)."""
+
+    label: str
+    username: Optional[str] = None
+
+
+class EntityCache:
+    """Bounded LRU with per-entry TTL and hit/miss counters."""
+
+    def __init__(self, max_size: int = 5000, ttl: float = 3600) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Key, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Key) -> Optional[PeerInfo]:
+        entry = self._data.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key: Key, info: PeerInfo) -> None:
+        self._data[key] = (info, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, peer_id: int) -> None:
+        """Drop both the sender and the chat label of a peer."""
+        self._data.pop((SENDER, peer_id), None)
+        self._data.pop((CHAT, peer_id), None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups * 100, 1) if lookups else 0.0,
+        }
+
+
+# Shared by the live listener, catch-up and backfill
+cache = EntityCache(config.entity_cache_size, config.entity_cache_ttl)
+
+
+async def resolve_sender(message: Any, chat_title: str) -> PeerInfo:
+    """Sender label/username of a message, fetching the entity only on a miss."""
+    peer_id = message.sender_id
+    if peer_id is None:
+        return PeerInfo(chat_title or "Unknown")
+    info = cache.get((SENDER, peer_id))
+    if info is None:
+        sender = await message.get_sender()
+        info = PeerInfo(format_sender(sender, chat_title), getattr(sender, "username", None))
+        # Without the entity the label is just the chat title, don't remember it
+        if sender is not None:
+            cache.put((SENDER, peer_id), info)
+    return info
+
+
+async def resolve_chat(event: Any) -> PeerInfo:
+    """Chat title/username of an event, fetching the entity only on a miss."""
+    info = cache.get((CHAT, event.chat_id))
+    if info is None:
+        chat = await event.get_chat()
+        username = getattr(chat, "username", None)
+        if isinstance(chat, types.User):
+            # Private chat: named after the other user
+            label = format_sender(chat, "Unknown")
+        else:
+            label = getattr(chat, "title", None) or username or "Unknown"
+        info = PeerInfo(label, username)
+        if chat is not None:
+            cache.put((CHAT, event.chat_id), info)
+    return info
+
+
+async def handle_peer_update(update: Any) -> None:
+    """Raw update handler: drop cached entries on renames and title changes."""
+    if isinstance(update, (types.UpdateUserName, types.UpdateUser)):
+        cache.invalidate(update.user_id)
+    elif isinstance(update, types.UpdateChannel):
+        cache.invalidate(utils.get_peer_id(types.PeerChannel(update.channel_id)))
+    elif isinstance(update, (types.UpdateNewMessage, types.UpdateNewChannelMessage)):
+        message = update.message
+        if isinstance(getattr(message, "action", None), types.MessageActionChatEditTitle):
+            cache.invalidate(utils.get_peer_id(message.peer_id))
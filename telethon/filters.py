@@ -0,0 +1,136 @@
+"""
+Filter rules of the live listener.
+
+Rules come from .env (FILTER_CHATS, FILTER_BLOCKED_SENDERS,
+FILTER_IGNORE_PATTERN) or from a JSON file (FILTER_RULES_FILE). Chats and
+senders are resolved to peer ids once at startup: allowed chats become the
+``chats=`` filter of ``events.NewMessage``, so Telethon drops other updates
+before the handler runs, and blocked senders / ignored texts are checked
+against ``event.sender_id`` and a precompiled regex without any request.
+"""
+import json
+import logging
+import re
+from pathlib import Path
+from typing import Any, Callable, FrozenSet, List, NamedTuple, Optional, Pattern, Union
+
+from telethon import TelegramClient, events, utils
+
+import config
+
+logger = logging.getLogger("tg-bot.filters")
+
+# Values of FILTER_CHATS meaning "every chat"
+_ALL = {"", "*", "all"}
+
+
+class FilterRules(NamedTuple):
+    """Raw rules as written in the configuration."""
+
+    chats: List[str]
+    blocked_senders: List[str]
+    ignore_patterns: List[str]
+
+
+def _split(value: str) -> List[str]:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def _chat_list(items: List[str]) -> List[str]:
+    # An empty list means no chat filter at all
+    return [] if any(item.strip().lower() in _ALL for item in items) else items
+
+
+def load_rules(rules_file: Optional[str] = None) -> FilterRules:
+    """Read rules from the JSON file if given, otherwise from .env."""
+    rules_file = rules_file if rules_file is not None else config.filter_rules_file
+    if rules_file:
+        data = json.loads(Path(rules_file).read_text(encoding="utf-8"))
+        return FilterRules(
+            chats=_chat_list([str(item) for item in data.get("chats", [])]),
+            blocked_senders=[str(item) for item in data.get("blocked_senders", [])],
+            ignore_patterns=list(data.get("ignore_patterns", [])),
+        )
+    return FilterRules(
+        chats=_chat_list(_split(config.filter_chats)),
+        blocked_senders=_split(config.filter_blocked_senders),
+        ignore_patterns=[config.filter_ignore_pattern] if config.filter_ignore_pattern else [],
+    )
+
+
+class MessageFilter:
+    """Rules resolved to peer ids and a single compiled regex."""
+
+    def __init__(
+        self,
+        chat_ids: Optional[FrozenSet[int]] = None,
+        blocked_sender_ids: FrozenSet[int] = frozenset(),
+        ignore_re: Optional[Pattern] = None,
+    ) -> None:
+        # None means every chat is allowed
+        self.chat_ids = chat_ids
+        self.blocked_sender_ids = blocked_sender_ids
+        self.ignore_re = ignore_re
+
+    def allows_chat(self, chat_id: int) -> bool:
+        return self.chat_ids is None or chat_id in self.chat_ids
+
+    def allows(self, sender_id: Optional[int], text: str) -> bool:
+        """Sender/text checks; the chat is already filtered by Telethon."""
+        if sender_id is not None and sender_id in self.blocked_sender_ids:
+            return False
+        if self.ignore_re is not None and self.ignore_re.search(text):
+            return False
+        return True
+
+    def _event_func(self, event: Any) -> bool:
+        return self.allows(event.sender_id, event.message.message or "")
+
+    def event(
+        self,
+        extra: Optional[Callable[[Any], bool]] = None,
+        builder: type = events.NewMessage,
+    ) -> events.NewMessage:
+        """
+        NewMessage (or MessageEdited) event builder with these rules applied
+        before the handler; ``extra`` is an additional check run after them
+        (e.g. shard ownership).
+        """
+        chats = None
+        if self.chat_ids is not None:
+            # Peer objects, so positive user ids are not widened to chats/channels
+            chats = [peer_cls(real_id) for real_id, peer_cls in map(utils.resolve_id, sorted(self.chat_ids))]
+        func = self._event_func
+        if extra is not None:
+            func = lambda event: self._event_func(event) and extra(event)  # noqa: E731
+        return builder(chats=chats, func=func)
+
+
+async def _resolve(client: TelegramClient, peers: List[str], kind: str) -> FrozenSet[int]:
+    ids = set()
+    for peer in peers:
+        target: Union[int, str] = int(peer) if peer.lstrip("-").isdigit() else peer
+        try:
+            ids.add(await client.get_peer_id(target))
+        except (ValueError, TypeError) as exc:
+            logger.warning("Cannot resolve %s %r: %s", kind, peer, exc)
+    return frozenset(ids)
+
+
+async def build_filter(client: TelegramClient, rules: Optional[FilterRules] = None) -> MessageFilter:
+    """Resolve the rules once (at startup) into a MessageFilter."""
+    rules = rules or load_rules()
+    chat_ids = None
+    if rules.chats:
+        chat_ids = await _resolve(client, rules.chats, "chat")
+        if not chat_ids:
+            raise RuntimeError("None of the allowed chats could be resolved, check FILTER_CHATS")
+    blocked = await _resolve(client, rules.blocked_senders, "sender")
+    ignore_re = re.compile("|".join(f"(?:{p})" for p in rules.ignore_patterns)) if rules.ignore_patterns else None
+    logger.info(
+        "Filters: %s chats, %d blocked senders, %d ignore patterns",
+        "all" if chat_ids is None else len(chat_ids),
+        len(blocked),
+        len(rules.ignore_patterns),
+    )
+    return MessageFilter(chat_ids, blocked, ignore_re)
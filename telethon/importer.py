@@ -0,0 +1,377 @@
+"""
+Bulk import of Telegram Desktop "Export chat history" into messages.db.
+
+The export is parsed as a stream, so multi-GB files are never loaded into
+memory:
+
+- JSON (``result.json``): single-chat exports and full account exports
+  (``chats.list``) are supported; every message object is decoded on its
+  own from a sliding buffer.
+- HTML (``messages*.html`` in the export folder): pages are fed to an
+  incremental HTML parser; the chat id is not part of HTML exports and
+  must be given with ``--chat-id``.
+
+Rows are written with ``save_messages`` in large transactions; re-imports
+are idempotent thanks to INSERT OR IGNORE on the (chat_id, id) key.
+
+Usage (from telethon/):
+    python importer.py path/to/result.json
+    python importer.py path/to/ChatExport_2024-01-01 --chat-id -1001234567890
+"""
+import argparse
+import json
+import logging
+import re
+import time
+from datetime import datetime, timezone
+from html.parser import HTMLParser
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from db import init_db, save_messages, to_epoch_ms
+
+logger = logging.getLogger("tg-bot.importer")
+
+CHUNK_SIZE = 1 << 20
+DEFAULT_BATCH_SIZE = 5000
+
+# Export chat types -> how Telethon marks the peer id
+_USER_TYPES = {"personal_chat", "bot_chat", "saved_messages"}
+_BASIC_GROUP_TYPES = {"private_group"}
+
+_decoder = json.JSONDecoder()
+
+
+def export_chat_id(raw_id: int, chat_type: str) -> int:
+    """Convert the id from the export into the marked id used by Telethon."""
+    if chat_type in _USER_TYPES or raw_id < 0:
+        return raw_id
+    if chat_type in _BASIC_GROUP_TYPES:
+        return -raw_id
+    return int(f"-100{raw_id}")
+
+
+def _flatten_text(text: Any) -> str:
+    # "text" is a string or a list of strings and {"type": ..., "text": ...} parts
+    if isinstance(text, str):
+        return text
+    return "".join(part if isinstance(part, str) else part.get("text", "") for part in text or [])
+
+
+class _JsonStream:
+    """Sliding-window reader that decodes JSON values one at a time."""
+
+    def __init__(self, fp: Any) -> None:
+        self.fp = fp
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.bytes_read = 0
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.fp.read(CHUNK_SIZE)
+        if not chunk:
+            self.eof = True
+            return False
+        self.bytes_read += len(chunk.encode("utf-8"))
+        # Drop what was already consumed before growing the buffer
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Next non-whitespace character ("" at the end of input)."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset ~{self.bytes_read}")
+        self.pos += 1
+
+    def value(self) -> Any:
+        """Decode one complete value (object, array, string, number, literal)."""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # A number at the very end of the buffer may be cut in half
+            if end == len(self.buf) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def members(self) -> Iterator[str]:
+        """Iterate object keys; the caller must consume each value."""
+        self.expect("{")
+        first = True
+        while True:
+            if self.peek() == "}":
+                self.pos += 1
+                return
+            if not first:
+                self.expect(",")
+            first = False
+            key = self.value()
+            self.expect(":")
+            yield key
+
+    def items(self) -> Iterator[None]:
+        """Iterate array elements; the caller must consume each element."""
+        self.expect("[")
+        first = True
+        while True:
+            if self.peek() == "]":
+                self.pos += 1
+                return
+            if not first:
+                self.expect(",")
+            first = False
+            yield None
+
+
+def _json_message_row(item: Dict[str, Any], chat_id: int, chat_name: str) -> Optional[Dict[str, Any]]:
+    if item.get("type") != "message" or not isinstance(item.get("id"), int):
+        return None
+    unixtime = item.get("date_unixtime")
+    if unixtime:
+        moment = datetime.fromtimestamp(int(unixtime), tz=timezone.utc)
+        date, date_ms = moment.isoformat(), int(unixtime) * 1000
+    else:
+        # Old exports only have local time without offset
+        date, date_ms = item.get("date"), to_epoch_ms(item.get("date"))
+    return {
+        "id": item["id"],
+        "chat_id": chat_id,
+        "sender": item.get("from") or chat_name or "Unknown",
+        "text": _flatten_text(item.get("text")),
+        "date": date,
+        "date_ms": date_ms,
+    }
+
+
+def iter_json_export(stream: _JsonStream, chat_id: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Rows from result.json. The top level of a single-chat export is the chat
+    object itself; a full export keeps chats in "chats"/"left_chats" -> "list".
+    Header keys ("name", "type", "id") precede "messages" in exports.
+    """
+    name, chat_type, raw_id = "", "", None
+    for key in stream.members():
+        if key == "messages":
+            if chat_id is None and raw_id is None:
+                raise ValueError("Chat id is missing in the export, pass --chat-id")
+            target = chat_id if chat_id is not None else export_chat_id(raw_id, chat_type)
+            for _ in stream.items():
+                row = _json_message_row(stream.value(), target, name)
+                if row is not None:
+                    yield row
+        elif key in ("chats", "left_chats") and stream.peek() == "{":
+            for section in stream.members():
+                if section == "list":
+                    for _ in stream.items():
+                        yield from iter_json_export(stream, chat_id)
+                else:
+                    stream.value()
+        else:
+            value = stream.value()
+            if key == "name":
+                name = value or ""
+            elif key == "type":
+                chat_type = value or ""
+            elif key == "id":
+                raw_id = value
+
+
+class _HtmlExportParser(HTMLParser):
+    """Incremental parser of messages*.html pages."""
+
+    def __init__(self, chat_id: int) -> None:
+        super().__init__(convert_charrefs=True)
+        self.chat_id = chat_id
+        self.rows: List[Dict[str, Any]] = []
+        self.chat_name = ""
+        self._divs: List[Tuple[str, ...]] = []
+        self._message: Optional[Dict[str, Any]] = None
+        self._message_depth = 0
+        self._capture: Optional[str] = None
+        self._capture_depth = 0
+        self._parts: List[str] = []
+        self._last_sender = ""
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        if tag == "br" and self._capture:
+            self._parts.append("\n")
+        if tag != "div":
+            return
+        attributes = dict(attrs)
+        classes = tuple((attributes.get("class") or "").split())
+        self._divs.append(classes)
+        depth = len(self._divs)
+
+        if "message" in classes and "default" in classes:
+            match = re.fullmatch(r"message(\d+)", attributes.get("id") or "")
+            if match:
+                self._message = {"id": int(match.group(1)), "joined": "joined" in classes}
+                self._message_depth = depth
+            return
+        if self._capture:
+            return
+        if self._message is None:
+            # Chat title in the page header
+            if "text" in classes and "bold" in classes and not self.chat_name:
+                self._start_capture("chat_name", depth)
+            return
+        if "date" in classes and "details" in classes and "date" not in self._message:
+            self._message["date"] = attributes.get("title") or ""
+        elif "from_name" in classes and "from" not in self._message:
+            self._start_capture("from", depth)
+        elif "text" in classes and "text" not in self._message:
+            self._start_capture("text", depth)
+
+    def _start_capture(self, field: str, depth: int) -> None:
+        self._capture, self._capture_depth, self._parts = field, depth, []
+
+    def handle_data(self, data: str) -> None:
+        if self._capture:
+            self._parts.append(data)
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag != "div" or not self._divs:
+            return
+        depth = len(self._divs)
+        self._divs.pop()
+        if self._capture and depth == self._capture_depth:
+            value = "".join(self._parts).strip()
+            if self._capture == "chat_name":
+                self.chat_name = self.chat_name or value
+            elif self._message is not None:
+                self._message[self._capture] = value
+            self._capture = None
+        if self._message is not None and depth == self._message_depth:
+            self._emit(self._message)
+            self._message = None
+
+    def _emit(self, message: Dict[str, Any]) -> None:
+        sender = message.get("from") or (self._last_sender if message["joined"] else "")
+        self._last_sender = sender
+        date = None
+        if message.get("date"):
+            try:
+                date = datetime.strptime(message["date"], "%d.%m.%Y %H:%M:%S UTC%z")
+            except ValueError:
+                date = None
+        self.rows.append({
+            "id": message["id"],
+            "chat_id": self.chat_id,
+            "sender": sender or self.chat_name or "Unknown",
+            "text": message.get("text", ""),
+            "date": date.astimezone(timezone.utc).isoformat() if date else None,
+            "date_ms": to_epoch_ms(date),
+        })
+
+
+def _html_pages(path: Path) -> List[Path]:
+    def page_number(page: Path) -> int:
+        digits = re.sub(r"\D", "", page.stem)
+        return int(digits) if digits else 1
+
+    return sorted(path.glob("messages*.html"), key=page_number)
+
+
+def iter_html_export(pages: List[Path], chat_id: int, progress: Dict[str, int]) -> Iterator[Dict[str, Any]]:
+    """Rows from the HTML pages of an export, page by page, chunk by chunk."""
+    parser = _HtmlExportParser(chat_id)
+    for page in pages:
+        with page.open(encoding="utf-8") as fp:
+            while True:
+                chunk = fp.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                progress["bytes"] += len(chunk.encode("utf-8"))
+                parser.feed(chunk)
+                yield from parser.rows
+                parser.rows.clear()
+    parser.close()
+    yield from parser.rows
+
+
+def import_export(path: Path, chat_id: Optional[int] = None, batch_size: int = DEFAULT_BATCH_SIZE) -> Tuple[int, int]:
+    """
+    Import a Telegram Desktop export (result.json, a folder or an HTML page).
+    Returns (messages read, messages inserted).
+    """
+    init_db()
+    path = Path(path)
+    if path.is_dir():
+        json_file = path / "result.json"
+        source = json_file if json_file.exists() else path
+    else:
+        source = path
+
+    progress = {"bytes": 0}
+    if source.is_file() and source.suffix == ".json":
+        total_bytes = source.stat().st_size
+        fp = source.open(encoding="utf-8")
+        stream = _JsonStream(fp)
+        rows = iter_json_export(stream, chat_id)
+        read_bytes = lambda: stream.bytes_read  # noqa: E731
+    else:
+        if chat_id is None:
+            raise ValueError("HTML exports do not contain the chat id, pass --chat-id")
+        pages = _html_pages(source) if source.is_dir() else [source]
+        if not pages:
+            raise ValueError(f"No result.json or messages*.html found in {source}")
+        total_bytes = sum(page.stat().st_size for page in pages)
+        fp = None
+        rows = iter_html_export(pages, chat_id, progress)
+        read_bytes = lambda: progress["bytes"]  # noqa: E731
+
+    started = time.monotonic()
+    seen = inserted = 0
+    batch: List[Dict[str, Any]] = []
+    try:
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                inserted += save_messages(batch)
+                seen += len(batch)
+                batch.clear()
+                percent = read_bytes() / total_bytes * 100 if total_bytes else 100.0
+                logger.info(
+                    "%.1f%% | %d messages read, %d new | %.0f msg/s",
+                    min(percent, 100.0), seen, inserted, seen / max(time.monotonic() - started, 1e-6),
+                )
+        if batch:
+            inserted += save_messages(batch)
+            seen += len(batch)
+    finally:
+        if fp is not None:
+            fp.close()
+
+    logger.info("Import finished: %d messages read, %d new, %.1fs", seen, inserted, time.monotonic() - started)
+    return seen, inserted
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+    )
+    parser = argparse.ArgumentParser(description="Import a Telegram Desktop chat export into messages.db")
+    parser.add_argument("path", type=Path, help="result.json, an export folder or a messages.html page")
+    parser.add_argument("--chat-id", type=int, default=None, help="Telethon chat id (required for HTML)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Rows per transaction")
+    args = parser.parse_args()
+    import_export(args.path, args.chat_id, args.batch_size)
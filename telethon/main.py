@@ -1,18 +1,22 @@
 import asyncio
 import logging
-from datetime import timezone, timedelta
-from typing import Optional
+from functools import partial
+from typing import Callable, Optional
 
 from telethon import TelegramClient, events
-from telethon.errors import RPCError
-from telethon.tl.types import Dialog
 
 import config
-from db import init_db, save_message
-
-# Московский часовой пояс (UTC+3)
-MSK = timezone(timedelta(hours=3))
-
+from backfill import run_backfill
+from catchup import catch_up, watch_reconnects
+from connection import close_connection
+from db import init_db
+from entities import cache as entity_cache, handle_peer_update, resolve_chat, resolve_sender
+from filters import build_filter
+from media import serve_media_requests
+from records import edited_row, message_to_row
+from session_store import SnapshotSession, persist_sessions
+from sharding import Account, Shard, ShardManager, is_channel, load_accounts, log_status
+from writer import MessageWriter
 
 # Configure logging for visibility into bot actions
 logging.basicConfig(
@@ -21,6 +25,13 @@ logging.basicConfig(
 )
 logger = logging.getLogger("tg-bot")
 
+# Single write-behind queue shared by history fetch and the live listener
+writer = MessageWriter(
+    batch_size=config.ingest_batch_size,
+    flush_ms=config.ingest_flush_ms,
+    max_queue=config.ingest_queue_size,
+)
+
 
 def ensure_config() -> None:
     """Sanity-check config values."""
@@ -30,12 +41,15 @@ def ensure_config() -> None:
         )
 
 
-def build_client() -> TelegramClient:
-    """Create and return a configured Telethon client."""
+def build_client(account: Optional[Account] = None) -> TelegramClient:
+    """Create and return a configured Telethon client (primary account by default)."""
+    account = account or load_accounts()[0]
+    # In-memory session keeps Telethon's constant session writes off the disk
+    session = SnapshotSession(account.session) if config.session_storage == "memory" else account.session
     return TelegramClient(
-        config.session_name,
-        config.api_id,
-        config.api_hash,
+        session,
+        account.api_id,
+        account.api_hash,
         # Telethon will auto-reconnect; these parameters make it more robust
         request_retries=5,
         connection_retries=5,
@@ -43,33 +57,6 @@ def build_client() -> TelegramClient:
     )
 
 
-def format_sender(sender: Optional[object], chat_title: str) -> str:
-    """
-    Normalize sender display:
-    - username
-    - first/last name
-    - title (for channels/chats)
-    - fallback to chat title
-    """
-    if sender is None:
-        return chat_title or "Unknown"
-
-    username = getattr(sender, "username", None)
-    if username:
-        return username
-
-    first_name = getattr(sender, "first_name", None)
-    last_name = getattr(sender, "last_name", None)
-    if first_name or last_name:
-        return " ".join(filter(None, (first_name, last_name)))
-
-    title = getattr(sender, "title", None)
-    if title:
-        return title
-
-    return chat_title or "Unknown"
-
-
 async def list_dialogs(client: TelegramClient) -> None:
     """Fetch and print available dialogs."""
     dialogs = await client.get_dialogs()
@@ -79,126 +66,146 @@ async def list_dialogs(client: TelegramClient) -> None:
         logger.info("  %d. %s (id=%s)", idx, title, dialog.id)
 
 
-async def fetch_recent_messages(
-    client: TelegramClient, dialog: Dialog, limit: int = 100
-) -> None:
-    """
-    Fetch last `limit` messages from a dialog and store them in the database.
-    """
-    logger.info("Fetching last %d messages from chat id=%s", limit, dialog.id)
-    chat_title = dialog.name or getattr(dialog.entity, "title", None) or "Unknown"
-    async for message in client.iter_messages(dialog.entity, limit=limit):
-        sender_entity = await message.get_sender()
-        sender_label = format_sender(sender_entity, chat_title)
-
-        message_data = {
-            "id": message.id,
-            "chat_id": dialog.id,
-            "sender": sender_label,
-            "text": message.message or "",
-            "date": message.date.isoformat() if message.date else None,
-        }
-        save_message(message_data)
-    logger.info("Finished fetching history for chat id=%s", dialog.id)
-
-
 async def handle_new_message(event: events.NewMessage.Event) -> None:
     """
     Event handler for new incoming messages.
-    Filter for specific bot if configured.
+    Chats, blocked senders and ignored texts are already filtered by the
+    event builder from filters.py, so only wanted messages get here.
     """
-    chat = await event.get_chat()
-    chat_title = getattr(chat, "title", None) or getattr(chat, "username", "Unknown")
-    chat_username = getattr(chat, "username", None)
-    
-    # Если настроен конкретный бот, фильтруем только его сообщения
-    if config.bot_username:
-        bot_username_clean = config.bot_username.lstrip("@")
-        if chat_username != bot_username_clean:
-            # Это не тот бот, пропускаем
-            return
-    
-    sender_entity = await event.get_sender()
-    sender = format_sender(sender_entity, chat_title)
+    # Sender and chat are resolved through the LRU cache, not per message
+    chat = await resolve_chat(event)
+    sender = await resolve_sender(event.message, chat.label)
     text = event.message.message or ""
-    
-    # Пропускаем сообщения от самого бота (ED_Zerocoder_intensive_bot)
-    sender_username = getattr(sender_entity, "username", None)
-    if sender_username and sender_username == "ED_Zerocoder_intensive_bot":
-        # Это сообщение от нашего бота, не сохраняем
-        return
-    
-    # Пропускаем служебные команды и кнопки
-    if text.startswith("/") or text in ["📊 Статус", "📝 Саммаризация"]:
-        # Это команда или нажатие кнопки, не сохраняем
-        return
 
-    # Конвертируем время в московское (UTC+3)
-    message_date = None
-    if event.message.date:
-        message_date = event.message.date.astimezone(MSK).isoformat()
-    
-    message_data = {
-        "id": event.message.id,
-        "chat_id": event.chat_id,
-        "sender": sender,
-        "text": text,
-        "date": message_date,
-    }
-    save_message(message_data)
+    await writer.put(message_to_row(event.message, event.chat_id, sender.label))
 
     # Short log to console
-    logger.info("[%s] %s: %s", chat_title, sender, text[:80])
+    logger.info("[%s] %s: %s", chat.label, sender.label, text[:80])
 
 
-async def choose_dialog(client: TelegramClient) -> Optional[Dialog]:
+async def handle_message_edited(event: events.MessageEdited.Event) -> None:
     """
-    Utility to select the first dialog as an example.
-    Replace this logic with user input if needed.
+    Store the new text in place. Triggers reindex the message and mark the
+    summaries covering it as stale, so only they are re-summarized.
     """
-    dialogs = await client.get_dialogs()
-    if not dialogs:
-        logger.warning("No dialogs available for this account.")
-        return None
-    return dialogs[0]
+    chat = await resolve_chat(event)
+    sender = await resolve_sender(event.message, chat.label)
+    await writer.put_edit(edited_row(event.message, event.chat_id, sender.label))
+    logger.info("[%s] edited message %s", chat.label, event.message.id)
+
+
+async def handle_message_deleted(
+    shard: Shard, owns: Callable[[int], bool], event: events.MessageDeleted.Event
+) -> None:
+    """Delete stored messages; summaries covering them become stale."""
+    if event.chat_id is not None:
+        chat_ids = [event.chat_id]
+    else:
+        # Private chats and basic groups: Telegram omits the chat, but message
+        # ids there are unique per account, so look in this account's chats
+        chat_ids = [chat_id for chat_id in shard.chat_ids if not is_channel(chat_id)]
+    # Rows of chats handled by another account are not this account's to delete
+    chat_ids = [chat_id for chat_id in chat_ids if owns(chat_id)]
+    if not chat_ids:
+        return
+    await writer.put_delete(chat_ids, event.deleted_ids)
+    logger.info("Deleted messages %s (chat id=%s)", event.deleted_ids, event.chat_id)
 
 
 async def run_bot() -> None:
     """
     Main routine:
       - Initialize DB
-      - Start Telethon client
+      - Start a Telethon client per account (shard)
       - List dialogs
-      - Fetch recent messages from one dialog
-      - Start live listener
+      - Start live listeners (new, edited, deleted), each channel served by one account
+      - Catch up messages missed while offline, and after each reconnect
+      - Backfill history of BACKFILL_DIALOGS in the background
     """
     ensure_config()
     init_db()
+    await writer.start()
 
-    client = build_client()
-
-    # Robust start with reconnect handling
-    while True:
-        try:
-            await client.start()
-            break
-        except RPCError as exc:
-            logger.error("RPCError during start: %s. Retrying...", exc)
-            await asyncio.sleep(3)
+    # One shard per configured account; only the primary one is mandatory
+    manager = ShardManager(load_accounts(), build_client)
+    await manager.start()
+    client = manager.primary.client
 
     await list_dialogs(client)
 
-    # Register event handler for new messages from ALL dialogs
-    client.add_event_handler(handle_new_message, events.NewMessage)
-    logger.info("Listening for new messages from ALL chats... Press Ctrl+C to stop.")
-
-    # Keep the client running
+    # Rules are resolved to peer ids once; Telethon drops other chats itself
+    message_filter = await build_filter(client)
+    background = [
+        asyncio.create_task(log_status(manager), name="shard-status"),
+        # Media files requested by the dashboard/mini app
+        asyncio.create_task(serve_media_requests(manager), name="media"),
+    ]
+    sessions = [
+        shard.client.session for shard in manager.started() if isinstance(shard.client.session, SnapshotSession)
+    ]
+    if sessions:
+        background.append(
+            asyncio.create_task(persist_sessions(sessions, config.session_flush_seconds), name="session-persist")
+        )
+    for shard in manager.started():
+        # Every channel is handled by exactly one account, see sharding.py
+        owns = partial(manager.owns, shard)
+        on_flood = partial(manager.report_flood, shard)
+        shard.client.add_event_handler(
+            handle_new_message, message_filter.event(partial(_count_owned, shard, owns))
+        )
+        shard.client.add_event_handler(
+            handle_message_edited, message_filter.event(partial(_is_owned, owns), events.MessageEdited)
+        )
+        # No chats= filter: deletions in private chats come without a chat id
+        shard.client.add_event_handler(partial(handle_message_deleted, shard, owns), events.MessageDeleted)
+        # Profile and title changes invalidate cached sender/chat labels
+        shard.client.add_event_handler(handle_peer_update, events.Raw)
+        background += [
+            asyncio.create_task(
+                catch_up(shard.client, writer, message_filter, config.catchup_concurrency, owns, on_flood),
+                name=f"catch-up-{shard.name}",
+            ),
+            asyncio.create_task(
+                watch_reconnects(shard.client, writer, message_filter, config.catchup_concurrency, owns, on_flood),
+                name=f"reconnect-watch-{shard.name}",
+            ),
+        ]
+    logger.info("Listening for new messages... Press Ctrl+C to stop.")
+
+    if config.backfill_dialogs:
+        background.append(asyncio.create_task(run_backfill(client, writer, manager), name="backfill"))
+
+    # Keep the clients running
     try:
-        await client.run_until_disconnected()
+        await manager.run_until_disconnected()
     except asyncio.CancelledError:
         logger.info("Shutdown requested, disconnecting...")
     finally:
-        await client.disconnect()
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        # Disconnecting also writes the final session snapshots
+        await manager.stop()
+        logger.info("Shards: %s", manager.status())
+        logger.info("Entity cache: %s", entity_cache.stats())
+        for shard in manager.shards.values():
+            if isinstance(shard.client.session, SnapshotSession):
+                logger.info("Session %s: %s", shard.name, shard.client.session.stats())
+        # Guaranteed flush of everything still queued before exit
+        await writer.close()
+        close_connection()
+
+
+def _is_owned(owns: Callable[[int], bool], event: events.NewMessage.Event) -> bool:
+    return owns(event.chat_id)
+
+
+def _count_owned(shard: Shard, owns: Callable[[int], bool], event: events.NewMessage.Event) -> bool:
+    if not owns(event.chat_id):
+        return False
+    shard.handled += 1
+    return True
 
 
 if __name__ == "__main__":
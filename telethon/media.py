@@ -0,0 +1,246 @@
+"""
+Media metadata and the lazy, size-capped download cache.
+
+At ingest only lightweight metadata is recorded (type, size, file name,
+duration, file id/reference) in message_media; the caption is the message
+text. Files are downloaded only when someone asks for them: the dashboard,
+mini app or bot calls ``request_media()``, which queues the file in the
+media_cache table, and the ingester's ``serve_media_requests()`` task
+downloads it with the account that owns the chat. The cache directory is
+kept under MEDIA_CACHE_MAX_MB by evicting the least recently used files.
+Files larger than MEDIA_MAX_FILE_MB are refused before downloading.
+
+This module does not import Telethon, so the web apps can use the
+synchronous part without it.
+"""
+import asyncio
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from connection import ROOT_DIR, get_connection, transaction
+
+logger = logging.getLogger("tg-bot.media")
+
+MEDIA_CACHE_DIR = Path(os.getenv("MEDIA_CACHE_DIR") or ROOT_DIR / "media_cache")
+MEDIA_CACHE_MAX_BYTES = int(os.getenv("MEDIA_CACHE_MAX_MB") or 500) * 1024 * 1024
+MEDIA_MAX_FILE_BYTES = int(os.getenv("MEDIA_MAX_FILE_MB") or 50) * 1024 * 1024
+
+# Most specific first: a voice note is also a document
+_KINDS = ("voice", "video_note", "gif", "sticker", "video", "audio", "photo", "document")
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _too_large(size: Optional[int]) -> Optional[str]:
+    """Error text if a file of this size must not be cached."""
+    if size and size > MEDIA_MAX_FILE_BYTES:
+        return f"file too large: {size // (1024 * 1024)} MB, limit {MEDIA_MAX_FILE_BYTES // (1024 * 1024)} MB"
+    return None
+
+
+def media_metadata(message: Any) -> Optional[Dict[str, Any]]:
+    """Metadata of a Telethon message's media, or None (no media / link preview)."""
+    if message.media is None or getattr(message, "web_preview", None) is not None:
+        return None
+    kind = next((name for name in _KINDS if getattr(message, name, None)), None)
+    if kind is None:
+        # Polls, geo, contacts etc. have nothing to download
+        return None
+    file = message.file
+    media = message.photo or message.document
+    return {
+        "kind": kind,
+        "mime_type": getattr(file, "mime_type", None),
+        "size": getattr(file, "size", None),
+        "file_name": getattr(file, "name", None),
+        "duration": getattr(file, "duration", None),
+        "file_id": getattr(media, "id", None),
+        "file_reference": getattr(media, "file_reference", None),
+    }
+
+
+def get_media_info(keys: List[Tuple[int, int]]) -> Dict[Tuple[int, int], Dict[str, Any]]:
+    """Metadata for many (chat_id, message_id) keys in one query."""
+    if not keys:
+        return {}
+    placeholders = ", ".join("(?, ?)" for _ in keys)
+    rows = get_connection().execute(
+        f"""
+        SELECT chat_id, message_id, kind, mime_type, size, file_name, duration
+        FROM message_media
+        WHERE (chat_id, message_id) IN (VALUES {placeholders})
+        """,
+        [value for key in keys for value in key],
+    ).fetchall()
+    return {(row["chat_id"], row["message_id"]): dict(row) for row in rows}
+
+
+def request_media(chat_id: int, message_id: int) -> Dict[str, Any]:
+    """
+    Ask for a media file. Returns its metadata plus "status":
+    "missing" (no media), "pending"/"downloading", "ready" (with "path")
+    or "failed" (with "error"; a new request retries it).
+    """
+    info = get_media_info([(chat_id, message_id)]).get((chat_id, message_id))
+    if info is None:
+        return {"status": "missing"}
+    error = _too_large(info["size"])
+    if error:
+        # Never queued: downloading it would not fit the limit anyway
+        return {**info, "status": "failed", "path": None, "error": error}
+    now = _now_ms()
+    with transaction() as conn:
+        row = conn.execute(
+            """
+            INSERT INTO media_cache (chat_id, message_id, status, requested_ms, last_access_ms)
+            VALUES (?, ?, 'pending', ?, ?)
+            ON CONFLICT (chat_id, message_id) DO UPDATE SET
+                last_access_ms = excluded.last_access_ms,
+                requested_ms = CASE WHEN status = 'failed' THEN excluded.requested_ms ELSE requested_ms END,
+                status = CASE WHEN status = 'failed' THEN 'pending' ELSE status END
+            RETURNING status, path, error
+            """,
+            (chat_id, message_id, now, now),
+        ).fetchone()
+        status, path = row["status"], row["path"]
+        if status == "ready" and not (path and Path(path).exists()):
+            # Removed from disk behind our back: download again
+            conn.execute(
+                """
+                UPDATE media_cache SET status = 'pending', path = NULL, size = 0, requested_ms = ?
+                WHERE chat_id = ? AND message_id = ?
+                """,
+                (now, chat_id, message_id),
+            )
+            status, path = "pending", None
+    return {**info, "status": status, "path": path, "error": row["error"]}
+
+
+def claim_media_requests(limit: int = 4) -> List[Dict[str, Any]]:
+    """Take the oldest pending requests for download."""
+    with transaction() as conn:
+        rows = conn.execute(
+            """
+            UPDATE media_cache SET status = 'downloading'
+            WHERE (chat_id, message_id) IN (
+                SELECT chat_id, message_id FROM media_cache
+                WHERE status = 'pending' ORDER BY requested_ms LIMIT ?
+            )
+            RETURNING chat_id, message_id
+            """,
+            (limit,),
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def reset_downloads() -> None:
+    """Requeue downloads interrupted by a restart."""
+    get_connection().execute("UPDATE media_cache SET status = 'pending' WHERE status = 'downloading'")
+
+
+def store_media(chat_id: int, message_id: int, path: Path) -> None:
+    """
+    Register a downloaded file and evict old ones over the budget.
+    Raises ValueError (and deletes the file) if it is over MEDIA_MAX_FILE_MB.
+    """
+    error = _too_large(path.stat().st_size)
+    if error:
+        path.unlink(missing_ok=True)
+        raise ValueError(error)
+    get_connection().execute(
+        """
+        UPDATE media_cache SET status = 'ready', path = ?, size = ?, error = NULL, last_access_ms = ?
+        WHERE chat_id = ? AND message_id = ?
+        """,
+        (str(path), path.stat().st_size, _now_ms(), chat_id, message_id),
+    )
+    evict_media()
+
+
+def fail_media(chat_id: int, message_id: int, error: str) -> None:
+    get_connection().execute(
+        "UPDATE media_cache SET status = 'failed', error = ? WHERE chat_id = ? AND message_id = ?",
+        (error[:500], chat_id, message_id),
+    )
+
+
+def evict_media(max_bytes: int = MEDIA_CACHE_MAX_BYTES) -> int:
+    """Delete least recently used files until the cache fits. Returns files removed."""
+    conn = get_connection()
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM media_cache WHERE status = 'ready'").fetchone()[0]
+    removed = 0
+    while total > max_bytes:
+        rows = conn.execute(
+            """
+            SELECT chat_id, message_id, path, size FROM media_cache
+            WHERE status = 'ready' ORDER BY last_access_ms LIMIT ?
+            """,
+            (100,),
+        ).fetchall()
+        if not rows:
+            break
+        victims = []
+        for row in rows:
+            if total <= max_bytes:
+                break
+            Path(row["path"]).unlink(missing_ok=True)
+            victims.append((row["chat_id"], row["message_id"]))
+            total -= row["size"]
+        with transaction(conn):
+            conn.executemany("DELETE FROM media_cache WHERE chat_id = ? AND message_id = ?", victims)
+        removed += len(victims)
+    if removed:
+        logger.info("Media cache: evicted %d files", removed)
+    return removed
+
+
+async def download_media(client: Any, entity: Any, chat_id: int, message_id: int) -> Path:
+    """Download one message's media into the cache directory."""
+    # Re-fetching the message gives a fresh file reference
+    message = await client.get_messages(entity, ids=message_id)
+    if message is None or message.media is None:
+        raise LookupError("message or media no longer exists")
+    error = _too_large(getattr(message.file, "size", None))
+    if error:
+        raise ValueError(error)
+    target = MEDIA_CACHE_DIR / str(chat_id)
+    target.mkdir(parents=True, exist_ok=True)
+    # Telethon appends the proper extension
+    path = await message.download_media(file=str(target / str(message_id)))
+    if path is None:
+        raise LookupError("nothing to download")
+    return Path(path)
+
+
+async def serve_media_requests(router: Any, poll_seconds: float = 1.0, concurrency: int = 2) -> None:
+    """
+    Background task of the ingester: download requested media with the
+    account (shard) owning each chat.
+    """
+    await asyncio.to_thread(reset_downloads)
+
+    async def handle(item: Dict[str, Any]) -> None:
+        chat_id, message_id = item["chat_id"], item["message_id"]
+        try:
+            shard = router.owner(chat_id)
+            if shard is None:
+                raise LookupError("no account can see this chat")
+            entity = await router.entity_for(shard, chat_id)
+            path = await download_media(shard.client, entity, chat_id, message_id)
+            await asyncio.to_thread(store_media, chat_id, message_id, path)
+            logger.info("Downloaded media of message %s in chat id=%s", message_id, chat_id)
+        except Exception as exc:  # keep serving other requests
+            logger.warning("Media download for %s/%s failed: %s", chat_id, message_id, exc)
+            await asyncio.to_thread(fail_media, chat_id, message_id, str(exc) or type(exc).__name__)
+
+    while True:
+        claimed = await asyncio.to_thread(claim_media_requests, concurrency)
+        if not claimed:
+            await asyncio.sleep(poll_seconds)
+            continue
+        await asyncio.gather(*(handle(item) for item in claimed))
@@ -0,0 +1,740 @@
+"""
+Versioned schema migrations for messages.db.
+
+Each migration is a function registered with a monotonically increasing
+version number. Applied versions are recorded in the ``schema_version``
+table, so ``migrate()`` is cheap to call on every process start and only
+runs what is missing, each migration in its own transaction. Processes
+starting together are safe: the version is re-read under the write lock.
+
+Run ``python migrations.py --check`` to verify that the hot queries used
+by the bot and dashboards are served by indexes (exit code 1 otherwise).
+"""
+import re
+import sqlite3
+import sys
+from typing import Callable, List, Optional, Tuple
+
+from connection import get_connection, transaction
+from search import fts_create_sql
+
+Migration = Tuple[int, str, Callable[[sqlite3.Connection], None]]
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, name: str) -> Callable:
+    """Register a migration function under the given version."""
+
+    def decorator(func: Callable[[sqlite3.Connection], None]) -> Callable:
+        MIGRATIONS.append((version, name, func))
+        return func
+
+    return decorator
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [row["name"] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+@migration(1, "baseline messages table")
+def _baseline(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY,
+            chat_id INTEGER NOT NULL,
+            sender TEXT,
+            text TEXT,
+            date TEXT,
+            summarized INTEGER DEFAULT 0
+        )
+        """
+    )
+    # Databases created by older versions may lack these columns
+    existing = _columns(conn, "messages")
+    for name, ddl in (
+        ("summarized", "summarized INTEGER DEFAULT 0"),
+        ("claim_token", "claim_token TEXT"),
+        ("claim_expires", "claim_expires REAL"),
+    ):
+        if name not in existing:
+            conn.execute(f"ALTER TABLE messages ADD COLUMN {ddl}")
+
+
+@migration(2, "indexes for hot queries")
+def _hot_query_indexes(conn: sqlite3.Connection) -> None:
+    # Dashboard lists: ORDER BY date DESC (the WITHOUT ROWID table appends
+    # the primary key, so this is effectively (date, chat_id, id))
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_date ON messages(date)")
+    # Summarizer queue (summarized = 0 ORDER BY date) and statistics
+    # (COUNT(*) / MAX(date) WHERE summarized = 1) share one composite index
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_messages_summarized_date ON messages(summarized, date)"
+    )
+    # Per-chat browsing
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_chat_date ON messages(chat_id, date)")
+    # complete_claim / release_claim
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_messages_claim "
+        "ON messages(claim_token) WHERE claim_token IS NOT NULL"
+    )
+
+
+@migration(3, "composite (chat_id, id) key, WITHOUT ROWID")
+def _composite_key(conn: sqlite3.Connection) -> None:
+    # Telegram message ids are only unique within a chat. Rebuild the table
+    # clustered by (chat_id, id): per-chat ranges become contiguous on disk.
+    # The copy runs in one transaction; in WAL mode dashboards keep reading
+    # the old snapshot meanwhile and writers wait on busy_timeout.
+    conn.execute(
+        """
+        CREATE TABLE messages_new (
+            chat_id INTEGER NOT NULL,
+            id INTEGER NOT NULL,
+            sender TEXT,
+            text TEXT,
+            date TEXT,
+            summarized INTEGER DEFAULT 0,
+            claim_token TEXT,
+            claim_expires REAL,
+            PRIMARY KEY (chat_id, id)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute(
+        """
+        INSERT OR IGNORE INTO messages_new
+            (chat_id, id, sender, text, date, summarized, claim_token, claim_expires)
+        SELECT chat_id, id, sender, text, date, summarized, claim_token, claim_expires
+        FROM messages
+        ORDER BY chat_id, id
+        """
+    )
+    conn.execute("DROP TABLE messages")
+    conn.execute("ALTER TABLE messages_new RENAME TO messages")
+    # Indexes were dropped together with the old table
+    _hot_query_indexes(conn)
+
+
+@migration(4, "summaries table")
+def _summaries(conn: sqlite3.Connection) -> None:
+    # chat_id / first/last_message_id describe the covered range when the
+    # summary spans a single chat (chat_id is NULL for multi-chat batches);
+    # summary_messages lists every covered message exactly.
+    conn.execute(
+        """
+        CREATE TABLE summaries (
+            id INTEGER PRIMARY KEY,
+            chat_id INTEGER,
+            first_message_id INTEGER,
+            last_message_id INTEGER,
+            message_count INTEGER,
+            text TEXT NOT NULL,
+            model TEXT,
+            latency_ms INTEGER,
+            prompt_tokens INTEGER,
+            completion_tokens INTEGER,
+            total_tokens INTEGER,
+            created_at TEXT NOT NULL DEFAULT (datetime('now'))
+        )
+        """
+    )
+    conn.execute("CREATE INDEX idx_summaries_created ON summaries(created_at)")
+    conn.execute(
+        "CREATE INDEX idx_summaries_chat_range "
+        "ON summaries(chat_id, first_message_id, last_message_id)"
+    )
+    conn.execute(
+        """
+        CREATE TABLE summary_messages (
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            summary_id INTEGER NOT NULL REFERENCES summaries(id) ON DELETE CASCADE,
+            PRIMARY KEY (chat_id, message_id, summary_id)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute("CREATE INDEX idx_summary_messages_summary ON summary_messages(summary_id)")
+
+    # Move legacy fake rows (id = message_id * 10_000 + 9999) out of messages
+    conn.execute(
+        """
+        INSERT INTO summaries
+            (chat_id, first_message_id, last_message_id, text, model, created_at)
+        SELECT chat_id, id / 10000, id / 10000, text, 'GigaChat', COALESCE(date, datetime('now'))
+        FROM messages
+        WHERE sender = 'bot_summary'
+        ORDER BY date
+        """
+    )
+    conn.execute("DELETE FROM messages WHERE sender = 'bot_summary'")
+
+
+def _fold_yo(expr: str) -> str:
+    """SQL expression folding ё into е so both spellings match in search."""
+    return f"replace(replace({expr}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+@migration(5, "full-text search (FTS5)")
+def _full_text_search(conn: sqlite3.Connection) -> None:
+    # messages is WITHOUT ROWID, so FTS5 needs an integer document id:
+    # message_search_keys maps doc_id <-> (chat_id, id), and the view serves
+    # as the external content table the FTS index reads text from.
+    conn.execute(
+        """
+        CREATE TABLE message_search_keys (
+            doc_id INTEGER PRIMARY KEY,
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            UNIQUE (chat_id, message_id)
+        )
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE VIEW messages_fts_source AS
+        SELECT k.doc_id AS doc_id, {_fold_yo("m.text")} AS text, m.sender AS sender
+        FROM message_search_keys k
+        JOIN messages m ON m.chat_id = k.chat_id AND m.id = k.message_id
+        """
+    )
+    conn.execute(
+        f"CREATE VIEW summaries_fts_source AS SELECT id, {_fold_yo('text')} AS text FROM summaries"
+    )
+    conn.execute(fts_create_sql("messages_fts", "text, sender", "messages_fts_source", "doc_id"))
+    conn.execute(fts_create_sql("summaries_fts", "text", "summaries_fts_source", "id"))
+
+    key = "FROM message_search_keys WHERE chat_id = {row}.chat_id AND message_id = {row}.id"
+    conn.execute(
+        f"""
+        CREATE TRIGGER messages_fts_ai AFTER INSERT ON messages BEGIN
+            INSERT OR IGNORE INTO message_search_keys (chat_id, message_id)
+            VALUES (new.chat_id, new.id);
+            INSERT INTO messages_fts (rowid, text, sender)
+            SELECT doc_id, {_fold_yo("new.text")}, new.sender {key.format(row="new")};
+        END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER messages_fts_ad AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, text, sender)
+            SELECT 'delete', doc_id, {_fold_yo("old.text")}, old.sender {key.format(row="old")};
+            DELETE {key.format(row="old")};
+        END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER messages_fts_au AFTER UPDATE OF text, sender ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, text, sender)
+            SELECT 'delete', doc_id, {_fold_yo("old.text")}, old.sender {key.format(row="old")};
+            INSERT INTO messages_fts (rowid, text, sender)
+            SELECT doc_id, {_fold_yo("new.text")}, new.sender {key.format(row="new")};
+        END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER summaries_fts_ai AFTER INSERT ON summaries BEGIN
+            INSERT INTO summaries_fts (rowid, text) VALUES (new.id, {_fold_yo("new.text")});
+        END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER summaries_fts_ad AFTER DELETE ON summaries BEGIN
+            INSERT INTO summaries_fts (summaries_fts, rowid, text)
+            VALUES ('delete', old.id, {_fold_yo("old.text")});
+        END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER summaries_fts_au AFTER UPDATE OF text ON summaries BEGIN
+            INSERT INTO summaries_fts (summaries_fts, rowid, text)
+            VALUES ('delete', old.id, {_fold_yo("old.text")});
+            INSERT INTO summaries_fts (rowid, text) VALUES (new.id, {_fold_yo("new.text")});
+        END
+        """
+    )
+
+    # Index what is already stored
+    conn.execute(
+        "INSERT INTO message_search_keys (chat_id, message_id) "
+        "SELECT chat_id, id FROM messages ORDER BY chat_id, id"
+    )
+    conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+    conn.execute("INSERT INTO summaries_fts (summaries_fts) VALUES ('rebuild')")
+
+
+@migration(6, "incremental statistics counters")
+def _statistics(conn: sqlite3.Connection) -> None:
+    # One row per chat plus the global row with chat_id = 0 (never a real
+    # Telegram chat id). Triggers keep counters exact on every write, so
+    # reading statistics is a primary-key lookup instead of COUNT(*).
+    conn.execute(
+        """
+        CREATE TABLE message_stats (
+            chat_id INTEGER PRIMARY KEY,
+            total INTEGER NOT NULL DEFAULT 0,
+            summarized INTEGER NOT NULL DEFAULT 0,
+            summaries INTEGER NOT NULL DEFAULT 0,
+            last_summary_at TEXT
+        )
+        """
+    )
+    upsert = (
+        "ON CONFLICT (chat_id) DO UPDATE SET "
+        "total = total + excluded.total, summarized = summarized + excluded.summarized"
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER message_stats_ai AFTER INSERT ON messages BEGIN
+            INSERT INTO message_stats (chat_id, total, summarized)
+            VALUES (new.chat_id, 1, new.summarized = 1), (0, 1, new.summarized = 1)
+            {upsert};
+        END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER message_stats_ad AFTER DELETE ON messages BEGIN
+            INSERT INTO message_stats (chat_id, total, summarized)
+            VALUES (old.chat_id, -1, -(old.summarized = 1)), (0, -1, -(old.summarized = 1))
+            {upsert};
+        END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER message_stats_au AFTER UPDATE OF summarized ON messages
+        WHEN (old.summarized = 1) != (new.summarized = 1) BEGIN
+            INSERT INTO message_stats (chat_id, total, summarized)
+            VALUES (new.chat_id, 0, (new.summarized = 1) - (old.summarized = 1)),
+                   (0, 0, (new.summarized = 1) - (old.summarized = 1))
+            {upsert};
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER message_stats_summary_ai AFTER INSERT ON summaries BEGIN
+            INSERT INTO message_stats (chat_id, summaries, last_summary_at)
+            VALUES (0, 1, new.created_at)
+            ON CONFLICT (chat_id) DO UPDATE SET
+                summaries = summaries + 1,
+                last_summary_at = max(COALESCE(last_summary_at, ''), excluded.last_summary_at);
+            INSERT INTO message_stats (chat_id, summaries, last_summary_at)
+            SELECT new.chat_id, 1, new.created_at WHERE new.chat_id IS NOT NULL
+            ON CONFLICT (chat_id) DO UPDATE SET
+                summaries = summaries + 1,
+                last_summary_at = max(COALESCE(last_summary_at, ''), excluded.last_summary_at);
+        END
+        """
+    )
+
+    # Seed counters from the existing data
+    conn.execute(
+        """
+        INSERT INTO message_stats (chat_id, total, summarized)
+        SELECT chat_id, COUNT(*), SUM(summarized = 1) FROM messages GROUP BY chat_id
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO message_stats (chat_id, total, summarized)
+        SELECT 0, COUNT(*), COALESCE(SUM(summarized = 1), 0) FROM messages
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO message_stats (chat_id, summaries, last_summary_at)
+        SELECT chat_id, COUNT(*), MAX(created_at) FROM summaries
+        WHERE chat_id IS NOT NULL
+        GROUP BY chat_id
+        ON CONFLICT (chat_id) DO UPDATE SET
+            summaries = excluded.summaries,
+            last_summary_at = excluded.last_summary_at
+        """
+    )
+    conn.execute(
+        """
+        UPDATE message_stats
+        SET summaries = (SELECT COUNT(*) FROM summaries),
+            last_summary_at = (SELECT MAX(created_at) FROM summaries)
+        WHERE chat_id = 0
+        """
+    )
+
+
+@migration(7, "epoch milliseconds sort key")
+def _epoch_ms(conn: sqlite3.Connection) -> None:
+    # `date` was stored as ISO text in mixed offsets (MSK, UTC, naive), so
+    # ordering by it was not chronological. date_ms (UTC epoch milliseconds)
+    # is the canonical sort/range key; 0 marks messages without a date.
+    conn.execute("ALTER TABLE messages ADD COLUMN date_ms INTEGER NOT NULL DEFAULT 0")
+    # julianday() understands ISO offsets (+03:00, Z); naive values are UTC
+    conn.execute(
+        """
+        UPDATE messages
+        SET date_ms = CAST(round((julianday(date) - 2440587.5) * 86400000) AS INTEGER)
+        WHERE julianday(date) IS NOT NULL
+        """
+    )
+    conn.execute("DROP INDEX IF EXISTS idx_messages_date")
+    conn.execute("DROP INDEX IF EXISTS idx_messages_summarized_date")
+    conn.execute("DROP INDEX IF EXISTS idx_messages_chat_date")
+    # Effectively (date_ms, chat_id, id): keyset pagination key
+    conn.execute("CREATE INDEX idx_messages_date_ms ON messages(date_ms)")
+    conn.execute("CREATE INDEX idx_messages_summarized_date_ms ON messages(summarized, date_ms)")
+    # Time windows per chat ("last 24h for chat X")
+    conn.execute("CREATE INDEX idx_messages_chat_date_ms ON messages(chat_id, date_ms)")
+
+
+@migration(8, "backfill progress per chat")
+def _backfill_state(conn: sqlite3.Connection) -> None:
+    # History is walked newest -> oldest: max_id is the newest message id
+    # stored, min_id the oldest one reached so far; done = reached the start.
+    conn.execute(
+        """
+        CREATE TABLE backfill_state (
+            chat_id INTEGER PRIMARY KEY,
+            min_id INTEGER,
+            max_id INTEGER,
+            done INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT NOT NULL DEFAULT (datetime('now'))
+        )
+        """
+    )
+
+
+@migration(9, "edits, deletions and stale summaries")
+def _stale_summaries(conn: sqlite3.Connection) -> None:
+    # stale: 0 - up to date, 1 - a covered message was edited or deleted,
+    # 2 - being re-summarized (claimed at updated_at, see claim_stale_summaries)
+    conn.execute("ALTER TABLE summaries ADD COLUMN stale INTEGER NOT NULL DEFAULT 0")
+    conn.execute("ALTER TABLE summaries ADD COLUMN updated_at TEXT")
+    # Partial index: only the (few) stale rows, in claim order
+    conn.execute("CREATE INDEX idx_summaries_stale ON summaries(id) WHERE stale != 0")
+    # Telegram edit_date of the stored text, so an older edit never wins
+    conn.execute("ALTER TABLE messages ADD COLUMN edited_ms INTEGER")
+
+    # Invalidation follows the data: only summaries covering the touched
+    # message are marked, found through the summary_messages primary key
+    conn.execute(
+        """
+        CREATE TRIGGER summaries_stale_au AFTER UPDATE OF text ON messages
+        WHEN old.text IS NOT new.text BEGIN
+            UPDATE summaries SET stale = 1
+            WHERE id IN (
+                SELECT summary_id FROM summary_messages
+                WHERE chat_id = new.chat_id AND message_id = new.id
+            );
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER summaries_stale_ad AFTER DELETE ON messages BEGIN
+            UPDATE summaries SET stale = 1
+            WHERE id IN (
+                SELECT summary_id FROM summary_messages
+                WHERE chat_id = old.chat_id AND message_id = old.id
+            );
+        END
+        """
+    )
+    # Summaries whose messages were all deleted are removed; keep counters exact
+    conn.execute(
+        """
+        CREATE TRIGGER message_stats_summary_ad AFTER DELETE ON summaries BEGIN
+            UPDATE message_stats SET summaries = summaries - 1
+            WHERE chat_id = 0 OR chat_id = old.chat_id;
+        END
+        """
+    )
+
+
+@migration(10, "media metadata and download cache")
+def _media(conn: sqlite3.Connection) -> None:
+    # Metadata is captured at ingest without downloading anything;
+    # file_reference is the value seen at ingest (it expires, downloads
+    # re-fetch the message for a fresh one)
+    conn.execute(
+        """
+        CREATE TABLE message_media (
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            mime_type TEXT,
+            size INTEGER,
+            file_name TEXT,
+            duration REAL,
+            file_id INTEGER,
+            file_reference BLOB,
+            PRIMARY KEY (chat_id, message_id)
+        ) WITHOUT ROWID
+        """
+    )
+    # Lazily downloaded files: requested by the dashboard/mini app/bot,
+    # downloaded by the ingester, evicted by last access within a byte budget
+    conn.execute(
+        """
+        CREATE TABLE media_cache (
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            path TEXT,
+            size INTEGER NOT NULL DEFAULT 0,
+            requested_ms INTEGER NOT NULL,
+            last_access_ms INTEGER NOT NULL,
+            error TEXT,
+            PRIMARY KEY (chat_id, message_id)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute(
+        "CREATE INDEX idx_media_cache_pending ON media_cache(requested_ms) WHERE status = 'pending'"
+    )
+    conn.execute(
+        "CREATE INDEX idx_media_cache_lru ON media_cache(last_access_ms) WHERE status = 'ready'"
+    )
+    # Cached files of deleted messages simply age out of the LRU
+    conn.execute(
+        """
+        CREATE TRIGGER message_media_ad AFTER DELETE ON messages BEGIN
+            DELETE FROM message_media WHERE chat_id = old.chat_id AND message_id = old.id;
+        END
+        """
+    )
+
+
+@migration(11, "backfill history count")
+def _backfill_fetched(conn: sqlite3.Connection) -> None:
+    # Older-history messages fetched so far, so BACKFILL_LIMIT holds across runs
+    conn.execute("ALTER TABLE backfill_state ADD COLUMN fetched INTEGER NOT NULL DEFAULT 0")
+
+
+@migration(12, "catch-up seen watermark")
+def _chat_seen(conn: sqlite3.Connection) -> None:
+    # Newest message id catch-up has looked at, stored or filtered out, so a
+    # chat whose latest messages are filtered is not fetched again every time
+    conn.execute(
+        """
+        CREATE TABLE chat_seen (
+            chat_id INTEGER PRIMARY KEY,
+            seen_id INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """
+    )
+
+
+@migration(13, "claimable messages counter")
+def _claimable(conn: sqlite3.Connection) -> None:
+    # total - summarized also counted media-only rows (empty text) that the
+    # summarizer queue never claims, so the backlog never reached zero.
+    # claimable mirrors the claim_unsummarized filter; text edits can move
+    # a row in or out of it as well.
+    conn.execute("ALTER TABLE message_stats ADD COLUMN claimable INTEGER NOT NULL DEFAULT 0")
+    for name in ("message_stats_ai", "message_stats_ad", "message_stats_au"):
+        conn.execute(f"DROP TRIGGER {name}")
+    upsert = (
+        "ON CONFLICT (chat_id) DO UPDATE SET "
+        "total = total + excluded.total, summarized = summarized + excluded.summarized, "
+        "claimable = claimable + excluded.claimable"
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER message_stats_ai AFTER INSERT ON messages BEGIN
+            INSERT INTO message_stats (chat_id, total, summarized, claimable)
+            VALUES (new.chat_id, 1, new.summarized = 1, COALESCE(new.summarized = 0 AND new.text != '', 0)),
+                   (0, 1, new.summarized = 1, COALESCE(new.summarized = 0 AND new.text != '', 0))
+            {upsert};
+        END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER message_stats_ad AFTER DELETE ON messages BEGIN
+            INSERT INTO message_stats (chat_id, total, summarized, claimable)
+            VALUES (old.chat_id, -1, -(old.summarized = 1), -COALESCE(old.summarized = 0 AND old.text != '', 0)),
+                   (0, -1, -(old.summarized = 1), -COALESCE(old.summarized = 0 AND old.text != '', 0))
+            {upsert};
+        END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER message_stats_au AFTER UPDATE OF summarized, text ON messages
+        WHEN (old.summarized = 1) != (new.summarized = 1)
+          OR COALESCE(old.summarized = 0 AND old.text != '', 0)
+             != COALESCE(new.summarized = 0 AND new.text != '', 0) BEGIN
+            INSERT INTO message_stats (chat_id, total, summarized, claimable)
+            VALUES (new.chat_id, 0, (new.summarized = 1) - (old.summarized = 1),
+                    COALESCE(new.summarized = 0 AND new.text != '', 0)
+                    - COALESCE(old.summarized = 0 AND old.text != '', 0)),
+                   (0, 0, (new.summarized = 1) - (old.summarized = 1),
+                    COALESCE(new.summarized = 0 AND new.text != '', 0)
+                    - COALESCE(old.summarized = 0 AND old.text != '', 0))
+            {upsert};
+        END
+        """
+    )
+    # Seed from the existing data
+    conn.execute(
+        """
+        INSERT INTO message_stats (chat_id, claimable)
+        SELECT chat_id, COUNT(*) FROM messages
+        WHERE summarized = 0 AND text != ''
+        GROUP BY chat_id
+        ON CONFLICT (chat_id) DO UPDATE SET claimable = excluded.claimable
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO message_stats (chat_id, claimable)
+        SELECT 0, COUNT(*) FROM messages WHERE summarized = 0 AND text != ''
+        ON CONFLICT (chat_id) DO UPDATE SET claimable = excluded.claimable
+        """
+    )
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    """Return the highest applied migration version (0 for a fresh DB)."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT NOT NULL DEFAULT (datetime('now'))
+        )
+        """
+    )
+    row = conn.execute("SELECT MAX(version) AS version FROM schema_version").fetchone()
+    return row["version"] or 0
+
+
+def migrate(conn: Optional[sqlite3.Connection] = None) -> int:
+    """
+    Apply all pending migrations in order.
+    Returns the schema version after migrating.
+    """
+    conn = conn or get_connection()
+    version = current_version(conn)
+    for number, name, func in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if number <= version:
+            continue
+        with transaction(conn):
+            # Another process starting at the same time may have applied it
+            # while we waited for the write lock
+            version = current_version(conn)
+            if number <= version:
+                continue
+            func(conn)
+            conn.execute(
+                "INSERT INTO schema_version (version, name) VALUES (?, ?)",
+                (number, name),
+            )
+        version = number
+    return version
+
+
+# Queries that must stay index-backed, with sample parameters
+HOT_QUERIES = {
+    "unsummarized queue": (
+        """
+        SELECT chat_id, id, sender, text, date FROM messages
+        WHERE summarized = 0 AND text IS NOT NULL AND text != ''
+        ORDER BY date_ms ASC LIMIT ?
+        """,
+        (100,),
+    ),
+    "claim release": (
+        "UPDATE messages SET claim_token = NULL, claim_expires = NULL WHERE claim_token = ?",
+        ("token",),
+    ),
+    "dashboard page": (
+        """
+        SELECT chat_id, id, sender, text, date_ms, summarized FROM messages
+        WHERE (date_ms, chat_id, id) < (?, ?, ?)
+        ORDER BY date_ms DESC, chat_id DESC, id DESC LIMIT ?
+        """,
+        (1_700_000_000_000, 1, 1, 50),
+    ),
+    "statistics": (
+        "SELECT total, summarized, claimable, last_summary_at FROM message_stats WHERE chat_id = ?",
+        (0,),
+    ),
+    "summary for message": (
+        """
+        SELECT s.id FROM summary_messages sm JOIN summaries s ON s.id = sm.summary_id
+        WHERE sm.chat_id = ? AND sm.message_id = ?
+        """,
+        (1, 1),
+    ),
+    "recent summaries": ("SELECT id FROM summaries ORDER BY created_at DESC LIMIT ?", (10,)),
+    "chat time window": (
+        """
+        SELECT chat_id, id, sender, text, date_ms FROM messages
+        WHERE chat_id = ? AND date_ms >= ? AND date_ms < ?
+        ORDER BY date_ms ASC LIMIT ?
+        """,
+        (1, 0, 1_700_000_000_000, 500),
+    ),
+    "chat watermark": ("SELECT MAX(id) FROM messages WHERE chat_id = ?", (1,)),
+    "chat seen": ("SELECT seen_id FROM chat_seen WHERE chat_id = ?", (1,)),
+    "stale summaries": (
+        """
+        SELECT id FROM summaries
+        WHERE stale != 0 AND (stale = 1 OR updated_at < ?)
+        ORDER BY id LIMIT ?
+        """,
+        ("2000-01-01 00:00:00", 5),
+    ),
+    "media requests": (
+        """
+        SELECT chat_id, message_id FROM media_cache
+        WHERE status = 'pending' ORDER BY requested_ms LIMIT ?
+        """,
+        (10,),
+    ),
+    "media eviction": (
+        "SELECT chat_id, message_id, path, size FROM media_cache WHERE status = 'ready' ORDER BY last_access_ms LIMIT ?",
+        (100,),
+    ),
+    "summaries of message": (
+        "SELECT summary_id FROM summary_messages WHERE chat_id = ? AND message_id = ?",
+        (1, 1),
+    ),
+}
+
+# A plain "SCAN <table>" (no index) or a temp b-tree sort means a regression
+_BAD_PLAN = re.compile(r"^SCAN \w+$|TEMP B-TREE")
+
+
+def check_query_plans(conn: Optional[sqlite3.Connection] = None) -> List[str]:
+    """
+    Run EXPLAIN QUERY PLAN for every hot query.
+    Returns a list of problems (empty when all queries use indexes).
+    """
+    conn = conn or get_connection()
+    problems = []
+    for name, (sql, params) in HOT_QUERIES.items():
+        for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params):
+            detail = row["detail"]
+            if _BAD_PLAN.search(detail):
+                problems.append(f"{name}: {detail}")
+    return problems
+
+
+if __name__ == "__main__":
+    print(f"Schema version: {migrate()}")
+    if "--check" in sys.argv:
+        issues = check_query_plans()
+        for issue in issues:
+            print(f"  ✗ {issue}")
+        if issues:
+            sys.exit(1)
+        print("  ✓ All hot queries use indexes")
@@ -0,0 +1,32 @@
+"""
+Opaque cursor tokens for keyset pagination.
+
+A cursor is the sort key of the last row of a page, serialized as
+URL-safe base64 JSON, so callers pass it back verbatim without knowing
+which columns it holds.
+"""
+import base64
+import json
+from typing import Any, List, Optional
+
+
+def encode_cursor(*values: Any) -> str:
+    """Pack sort-key values into an opaque URL-safe token."""
+    raw = json.dumps(list(values), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: Optional[str], size: int) -> Optional[List[Any]]:
+    """
+    Unpack a token produced by encode_cursor.
+    Returns None for an empty token; raises ValueError for a malformed one.
+    """
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError) as exc:
+        raise ValueError("Некорректный курсор") from exc
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Некорректный курсор")
+    return values
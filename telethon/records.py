@@ -0,0 +1,54 @@
+"""Conversion of Telethon messages into rows of the messages table."""
+from typing import Any, Dict, Optional
+
+from db import to_epoch_ms
+from media import media_metadata
+
+
+def format_sender(sender: Optional[object], chat_title: str) -> str:
+    """
+    Normalize sender display:
+    - username
+    - first/last name
+    - title (for channels/chats)
+    - fallback to chat title
+    """
+    if sender is None:
+        return chat_title or "Unknown"
+
+    username = getattr(sender, "username", None)
+    if username:
+        return username
+
+    first_name = getattr(sender, "first_name", None)
+    last_name = getattr(sender, "last_name", None)
+    if first_name or last_name:
+        return " ".join(filter(None, (first_name, last_name)))
+
+    title = getattr(sender, "title", None)
+    if title:
+        return title
+
+    return chat_title or "Unknown"
+
+
+def message_to_row(message: Any, chat_id: int, sender_label: str) -> Dict[str, Any]:
+    """Build the dict expected by db.save_messages from a Telethon message."""
+    return {
+        "id": message.id,
+        "chat_id": chat_id,
+        "sender": sender_label,
+        "text": message.message or "",
+        # Время храним в UTC; в московское переводим только при отображении
+        "date": message.date.isoformat() if message.date else None,
+        "date_ms": to_epoch_ms(message.date),
+        # Only metadata; the file itself is downloaded on demand (media.py)
+        "media": media_metadata(message),
+    }
+
+
+def edited_row(message: Any, chat_id: int, sender_label: str) -> Dict[str, Any]:
+    """Row for writer.put_edit: message_to_row plus the edit timestamp."""
+    row = message_to_row(message, chat_id, sender_label)
+    row["edited_ms"] = to_epoch_ms(message.edit_date) or row["date_ms"]
+    return row
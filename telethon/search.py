@@ -0,0 +1,198 @@
+"""
+Full-text search over messages and summaries (SQLite FTS5).
+
+The FTS tables are external-content indexes kept in sync by triggers (see
+migration 5 in migrations.py), so they store only the inverted index, not a
+second copy of the text. Two tokenizers are supported, chosen with the
+SEARCH_TOKENIZER env variable:
+
+- ``unicode61`` (default): word tokens; query words are reduced by a light
+  Russian stemmer and matched as prefixes, so "сообщениями" finds
+  "сообщение", "сообщения" etc.
+- ``trigram``: substring matching on any 3+ character fragment, robust to
+  any morphology at the cost of a larger index.
+
+After changing SEARCH_TOKENIZER call ``rebuild_search_index()``.
+"""
+import html
+import os
+import re
+import sqlite3
+from typing import Any, Dict, List, Optional, Tuple
+
+from connection import get_connection, transaction
+from pagination import decode_cursor, encode_cursor
+
+TOKENIZER = (os.getenv("SEARCH_TOKENIZER") or "unicode61").lower()
+
+_TOKENIZE_ARGS = {
+    "unicode61": "unicode61 remove_diacritics 2",
+    "trigram": "trigram",
+}
+
+# Private-use markers around matches; escaped text is then wrapped in <mark>
+_HL_START, _HL_END = "\ue000", "\ue001"
+# Private-use marker for a cut, so it is not confused with a "…" in the text
+_CUT = "\ue002"
+_MARKERS = (_HL_START, _HL_END, _CUT)
+
+# Russian inflection endings, longest first
+_RU_ENDINGS = sorted(
+    """
+    иями ями ами ого его ому ему ыми ими ость ости ение ения ений ению ением
+    ов ев ей ий ый ой ая яя ое ее ие ые ых их ую юю ом ем ам ям ах ях ею ою
+    а я о е ы и у ю ь
+    """.split(),
+    key=len,
+    reverse=True,
+)
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def fts_create_sql(table: str, columns: str, content: str, content_rowid: str) -> str:
+    """DDL for an external-content FTS5 table using the configured tokenizer."""
+    tokenize = _TOKENIZE_ARGS.get(TOKENIZER, _TOKENIZE_ARGS["unicode61"])
+    return (
+        f"CREATE VIRTUAL TABLE {table} USING fts5({columns}, "
+        f"content='{content}', content_rowid='{content_rowid}', tokenize='{tokenize}')"
+    )
+
+
+def _stem(word: str) -> str:
+    """Strip a common Russian ending, keeping at least 3 characters."""
+    for ending in _RU_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[: -len(ending)]
+    return word
+
+
+def build_match_query(query: str) -> str:
+    """
+    Turn free user input into a safe FTS5 MATCH expression.
+    Raises ValueError if the query has no searchable words.
+    """
+    words = [fold_yo(w.lower()) for w in _WORD_RE.findall(query)]
+    if TOKENIZER == "trigram":
+        words = [w for w in words if len(w) >= 3]
+        if not words:
+            raise ValueError("Запрос должен содержать слова длиной от 3 символов")
+        return " AND ".join(f'"{w}"' for w in words)
+    if not words:
+        raise ValueError("Пустой поисковый запрос")
+    return " AND ".join(f'"{_stem(w)}"*' for w in words)
+
+
+def fold_yo(text: str) -> str:
+    """ё -> е, as the index stores it (see migration 5); keeps the length."""
+    return text.replace("ё", "е").replace("Ё", "Е")
+
+
+def _restore_snippet(snippet: Optional[str], original: Optional[str]) -> Optional[str]:
+    """
+    The index holds ё-folded text, so snippet() returns it folded. Folding
+    maps character to character: find the fragment in the folded original
+    and take the original characters at the same positions.
+    """
+    if not snippet or not original:
+        return snippet
+    plain = "".join(ch for ch in snippet if ch not in _MARKERS)
+    start = fold_yo(original).find(plain)
+    if start < 0:
+        return snippet
+    restored = []
+    position = start
+    for ch in snippet:
+        if ch in _MARKERS:
+            restored.append(ch)
+        else:
+            restored.append(original[position])
+            position += 1
+    return "".join(restored)
+
+
+def _snippet_html(snippet: Optional[str]) -> str:
+    escaped = html.escape(snippet or "", quote=False)
+    return escaped.replace(_HL_START, "<mark>").replace(_HL_END, "</mark>").replace(_CUT, "…")
+
+
+def _decode_search_cursor(cursor: Optional[str]) -> Tuple[float, int]:
+    values = decode_cursor(cursor, 2)
+    if values is None:
+        return float("-inf"), 0
+    try:
+        return float(values[0]), int(values[1])
+    except (TypeError, ValueError) as exc:
+        raise ValueError("Некорректный курсор") from exc
+
+
+def _paginate(rows: List[sqlite3.Row], limit: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    results = []
+    for row in rows:
+        item = dict(row)
+        item["snippet"] = _snippet_html(_restore_snippet(item["snippet"], item.pop("source_text")))
+        results.append(item)
+    next_cursor = encode_cursor(rows[-1]["rank"], rows[-1]["doc_id"]) if has_more else None
+    return results, next_cursor
+
+
+def search_messages(
+    query: str, limit: int = 20, cursor: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Ranked search over messages (best matches first).
+    Returns (results, next_cursor); snippets are HTML with <mark> highlights.
+    """
+    match = build_match_query(query)
+    after_rank, after_id = _decode_search_cursor(cursor)
+    rows = get_connection().execute(
+        f"""
+        SELECT m.chat_id, m.id, m.sender, m.date, m.date_ms, m.summarized, m.text AS source_text,
+               snippet(messages_fts, 0, '{_HL_START}', '{_HL_END}', '{_CUT}', 16) AS snippet,
+               f.rank AS rank, f.rowid AS doc_id
+        FROM messages_fts f
+        JOIN message_search_keys k ON k.doc_id = f.rowid
+        JOIN messages m ON m.chat_id = k.chat_id AND m.id = k.message_id
+        WHERE messages_fts MATCH ?
+          AND (f.rank > ? OR (f.rank = ? AND f.rowid > ?))
+        ORDER BY f.rank, f.rowid
+        LIMIT ?
+        """,
+        (match, after_rank, after_rank, after_id, limit + 1),
+    ).fetchall()
+    return _paginate(rows, limit)
+
+
+def search_summaries(
+    query: str, limit: int = 20, cursor: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Ranked search over summaries, same contract as search_messages."""
+    match = build_match_query(query)
+    after_rank, after_id = _decode_search_cursor(cursor)
+    rows = get_connection().execute(
+        f"""
+        SELECT s.id, s.chat_id, s.message_count, s.created_at, s.text AS source_text,
+               snippet(summaries_fts, 0, '{_HL_START}', '{_HL_END}', '{_CUT}', 24) AS snippet,
+               f.rank AS rank, f.rowid AS doc_id
+        FROM summaries_fts f
+        JOIN summaries s ON s.id = f.rowid
+        WHERE summaries_fts MATCH ?
+          AND (f.rank > ? OR (f.rank = ? AND f.rowid > ?))
+        ORDER BY f.rank, f.rowid
+        LIMIT ?
+        """,
+        (match, after_rank, after_rank, after_id, limit + 1),
+    ).fetchall()
+    return _paginate(rows, limit)
+
+
+def rebuild_search_index() -> None:
+    """Recreate both FTS tables with the configured tokenizer and reindex."""
+    with transaction() as conn:
+        conn.execute("DROP TABLE IF EXISTS messages_fts")
+        conn.execute("DROP TABLE IF EXISTS summaries_fts")
+        conn.execute(fts_create_sql("messages_fts", "text, sender", "messages_fts_source", "doc_id"))
+        conn.execute(fts_create_sql("summaries_fts", "text", "summaries_fts_source", "id"))
+        conn.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+        conn.execute("INSERT INTO summaries_fts(summaries_fts) VALUES ('rebuild')")
@@ -0,0 +1,311 @@
+"""
+In-memory Telethon session persisted by periodic flushes.
+
+Telethon's SQLite ``.session`` rewrites every entity it sees (with a fresh
+``date``) on each batch of updates, competing for the disk with
+messages.db. With SESSION_STORAGE=memory the client runs on a
+``SnapshotSession``: the ``.session`` file is read once at startup into
+memory, lookups are dict hits, and only rows that actually changed
+(new/renamed entities, moved update state) are written back every
+SESSION_FLUSH_SECONDS and at shutdown. Each flush is a single SQLite
+transaction, so after a crash the file holds either the previous or the
+new state, never a mix. The file keeps Telethon's format, so switching
+back to SESSION_STORAGE=sqlite needs no conversion.
+
+Auth key and data center changes are written immediately: losing them
+would mean logging in again. Only the uploaded-files cache is not
+persisted (the ingester does not upload).
+
+The file is written with explicit column lists of Telethon's schema and
+rows come from MemorySession._entities_to_rows, so the Telethon version is
+pinned in requirements.txt (1.45.x); check this module when upgrading.
+"""
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from telethon import utils
+from telethon.sessions import MemorySession, SQLiteSession
+from telethon.tl.types import PeerChannel, PeerChat, PeerUser
+
+logger = logging.getLogger("tg-bot.session")
+
+EXTENSION = ".session"
+
+
+class Snapshot(NamedTuple):
+    """Changes copied on the event loop, written from a thread."""
+
+    version: int
+    session: Optional[tuple]
+    entities: List[tuple]
+    update_states: List[tuple]
+
+
+class SnapshotSession(MemorySession):
+    """MemorySession loaded from and periodically flushed to a Telethon .session file."""
+
+    def __init__(self, session_name: str) -> None:
+        super().__init__()
+        path = Path(session_name)
+        self.path = path if path.name.endswith(EXTENSION) else path.with_name(path.name + EXTENSION)
+        # Entities by marked id, plus username/phone indexes (MemorySession scans a set)
+        self._rows: Dict[int, tuple] = {}
+        self._usernames: Dict[str, int] = {}
+        self._phones: Dict[str, int] = {}
+        # Changes since the last snapshot
+        self._changed_rows: Dict[int, tuple] = {}
+        self._changed_states: Set[int] = set()
+        self._session_changed = False
+        # Snapshots are written strictly in the order they were taken
+        self._turn = threading.Condition()
+        self._version = 0
+        self._written_version = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        self.load_ms = 0.0
+        self.flushes = 0
+        self.rows_written = 0
+        if self.path.exists():
+            self._load()
+
+    # Loading and saving
+
+    def _load(self) -> None:
+        started = time.perf_counter()
+        disk = SQLiteSession(str(self.path))
+        try:
+            self._dc_id = disk.dc_id
+            self._server_address = disk.server_address
+            self._port = disk.port
+            self._auth_key = disk.auth_key
+            self._takeout_id = disk.takeout_id
+            self._update_states = dict(disk.get_update_states())
+        finally:
+            disk.close()
+        # Opening it with SQLiteSession first brought the schema up to date
+        conn = sqlite3.connect(str(self.path))
+        try:
+            for row in conn.execute("SELECT id, hash, username, phone, name FROM entities"):
+                self._put_row(tuple(row))
+        finally:
+            conn.close()
+        self.load_ms = (time.perf_counter() - started) * 1000
+        logger.info("Session %s: loaded %d entities in %.0f ms", self.path, len(self._rows), self.load_ms)
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._session_changed or self._changed_rows or self._changed_states)
+
+    def snapshot(self) -> Optional[Snapshot]:
+        """Changes to persist since the last snapshot, or None when there are none."""
+        if not self.dirty:
+            return None
+        session = None
+        if self._session_changed:
+            session = (
+                self._dc_id,
+                self._server_address,
+                self._port,
+                self._auth_key.key if self._auth_key else b"",
+                self._takeout_id,
+                b"",
+            )
+        now = int(time.time())
+        states = []
+        for entity_id in self._changed_states:
+            state = self._update_states[entity_id]
+            states.append((entity_id, state.pts, state.qts, int(state.date.timestamp()), state.seq))
+        self._version += 1
+        snapshot = Snapshot(
+            self._version, session, [row + (now,) for row in self._changed_rows.values()], states
+        )
+        self._session_changed = False
+        self._changed_rows = {}
+        self._changed_states = set()
+        return snapshot
+
+    def write_snapshot(self, snapshot: Snapshot) -> None:
+        """Apply a snapshot to the session file in one transaction (after all older ones)."""
+        with self._turn:
+            # The timeout only guards against a snapshot that was never written
+            self._turn.wait_for(lambda: self._written_version >= snapshot.version - 1, timeout=30)
+            try:
+                self._write(snapshot)
+                self.flushes += 1
+                self.rows_written += len(snapshot.entities) + len(snapshot.update_states)
+            except (OSError, sqlite3.Error):
+                self._restore(snapshot)
+                raise
+            finally:
+                self._written_version = snapshot.version
+                self._turn.notify_all()
+
+    def _write(self, snapshot: Snapshot) -> None:
+        if self._conn is None:
+            if not self.path.exists():
+                # Let Telethon create its schema
+                SQLiteSession(str(self.path)).close()
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+            # A small WAL append per flush instead of a rollback journal created,
+            # synced and deleted every time (Telethon reads WAL files as well)
+            self._conn.execute("PRAGMA journal_mode = WAL")
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if snapshot.session is not None:
+                conn.execute("DELETE FROM sessions")
+                conn.execute(
+                    "INSERT INTO sessions (dc_id, server_address, port, auth_key, takeout_id, tmp_auth_key) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    snapshot.session,
+                )
+            conn.executemany(
+                "INSERT OR REPLACE INTO entities (id, hash, username, phone, name, date) VALUES (?, ?, ?, ?, ?, ?)",
+                snapshot.entities,
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO update_state (id, pts, qts, date, seq) VALUES (?, ?, ?, ?, ?)",
+                snapshot.update_states,
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _restore(self, snapshot: Snapshot) -> None:
+        # Keep the changes for the next attempt, unless newer ones exist
+        if snapshot.session is not None:
+            self._session_changed = True
+        for row in snapshot.entities:
+            self._changed_rows.setdefault(row[0], self._rows.get(row[0], row[:5]))
+        self._changed_states.update(state[0] for state in snapshot.update_states)
+
+    def flush(self) -> None:
+        """Persist pending changes now (blocking)."""
+        snapshot = self.snapshot()
+        if snapshot is not None:
+            self.write_snapshot(snapshot)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entities": len(self._rows),
+            "load_ms": round(self.load_ms),
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+        }
+
+    # Session interface: state lives in memory, changes are only recorded
+
+    def set_dc(self, dc_id: int, server_address: str, port: int) -> None:
+        if (dc_id, server_address, port) == (self._dc_id, self._server_address, self._port):
+            return
+        super().set_dc(dc_id, server_address, port)
+        self._session_changed = True
+        self.flush()
+
+    @MemorySession.auth_key.setter
+    def auth_key(self, value: Any) -> None:
+        self._auth_key = value
+        self._session_changed = True
+        self.flush()
+
+    @MemorySession.takeout_id.setter
+    def takeout_id(self, value: Optional[int]) -> None:
+        self._takeout_id = value
+        self._session_changed = True
+
+    def set_update_state(self, entity_id: int, state: Any) -> None:
+        old = self._update_states.get(entity_id)
+        # Telethon stamps channel states with the current time, only pts matters there
+        if old is None or (old.pts, old.qts, old.seq) != (state.pts, state.qts, state.seq) or (
+            entity_id == 0 and old.date != state.date
+        ):
+            self._changed_states.add(entity_id)
+        self._update_states[entity_id] = state
+
+    def save(self) -> None:
+        # Called by Telethon every minute and after downloads;
+        # persist_sessions() does the writing off the event loop
+        pass
+
+    def close(self) -> None:
+        self.flush()
+        with self._turn:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def delete(self) -> bool:
+        # Log out
+        self.close()
+        self._rows.clear()
+        self._usernames.clear()
+        self._phones.clear()
+        try:
+            self.path.unlink()
+            return True
+        except OSError:
+            return False
+
+    def _put_row(self, row: tuple) -> bool:
+        entity_id, _, username, phone, _ = row
+        old = self._rows.get(entity_id)
+        if old == row:
+            return False
+        if old is not None:
+            if old[2] and self._usernames.get(old[2]) == entity_id:
+                del self._usernames[old[2]]
+            if old[3] and self._phones.get(old[3]) == entity_id:
+                del self._phones[old[3]]
+        self._rows[entity_id] = row
+        if username:
+            self._usernames[username] = entity_id
+        if phone:
+            self._phones[phone] = entity_id
+        return True
+
+    def process_entities(self, tlo: Any) -> None:
+        for row in self._entities_to_rows(tlo):
+            if self._put_row(row):
+                self._changed_rows[row[0]] = row
+
+    def _lookup(self, entity_id: Optional[int]) -> Optional[Tuple[int, int]]:
+        row = self._rows.get(entity_id) if entity_id is not None else None
+        return (row[0], row[1]) if row else None
+
+    def get_entity_rows_by_phone(self, phone: str) -> Optional[Tuple[int, int]]:
+        return self._lookup(self._phones.get(phone))
+
+    def get_entity_rows_by_username(self, username: str) -> Optional[Tuple[int, int]]:
+        return self._lookup(self._usernames.get(username))
+
+    def get_entity_rows_by_name(self, name: str) -> Optional[Tuple[int, int]]:
+        return next(((row[0], row[1]) for row in self._rows.values() if row[4] == name), None)
+
+    def get_entity_rows_by_id(self, id: int, exact: bool = True) -> Optional[Tuple[int, int]]:
+        if exact:
+            return self._lookup(id)
+        # Unmarked id: try it as a user, a basic group and a channel
+        for peer_cls in (PeerUser, PeerChat, PeerChannel):
+            found = self._lookup(utils.get_peer_id(peer_cls(id)))
+            if found:
+                return found
+        return None
+
+
+async def persist_sessions(sessions: List[SnapshotSession], interval: float = 60) -> None:
+    """Periodically flush changed sessions; snapshots are taken on the loop, written in a thread."""
+    while True:
+        await asyncio.sleep(interval)
+        for session in sessions:
+            snapshot = session.snapshot()
+            if snapshot is None:
+                continue
+            try:
+                await asyncio.to_thread(session.write_snapshot, snapshot)
+            except (OSError, sqlite3.Error) as exc:
+                logger.error("Session %s: flush failed: %s", session.path, exc)
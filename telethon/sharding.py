@@ -0,0 +1,244 @@
+"""
+Multi-account sharded ingestion.
+
+All dialogs of one account share its rate limits, so several accounts
+(sessions) can be configured with EXTRA_ACCOUNTS. Each channel or
+supergroup is owned by exactly one account, chosen by consistent hashing of
+the chat id over the accounts that are members of that chat and currently
+available; adding or removing an account only moves the chats that hashed
+to it. When the owner is flood-limited or disconnected, its chats fail over
+to the next account on the ring.
+
+Private chats and basic groups are never sharded: their message ids are
+numbered per account (and a private chat id is just the other user's id),
+while messages are keyed by (chat_id, id). Two accounts would store
+colliding rows for such chats, so only the primary account handles them;
+the private chats and basic groups of extra accounts are not ingested.
+Every account runs in its own tasks in this process and feeds the single
+MessageWriter.
+"""
+import asyncio
+import bisect
+import hashlib
+import logging
+import time
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Set
+
+from telethon import TelegramClient
+from telethon.errors import RPCError
+from telethon.tl.types import Dialog
+
+import config
+
+logger = logging.getLogger("tg-bot.shards")
+
+# Marked ids of channels/supergroups are -100xxxxxxxxxx, below this bound
+CHANNEL_ID_BOUND = -1_000_000_000_000
+
+
+def is_channel(chat_id: int) -> bool:
+    """Channel or supergroup: message ids are shared by all its members."""
+    return chat_id <= CHANNEL_ID_BOUND
+
+
+class Account(NamedTuple):
+    """Telegram account credentials of one shard."""
+
+    name: str
+    session: str
+    api_id: int
+    api_hash: str
+
+
+def load_accounts() -> List[Account]:
+    """
+    Primary account from config plus EXTRA_ACCOUNTS entries
+    ("session" or "session:api_id:api_hash", comma-separated).
+    """
+    accounts = [Account(config.session_name, config.session_name, config.api_id, config.api_hash)]
+    for entry in config.extra_accounts.split(","):
+        parts = entry.strip().split(":")
+        if not parts[0]:
+            continue
+        if len(parts) == 3:
+            accounts.append(Account(parts[0], parts[0], int(parts[1]), parts[2]))
+        else:
+            accounts.append(Account(parts[0], parts[0], config.api_id, config.api_hash))
+    return accounts
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes."""
+
+    def __init__(self, nodes: Iterable[str], replicas: int = 64) -> None:
+        self._ring = sorted((_hash(f"{node}#{i}"), node) for node in nodes for i in range(replicas))
+        self._keys = [point for point, _ in self._ring]
+
+    def node_for(self, key: Any, eligible: Optional[Iterable[str]] = None) -> Optional[str]:
+        """First node clockwise from the key's point, limited to eligible nodes."""
+        if not self._ring:
+            return None
+        allowed = set(eligible) if eligible is not None else None
+        start = bisect.bisect(self._keys, _hash(str(key)))
+        for offset in range(len(self._ring)):
+            node = self._ring[(start + offset) % len(self._ring)][1]
+            if allowed is None or node in allowed:
+                return node
+        return None
+
+
+class Shard:
+    """One account: its client, the dialogs it can see and its health."""
+
+    def __init__(self, account: Account, client: TelegramClient) -> None:
+        self.account = account
+        self.name = account.name
+        self.client = client
+        self.dialogs: Dict[int, Dialog] = {}
+        # Chats this account is a member of (dialogs plus chats seen in updates)
+        self.chat_ids: Set[int] = set()
+        self.started = False
+        self.flood_until = 0.0
+        self.floods = 0
+        self.handled = 0
+
+    def available(self) -> bool:
+        return self.started and self.client.is_connected() and time.monotonic() >= self.flood_until
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "connected": self.started and self.client.is_connected(),
+            "flood_wait_left": max(0, round(self.flood_until - time.monotonic())),
+            "floods": self.floods,
+            "chats": len(self.chat_ids),
+            "handled": self.handled,
+        }
+
+
+class ShardManager:
+    """Owns the shards and decides which account serves which chat."""
+
+    def __init__(self, accounts: List[Account], client_factory: Callable[[Account], TelegramClient]) -> None:
+        self.shards: Dict[str, Shard] = {
+            account.name: Shard(account, client_factory(account)) for account in accounts
+        }
+        self.ring = HashRing(self.shards)
+        self.primary = self.shards[accounts[0].name]
+
+    async def _start_shard(self, shard: Shard, attempts: int = 5) -> None:
+        for attempt in range(1, attempts + 1):
+            try:
+                await shard.client.start()
+                break
+            except RPCError as exc:
+                logger.error("Shard %s: RPCError during start: %s (attempt %d)", shard.name, exc, attempt)
+                await asyncio.sleep(3)
+        else:
+            raise RuntimeError(f"Shard {shard.name} could not start")
+        shard.dialogs = {dialog.id: dialog for dialog in await shard.client.get_dialogs()}
+        shard.chat_ids.update(shard.dialogs)
+        shard.started = True
+
+    async def start(self) -> None:
+        """
+        Start every account; only the primary one is mandatory.
+        Sequential, since a new session may ask for a login code in the console.
+        """
+        for shard in self.shards.values():
+            try:
+                await self._start_shard(shard)
+            except Exception as exc:
+                if shard is self.primary:
+                    raise
+                logger.error("Shard %s is down: %s", shard.name, exc)
+        logger.info("Shards: %s", self.status())
+
+    async def stop(self) -> None:
+        await asyncio.gather(*(shard.client.disconnect() for shard in self.shards.values()), return_exceptions=True)
+
+    async def run_until_disconnected(self) -> None:
+        """Wait until every started account is disconnected."""
+        await asyncio.gather(
+            *(shard.client.run_until_disconnected() for shard in self.shards.values() if shard.started)
+        )
+
+    def started(self) -> List[Shard]:
+        return [shard for shard in self.shards.values() if shard.started]
+
+    def owner(self, chat_id: int) -> Optional[Shard]:
+        """
+        Account serving the chat. Channels: consistent hash over available
+        members, falling back to any member while all of them are
+        unavailable. Other chats: the primary account when it is a member,
+        without failover (their message ids belong to one account).
+        """
+        if not is_channel(chat_id):
+            primary = self.primary
+            return primary if primary.started and chat_id in primary.chat_ids else None
+        members = [shard.name for shard in self.started() if chat_id in shard.chat_ids]
+        if not members:
+            return None
+        available = [name for name in members if self.shards[name].available()]
+        name = self.ring.node_for(chat_id, available or members)
+        return self.shards[name] if name else None
+
+    def owns(self, shard: Shard, chat_id: int) -> bool:
+        """Whether the shard should handle an update it received for the chat."""
+        # Receiving an update proves membership, e.g. in a chat joined after start
+        shard.chat_ids.add(chat_id)
+        # Private chats and basic groups: the primary account only, see above
+        return self.owner(chat_id) is shard
+
+    async def entity_for(self, shard: Shard, chat_id: int) -> Any:
+        """The chat's entity as seen by this account (access hashes are per account)."""
+        dialog = shard.dialogs.get(chat_id)
+        return dialog.entity if dialog is not None else await shard.client.get_input_entity(chat_id)
+
+    def report_flood(self, shard: Shard, seconds: int) -> None:
+        """Mark the account flood-limited; its channels fail over meanwhile."""
+        shard.flood_until = max(shard.flood_until, time.monotonic() + seconds)
+        shard.floods += 1
+        logger.warning("Shard %s is flood-limited for %ss, failing over its channels", shard.name, seconds)
+
+    def dialogs(self) -> List[Dialog]:
+        """Every dialog some account handles, taken from its owner."""
+        merged: Dict[int, Dialog] = {}
+        for shard in self.started():
+            for chat_id, dialog in shard.dialogs.items():
+                if chat_id not in merged:
+                    owner = self.owner(chat_id)
+                    if owner is not None:
+                        merged[chat_id] = owner.dialogs.get(chat_id, dialog)
+        return list(merged.values())
+
+    def status(self) -> Dict[str, Any]:
+        """Health of every shard and how many chats it currently owns."""
+        owned: Dict[str, int] = {name: 0 for name in self.shards}
+        for dialog in self.dialogs():
+            owner = self.owner(dialog.id)
+            if owner is not None:
+                owned[owner.name] += 1
+        return {
+            name: {**shard.status(), "owned_chats": owned[name]}
+            for name, shard in self.shards.items()
+        }
+
+    def assignment(self) -> Dict[int, str]:
+        """Current chat -> account mapping."""
+        result = {}
+        for dialog in self.dialogs():
+            owner = self.owner(dialog.id)
+            if owner is not None:
+                result[dialog.id] = owner.name
+        return result
+
+
+async def log_status(manager: ShardManager, interval: float = 60) -> None:
+    """Periodically log shard health and assignment counts."""
+    while True:
+        await asyncio.sleep(interval)
+        logger.info("Shards: %s", manager.status())
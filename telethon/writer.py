@@ -0,0 +1,245 @@
+"""
+Write-behind stage for message ingestion.
+
+Event handlers push message dicts into a bounded asyncio queue and return
+immediately. A single writer task drains the queue and stores rows with
+``executemany`` in one transaction, every ``batch_size`` rows or every
+``flush_ms`` milliseconds, whichever comes first. Edits and deletions go
+through the same queue and the same transactions. The SQLite work runs in
+a dedicated thread so the event loop is never blocked by disk I/O.
+
+A batch that fails to store is kept and retried (with backoff, ahead of
+newer rows); flush barriers waiting on it fail with the error meanwhile,
+and the bounded queue holds back producers. Database outages
+(sqlite3.OperationalError: locked, I/O) are retried until they pass. Any
+other error after MAX_BATCH_RETRIES attempts is isolated by storing the
+batch change by change: the good rows get through, and the ones that still
+fail are logged and dropped.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from connection import close_connection
+from db import apply_message_changes
+
+logger = logging.getLogger("tg-bot.writer")
+
+_STOP = object()
+
+# Backoff between attempts to store a failed batch, seconds
+RETRY_DELAY = 0.5
+RETRY_DELAY_MAX = 30.0
+# Attempts of a whole batch before it is stored change by change
+MAX_BATCH_RETRIES = 5
+
+# Queue items other than plain message dicts (inserts)
+_EDIT = "edit"
+_DELETE = "delete"
+
+
+class MessageWriter:
+    """Batching single-writer queue in front of the messages table."""
+
+    def __init__(
+        self,
+        batch_size: int = 500,
+        flush_ms: int = 200,
+        max_queue: int = 10_000,
+    ) -> None:
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._task: Optional[asyncio.Task] = None
+        # One thread => one connection => exactly one writer
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        # Flush barriers not resolved yet (queued or collected)
+        self._barriers: Set[asyncio.Future] = set()
+        self._closing = False
+        self.written = 0
+
+    async def start(self) -> None:
+        """Start the background writer task."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="message-writer")
+
+    async def put(self, message_data: Dict[str, Any]) -> None:
+        """
+        Enqueue a message for storage.
+
+        Waits while the queue is full, which applies back-pressure to the
+        producers instead of growing memory without bound.
+        """
+        await self._queue.put(message_data)
+
+    async def put_edit(self, message_data: Dict[str, Any]) -> None:
+        """Enqueue an edited message (needs "edited_ms"); stored in place."""
+        await self._queue.put((_EDIT, message_data))
+
+    async def put_delete(self, chat_ids: List[int], message_ids: List[int]) -> None:
+        """Enqueue deleted message ids; see db.delete_messages for chat_ids."""
+        await self._queue.put((_DELETE, (list(chat_ids), list(message_ids))))
+
+    async def close(self) -> None:
+        """Flush everything still queued and stop the writer."""
+        if self._task is None:
+            return
+        # Stop retrying a failing batch even before _STOP is dequeued
+        self._closing = True
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+        await asyncio.get_running_loop().run_in_executor(self._executor, close_connection)
+        self._executor.shutdown(wait=True)
+        logger.info("Writer stopped, %d messages stored", self.written)
+
+    async def flush(self) -> None:
+        """
+        Wait until everything enqueued before this call is stored.
+
+        Used as a barrier, e.g. before recording backfill progress. Raises
+        the storage error if those changes could not be written (yet); they
+        stay queued for another attempt.
+        """
+        if self._task is None:
+            return
+        done = asyncio.get_running_loop().create_future()
+        self._barriers.add(done)
+        try:
+            await self._queue.put(done)
+            await done
+        finally:
+            self._barriers.discard(done)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        # Changes of a failed batch, stored first on the next attempt
+        pending: List[Any] = []
+        failures = 0
+        while not stopping:
+            batch: List[Any] = pending
+            waiters: List[asyncio.Future] = []
+            deadline = None
+            if pending:
+                # Retry after a backoff, taking newer items in meanwhile
+                delay = min(RETRY_DELAY * 2 ** (failures - 1), RETRY_DELAY_MAX)
+                deadline = loop.time() + delay
+                if len(batch) >= self.batch_size:
+                    await asyncio.sleep(delay)
+
+            # Collect rows until the batch is full, the deadline passes
+            # (counted from the first row) or a flush barrier arrives
+            while len(batch) < self.batch_size:
+                if deadline is None:
+                    item = await self._queue.get()
+                    deadline = loop.time() + self.flush_interval
+                else:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _STOP:
+                    stopping = True
+                    break
+                if isinstance(item, asyncio.Future):
+                    waiters.append(item)
+                    break
+                batch.append(item)
+
+            error = await self._flush(batch) if batch else None
+            if (
+                error is not None
+                and not isinstance(error, sqlite3.OperationalError)
+                # On close there is no later attempt: save what can be saved now
+                and (failures + 1 >= MAX_BATCH_RETRIES or self._closing)
+            ):
+                batch, error = await self._flush_each(batch)
+            if error is None:
+                pending, failures = [], 0
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_result(None)
+            else:
+                pending, failures = batch, failures + 1
+                # Every barrier, even one still queued, is behind the failed batch
+                for waiter in self._barriers:
+                    if not waiter.done():
+                        waiter.set_exception(error)
+                if self._closing:
+                    logger.error("Writer stopped: %d changes and everything queued after them not stored", len(batch))
+                    break
+
+    async def _flush(self, batch: List[Any]) -> Optional[Exception]:
+        """Store a batch in one transaction; returns the error instead of raising."""
+        loop = asyncio.get_running_loop()
+        inserts, edits, deletes = _split(batch)
+        try:
+            inserted = await loop.run_in_executor(
+                self._executor, apply_message_changes, inserts, edits, deletes
+            )
+        except Exception as exc:  # keep the writer alive on DB errors
+            logger.exception("Failed to store batch of %d changes, will retry: %s", len(batch), exc)
+            return exc
+        self.written += inserted
+        logger.debug(
+            "Flushed %d messages (%d new), %d edits, %d deletions",
+            len(inserts), inserted, len(edits), len(deletes),
+        )
+        return None
+
+    async def _flush_each(self, batch: List[Any]) -> Tuple[List[Any], Optional[Exception]]:
+        """
+        Store a failing batch change by change, dropping the changes that
+        fail on their own. Returns the changes left for a retry (from the
+        first database outage on) and that error.
+        """
+        loop = asyncio.get_running_loop()
+        inserted, rejected, left, error = await loop.run_in_executor(self._executor, _apply_each, batch)
+        self.written += inserted
+        for item, exc in rejected:
+            logger.error(
+                "Dropped a change that cannot be stored (%s): %s",
+                exc, json.dumps(item, ensure_ascii=False, default=str)[:1000],
+            )
+        logger.warning(
+            "Stored a failing batch change by change: %d dropped, %d left for a retry",
+            len(rejected), len(left),
+        )
+        return left, error
+
+
+def _split(batch: List[Any]) -> Tuple[List[Any], List[Any], List[Any]]:
+    """Queue items -> (inserts, edits, deletes) for apply_message_changes."""
+    inserts, edits, deletes = [], [], []
+    for item in batch:
+        if isinstance(item, tuple):
+            kind, payload = item
+            (edits if kind == _EDIT else deletes).append(payload)
+        else:
+            inserts.append(item)
+    return inserts, edits, deletes
+
+
+def _apply_each(batch: List[Any]) -> Tuple[int, List[Tuple[Any, Exception]], List[Any], Optional[Exception]]:
+    """
+    Runs in the writer thread: one transaction per change, in order.
+    Returns (inserted, rejected (item, error) pairs, items left, outage error).
+    """
+    inserted = 0
+    rejected = []
+    for index, item in enumerate(batch):
+        try:
+            inserted += apply_message_changes(*_split([item]))
+        except sqlite3.OperationalError as exc:
+            # The database itself is failing, not this change
+            return inserted, rejected, batch[index:], exc
+        except Exception as exc:
+            rejected.append((item, exc))
+    return inserted, rejected, [], None
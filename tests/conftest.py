@@ -0,0 +1,40 @@
+"""Shared fixtures: a migrated messages.db in a temporary directory."""
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "ai"))
+sys.path.insert(0, str(ROOT / "telethon"))
+
+import connection  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """Point MESSAGES_DB_PATH at a fresh database and migrate it."""
+    path = tmp_path / "messages.db"
+    monkeypatch.setenv("MESSAGES_DB_PATH", str(path))
+    # DB_PATH is read once at import; connections are kept per thread
+    monkeypatch.setattr(connection, "DB_PATH", path)
+    connection.close_connection()
+    migrate()
+    yield path
+    connection.close_connection()
+
+
+def make_messages(chat_id, ids, start_ms=1_700_000_000_000, step_ms=60_000, text="Сообщение номер {id}"):
+    """Message dicts as the ingester stores them, one per id, ``step_ms`` apart."""
+    return [
+        {
+            "id": message_id,
+            "chat_id": chat_id,
+            "sender": "Алиса",
+            "text": text.format(id=message_id),
+            "date": None,
+            "date_ms": start_ms + index * step_ms,
+        }
+        for index, message_id in enumerate(ids)
+    ]
@@ -0,0 +1,65 @@
+"""Summarizer queue leases: claim, complete, release and expiry."""
+from conftest import make_messages
+
+from db import claim_unsummarized, complete_claim, get_statistics, release_claim, save_messages
+
+
+def test_claim_is_chronological_and_exclusive(db_path):
+    # Stored out of order; media-only rows (empty text) are never claimed
+    save_messages(make_messages(1, [3, 1, 2]) + make_messages(2, [7], text=""))
+    token, messages = claim_unsummarized(limit=10)
+    assert [m["id"] for m in messages] == [3, 1, 2]
+    assert [m["date_ms"] for m in messages] == sorted(m["date_ms"] for m in messages)
+    # A concurrent worker gets nothing while the lease holds
+    other, rest = claim_unsummarized(limit=10)
+    assert other != token and rest == []
+
+
+def test_claim_respects_limit(db_path):
+    save_messages(make_messages(1, range(1, 6)))
+    _, first = claim_unsummarized(limit=2)
+    _, second = claim_unsummarized(limit=10)
+    assert [m["id"] for m in first] == [1, 2]
+    assert [m["id"] for m in second] == [3, 4, 5]
+
+
+def test_complete_marks_summarized(db_path):
+    save_messages(make_messages(1, [1, 2, 3]))
+    token, _ = claim_unsummarized(limit=2)
+    assert complete_claim(token) == 2
+    stats = get_statistics()
+    assert (stats["analyzed"], stats["unsummarized"]) == (2, 1)
+    # Completed rows never come back
+    _, messages = claim_unsummarized(limit=10)
+    assert [m["id"] for m in messages] == [3]
+
+
+def test_release_returns_to_queue(db_path):
+    save_messages(make_messages(1, [1, 2]))
+    token, _ = claim_unsummarized(limit=10)
+    assert release_claim(token) == 2
+    assert get_statistics()["analyzed"] == 0
+    _, messages = claim_unsummarized(limit=10)
+    assert [m["id"] for m in messages] == [1, 2]
+
+
+def test_expired_lease_is_taken_over(db_path):
+    save_messages(make_messages(1, [1, 2]))
+    # A worker that died: its lease is already over
+    stale_token, _ = claim_unsummarized(limit=10, lease_seconds=-1)
+    token, messages = claim_unsummarized(limit=10)
+    assert [m["id"] for m in messages] == [1, 2]
+    # The late worker can no longer complete or release the rows
+    assert complete_claim(stale_token) == 0
+    assert release_claim(stale_token) == 0
+    assert complete_claim(token) == 2
+
+
+def test_statistics_count_only_claimable_rows(db_path):
+    save_messages(make_messages(1, [1, 2]) + make_messages(1, [3], text=""))
+    stats = get_statistics()
+    assert (stats["total"], stats["unsummarized"], stats["percentage"]) == (3, 2, 0)
+    token, _ = claim_unsummarized(limit=10)
+    complete_claim(token)
+    stats = get_statistics(1)
+    assert (stats["unsummarized"], stats["percentage"]) == (0, 100)
@@ -0,0 +1,85 @@
+"""Two-tier completion cache: hits and misses, LRU eviction and TTL."""
+import time
+from types import SimpleNamespace
+
+import completion_cache
+from completion_cache import CompletionCache, cache_key
+
+
+def _messages(text):
+    return [{"role": "system", "content": "Выжимка"}, {"role": "user", "content": text}]
+
+
+def _result(content, tokens=10):
+    return {"content": content, "model": "GigaChat", "usage": {"total_tokens": tokens}}
+
+
+def test_key_ignores_formatting_only():
+    key = cache_key(_messages("Привет\r\nмир  "), "GigaChat")
+    assert key == cache_key(_messages("Привет\nмир"), "GigaChat")
+    assert key != cache_key(_messages("Привет мир"), "GigaChat")
+    assert key != cache_key(_messages("Привет\nмир"), "GigaChat-Pro")
+
+
+def test_memory_then_disk_hit(tmp_path):
+    path = tmp_path / "cache.db"
+    cache = CompletionCache(path)
+    assert cache.get("k") is None
+    cache.put("k", _result("ответ", tokens=42))
+    hit = cache.get("k")
+    assert hit == {"content": "ответ", "model": "GigaChat", "usage": {}, "cached": True}
+
+    # Another process (the CLI) only has the shared file
+    other = CompletionCache(path)
+    assert other.get("k")["content"] == "ответ"
+    assert other.get("k")["content"] == "ответ"
+    assert (other.metrics["disk_hits"], other.metrics["memory_hits"]) == (1, 1)
+    stats = cache.stats()
+    assert (stats["memory_hits"], stats["misses"], stats["tokens_saved"]) == (1, 1, 42)
+
+
+def test_memory_tier_is_lru():
+    cache = CompletionCache(memory_items=2)
+    cache.put("a", _result("a"))
+    cache.put("b", _result("b"))
+    cache.get("a")
+    cache.put("c", _result("c"))
+    # "b" was the least recently used; without a file it is gone
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path, monkeypatch):
+    clock = [1_000_000.0]
+    monkeypatch.setattr(completion_cache, "time", SimpleNamespace(time=lambda: clock[0]))
+    cache = CompletionCache(tmp_path / "cache.db", memory_items=1, max_bytes=7_000)
+    for name in "abcd":
+        clock[0] += 1
+        cache.put(name, _result(name * 3000))
+    clock[0] += 1
+    # Reading "a" makes it recent, so "b" and "c" go first
+    assert cache.get("a") is not None
+    assert cache.evict() == 2
+    assert cache.get("b") is None and cache.get("c") is None
+    assert cache.get("a") is not None and cache.get("d") is not None
+    assert cache.stats()["evicted"] == 2
+
+
+def test_expired_entries_are_ignored_and_deleted(tmp_path, monkeypatch):
+    clock = [time.time()]
+    monkeypatch.setattr(completion_cache, "time", SimpleNamespace(time=lambda: clock[0]))
+    cache = CompletionCache(tmp_path / "cache.db", max_age=60)
+    cache.put("k", _result("ответ"))
+    clock[0] += 61
+    # Neither tier serves it any more
+    assert cache.get("k") is None
+    assert cache.evict() == 1
+
+
+def test_broken_file_falls_back_to_memory(tmp_path):
+    path = tmp_path / "cache.db"
+    path.mkdir()
+    cache = CompletionCache(path)
+    cache.put("k", _result("ответ"))
+    assert cache.get("k")["content"] == "ответ"
+    assert cache.path is None
@@ -0,0 +1,102 @@
+"""Edits and deletions: rows change in place and covering summaries go stale."""
+from conftest import make_messages
+
+from connection import get_connection
+from db import (
+    claim_stale_summaries,
+    delete_messages,
+    delete_summary,
+    get_statistics,
+    release_stale_summaries,
+    replace_summary,
+    save_message_edits,
+    save_messages,
+    save_summary,
+)
+
+EDITED_MS = 1_800_000_000_000
+
+
+def _text(chat_id, message_id):
+    row = get_connection().execute(
+        "SELECT text FROM messages WHERE chat_id = ? AND id = ?", (chat_id, message_id)
+    ).fetchone()
+    return row["text"] if row else None
+
+
+def _stale(summary_id):
+    return get_connection().execute("SELECT stale FROM summaries WHERE id = ?", (summary_id,)).fetchone()["stale"]
+
+
+def _edit(message_id, text, edited_ms, chat_id=1):
+    return {**make_messages(chat_id, [message_id])[0], "text": text, "edited_ms": edited_ms}
+
+
+def test_edit_replaces_text_unless_older(db_path):
+    save_messages(make_messages(1, [1]))
+    assert save_message_edits([_edit(1, "Первая правка", EDITED_MS)]) == 1
+    # An out-of-order (older) edit and a repeated one change nothing
+    assert save_message_edits([_edit(1, "Старая правка", EDITED_MS - 1)]) == 0
+    assert save_message_edits([_edit(1, "Первая правка", EDITED_MS + 1)]) == 0
+    assert _text(1, 1) == "Первая правка"
+    # An edit of a message never seen stores it
+    assert save_message_edits([_edit(2, "Новое", EDITED_MS)]) == 1
+    assert get_statistics()["total"] == 2
+
+
+def test_edit_and_delete_make_only_covering_summaries_stale(db_path):
+    messages = make_messages(1, [1, 2, 3, 4])
+    save_messages(messages)
+    first = save_summary("Выжимка 1–2", messages[:2])
+    second = save_summary("Выжимка 3–4", messages[2:])
+
+    save_message_edits([_edit(1, "Исправлено", EDITED_MS)])
+    assert (_stale(first), _stale(second)) == (1, 0)
+    delete_messages([1], [4])
+    assert (_stale(first), _stale(second)) == (1, 1)
+    assert get_statistics()["stale_summaries"] == 2
+
+
+def test_refresh_cycle(db_path):
+    messages = make_messages(1, [1, 2])
+    save_messages(messages)
+    summary_id = save_summary("Выжимка", messages)
+    save_message_edits([_edit(2, "Исправлено", EDITED_MS)])
+
+    claimed = claim_stale_summaries(limit=5)
+    assert [item["id"] for item in claimed] == [summary_id]
+    assert [m["text"] for m in claimed[0]["messages"]] == ["Сообщение номер 1", "Исправлено"]
+    # Claimed summaries are not handed out twice
+    assert claim_stale_summaries(limit=5) == []
+
+    replace_summary(summary_id, "Новая выжимка", claimed[0]["messages"])
+    assert _stale(summary_id) == 0
+    assert get_statistics()["stale_summaries"] == 0
+
+
+def test_edit_during_refresh_keeps_summary_stale(db_path):
+    messages = make_messages(1, [1])
+    save_messages(messages)
+    summary_id = save_summary("Выжимка", messages)
+    save_message_edits([_edit(1, "Правка", EDITED_MS)])
+    claimed = claim_stale_summaries(limit=5)
+    # The message changes again while GigaChat works on the old text
+    save_message_edits([_edit(1, "Ещё правка", EDITED_MS + 1)])
+    replace_summary(summary_id, "Устаревшая выжимка", claimed[0]["messages"])
+    assert _stale(summary_id) == 1
+
+
+def test_release_and_fully_deleted_summary(db_path):
+    messages = make_messages(1, [1, 2])
+    save_messages(messages)
+    summary_id = save_summary("Выжимка", messages)
+    delete_messages([1, 2, 3], [1, 2])
+
+    claimed = claim_stale_summaries(limit=5)
+    # Nothing is left to summarize: the caller deletes the summary
+    assert claimed[0]["messages"] == []
+    release_stale_summaries([summary_id])
+    assert _stale(summary_id) == 1
+    delete_summary(summary_id)
+    stats = get_statistics()
+    assert (stats["total"], stats["summaries"], stats["stale_summaries"]) == (0, 0, 0)
@@ -0,0 +1,66 @@
+"""Schema migrations: concurrent startup and index-backed hot queries."""
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "telethon"))
+
+import migrations  # noqa: E402
+from connection import connect  # noqa: E402
+from migrations import MIGRATIONS, check_query_plans, current_version, migrate  # noqa: E402
+
+LATEST = max(number for number, _, _ in MIGRATIONS)
+
+
+def test_migrate_fresh_db(tmp_path):
+    conn = connect(tmp_path / "messages.db")
+    assert migrate(conn) == LATEST
+    # A second start has nothing to do
+    assert migrate(conn) == LATEST
+    assert current_version(conn) == LATEST
+
+
+def test_hot_queries_use_indexes(tmp_path):
+    conn = connect(tmp_path / "messages.db")
+    migrate(conn)
+    assert check_query_plans(conn) == []
+
+
+def test_concurrent_migrate(tmp_path, monkeypatch):
+    """Processes starting together (bot, ingester, dashboards) must not fail."""
+    path = tmp_path / "messages.db"
+    number, name, func = min(MIGRATIONS, key=lambda m: m[0])
+
+    def slow(conn):
+        # Hold the write lock long enough for the others to read version 0
+        time.sleep(0.2)
+        func(conn)
+
+    patched = [(number, name, slow) if m[0] == number else m for m in MIGRATIONS]
+    monkeypatch.setattr(migrations, "MIGRATIONS", patched)
+    # An existing DB: schema_version is there, so nothing serializes the reads
+    current_version(connect(path))
+    barrier = threading.Barrier(4)
+    errors = []
+
+    def start():
+        conn = connect(path)
+        barrier.wait()
+        try:
+            migrate(conn)
+        except Exception as exc:  # pragma: no cover - reported below
+            errors.append(exc)
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=start) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    conn = connect(path)
+    rows = conn.execute("SELECT version FROM schema_version ORDER BY version").fetchall()
+    assert [row["version"] for row in rows] == sorted(number for number, _, _ in MIGRATIONS)
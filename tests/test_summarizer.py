@@ -0,0 +1,94 @@
+"""Map-reduce summarization: chunk packing, splitting and the token budget."""
+import threading
+
+import pytest
+
+pytest.importorskip("requests")
+
+import summarizer  # noqa: E402
+from gigachat import GigaChatError  # noqa: E402
+from summarizer import SEPARATOR, estimate_tokens, pack_chunks, split_text, summarize_large  # noqa: E402
+
+BUDGET = 100
+
+
+class FakeClient:
+    """Records every request; each answer is ``answer(user_text)``."""
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def chat(self, messages):
+        text = messages[-1]["content"]
+        with self._lock:
+            self.requests.append((messages[0]["content"], text))
+        return {"content": self.answer(text), "model": "fake", "usage": {"total_tokens": estimate_tokens(text)}}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    fake = FakeClient(lambda text: f"Итог: {text[:30]}")
+    monkeypatch.setattr(summarizer, "get_client", lambda: fake)
+    return fake
+
+
+def test_split_text_prefers_line_breaks():
+    lines = [f"строка {i} " + "слово " * 20 for i in range(10)]
+    pieces = split_text("\n".join(lines), 60)
+    assert len(pieces) > 1
+    assert all(estimate_tokens(piece) <= 60 for piece in pieces)
+    # Cut at line breaks, so every piece starts with a whole line
+    assert all(piece.startswith("строка") for piece in pieces)
+    assert "".join(pieces).replace("\n", "") == "".join(lines)
+
+
+def test_pack_chunks_keeps_order_within_budget():
+    parts = [f"сообщение {i}: " + "текст " * (i % 7 * 5) for i in range(40)]
+    chunks = pack_chunks(parts, BUDGET)
+    assert len(chunks) > 1
+    assert all(estimate_tokens(chunk) <= BUDGET for chunk in chunks)
+    assert [part for chunk in chunks for part in chunk.split(SEPARATOR)] == parts
+
+
+def test_pack_chunks_splits_oversized_part():
+    huge = "слово " * 1000
+    chunks = pack_chunks(["до", huge, "после"], BUDGET)
+    assert all(estimate_tokens(chunk) <= BUDGET for chunk in chunks)
+    assert chunks[0].startswith("до") and chunks[-1].endswith("после")
+
+
+def test_small_backlog_is_one_request(client):
+    result = summarize_large(["первое", "второе"], budget=BUDGET)
+    assert (result["chunks"], result["levels"]) == (1, 0)
+    assert len(client.requests) == 1
+
+
+def test_every_request_fits_the_budget(client):
+    parts = [f"сообщение {i}: " + "текст " * 30 for i in range(60)]
+    progress = []
+    result = summarize_large(parts, budget=BUDGET, on_progress=lambda *args: progress.append(args))
+    assert result["chunks"] > 1 and result["levels"] >= 1
+    assert all(estimate_tokens(text) <= BUDGET for _, text in client.requests)
+    # Map requests use the summary prompt, the rest merge partial summaries
+    prompts = [prompt for prompt, _ in client.requests]
+    assert prompts.count(summarizer.SUMMARY_SYSTEM_PROMPT) == result["chunks"]
+    assert set(prompts[result["chunks"]:]) == {summarizer.MERGE_SYSTEM_PROMPT}
+    assert result["usage"]["total_tokens"] == sum(estimate_tokens(text) for _, text in client.requests)
+    assert ("map", result["chunks"], result["chunks"]) in progress
+
+
+def test_long_partial_summaries_are_condensed_within_budget(monkeypatch):
+    # Partial summaries too long to share a chunk are merged one by one first
+    fake = FakeClient(lambda text: text[: len(text) * 3 // 4])
+    monkeypatch.setattr(summarizer, "get_client", lambda: fake)
+    summarize_large(["текст " * 40 for _ in range(8)], budget=BUDGET)
+    assert all(estimate_tokens(text) <= BUDGET for _, text in fake.requests)
+
+
+def test_merges_that_do_not_shrink_fail(monkeypatch):
+    fake = FakeClient(lambda text: text)
+    monkeypatch.setattr(summarizer, "get_client", lambda: fake)
+    with pytest.raises(GigaChatError):
+        summarize_large(["текст " * 40 for _ in range(8)], budget=BUDGET)
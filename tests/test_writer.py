@@ -0,0 +1,106 @@
+"""Write-behind writer: flush barriers, retries and changes that cannot be stored."""
+import asyncio
+import sqlite3
+
+import pytest
+from conftest import make_messages
+
+import writer
+from connection import get_connection
+from writer import MAX_BATCH_RETRIES, MessageWriter
+
+# Missing the sender/text/date bindings: fails on its own, every time
+POISON = {"id": 13, "chat_id": 1}
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(writer, "RETRY_DELAY", 0.001)
+
+
+def _stored_ids():
+    return [row["id"] for row in get_connection().execute("SELECT id FROM messages ORDER BY id")]
+
+
+async def _flush_until_stored(message_writer, error, attempts):
+    for _ in range(attempts):
+        try:
+            return await message_writer.flush()
+        except error:
+            continue
+    raise AssertionError("changes were never stored")
+
+
+def test_flush_waits_for_queued_changes(db_path):
+    async def main():
+        message_writer = MessageWriter(batch_size=100, flush_ms=10_000)
+        await message_writer.start()
+        for message in make_messages(1, [1, 2, 3]):
+            await message_writer.put(message)
+        await message_writer.put_edit({**make_messages(1, [2])[0], "text": "Правка", "edited_ms": 1})
+        await message_writer.put_delete([1], [3])
+        # Returns long before flush_ms: the barrier cuts the batch short
+        await asyncio.wait_for(message_writer.flush(), 5)
+        assert _stored_ids() == [1, 2]
+        text = get_connection().execute("SELECT text FROM messages WHERE id = 2").fetchone()["text"]
+        assert text == "Правка"
+        await message_writer.close()
+        return message_writer.written
+
+    assert asyncio.run(main()) == 3
+
+
+def test_change_that_cannot_be_stored_is_dropped(db_path):
+    async def main():
+        message_writer = MessageWriter(batch_size=100, flush_ms=10)
+        await message_writer.start()
+        for message in make_messages(1, [10, 11]) + [POISON] + make_messages(1, [14]):
+            await message_writer.put(message)
+        # The whole batch fails until it is stored change by change
+        await _flush_until_stored(message_writer, sqlite3.ProgrammingError, MAX_BATCH_RETRIES + 1)
+        assert _stored_ids() == [10, 11, 14]
+        # The writer is not wedged: newer changes go through
+        await message_writer.put(make_messages(1, [20])[0])
+        await message_writer.flush()
+        await message_writer.close()
+        assert _stored_ids() == [10, 11, 14, 20]
+
+    asyncio.run(main())
+
+
+def test_outage_is_retried_without_dropping(db_path, monkeypatch):
+    failures = [3 * MAX_BATCH_RETRIES]
+    apply = writer.apply_message_changes
+
+    def flaky(*args):
+        if failures[0]:
+            failures[0] -= 1
+            raise sqlite3.OperationalError("database is locked")
+        return apply(*args)
+
+    monkeypatch.setattr(writer, "apply_message_changes", flaky)
+
+    async def main():
+        message_writer = MessageWriter(batch_size=100, flush_ms=10)
+        await message_writer.start()
+        for message in make_messages(1, [1, 2, 3]):
+            await message_writer.put(message)
+        await _flush_until_stored(message_writer, sqlite3.OperationalError, 4 * MAX_BATCH_RETRIES)
+        await message_writer.close()
+        return message_writer.written
+
+    assert asyncio.run(main()) == 3
+    assert failures == [0]
+    assert _stored_ids() == [1, 2, 3]
+
+
+def test_close_stores_what_it_can(db_path):
+    async def main():
+        message_writer = MessageWriter(batch_size=100, flush_ms=10_000)
+        await message_writer.start()
+        for message in make_messages(1, [1]) + [POISON] + make_messages(1, [2]):
+            await message_writer.put(message)
+        await message_writer.close()
+
+    asyncio.run(main())
+    assert _stored_ids() == [1, 2]